@@ -1,13 +1,25 @@
 import os
+import json
+import shutil
 import asyncio
-import requests
 import time
-import shutil
+import sqlite3
+import hashlib
+import tempfile
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from telethon import TelegramClient
-from telethon import functions, types
+from telethon import functions, types, errors
 from telethon.tl.types import InputChatUploadedPhoto
 import random
+import media_index
+import layout
+import ledger
+import anilist
+import media
+import telemetry
+import metrics
+import disk_budget
 
 # Get the directory where the script is located
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -18,6 +30,127 @@ DONE_PATH = os.path.join(SCRIPT_DIR, "done")  # Create 'done' folder in script d
 API_ID = 20509864  # Replace with your actual API ID
 API_HASH = '11905c7c10752429a01ceb1b2c42a993'  # Replace with your actual API Hash
 
+# Telethon sleeps through FloodWaits under its threshold (60s by default) without
+# raising; 0 makes every FloodWait reach RateLimiter, which slows the action down
+FLOOD_SLEEP_THRESHOLD = 0
+
+# Parallel upload settings
+UPLOAD_PARTS_IN_FLIGHT = 4              # File parts awaiting Telegram's reply at once (one MTProto connection)
+UPLOAD_PART_SIZE = 512 * 1024           # Telegram's maximum part size
+BIG_FILE_THRESHOLD = 10 * 1024 * 1024   # Files above this use the "big file" API
+UPLOAD_PART_RETRIES = 3                 # Attempts per part before the upload fails
+UPLOAD_STATE_SAVE_INTERVAL = 5          # Seconds between saves of confirmed parts
+
+# Telegram no longer has (all) the parts of a saved upload; str() of these is
+# human-readable text, so they have to be matched by type
+FILE_PART_ERRORS = (
+    errors.FilePartMissingError,
+    errors.FilePartsInvalidError,
+    errors.FilePartInvalidError,
+    errors.FilePartEmptyError,
+)
+
+# Token bucket per Telegram action: (requests per second, burst size)
+# These only pace us between FloodWaits; the server's FloodWait durations always win
+RATE_LIMITS = {
+    'create_channel': (1 / 30, 1),
+    'update_username': (1 / 5, 2),
+    'edit_photo': (1 / 5, 2),
+    'send_message': (1, 3),
+    'upload_part': (100, 100),
+}
+RATE_RECOVERY_FACTOR = 1.25   # Rate multiplier per success while recovering from a FloodWait
+RATE_MIN_FACTOR = 0.1         # Never slow an action below this share of its base rate
+FLOOD_WAIT_MAX_RETRIES = 5    # FloodWaits tolerated for a single call
+
+# Concurrency settings
+FOLDER_CONCURRENCY = 3        # Anime folders (channels) processed at the same time
+MAX_CONCURRENT_UPLOADS = 2    # Videos uploading at once across all folders
+
+# Pre-upload video metadata (duration, dimensions, thumbnail)
+METADATA_WORKERS = 4          # ffprobe/ffmpeg jobs run in parallel
+THUMBNAIL_DIR = os.path.join(tempfile.gettempdir(), "anime_upload_thumbs")
+
+# Oversized episodes are cut (stream copy, keyframe-aligned) into parts below this size
+MAX_UPLOAD_BYTES = int(1.9 * 1024**3)   # Telegram limit is ~2GB
+PARTS_DIR_NAME = '.parts'               # Per-folder scratch dir for the parts, removed once uploaded
+PARTS_MANIFEST = 'parts.json'           # Which parts exist and which are already uploaded
+
+class RateLimiter:
+    """
+    Central token-bucket limiter for Telegram actions.
+    FloodWaitError durations are honoured exactly and block the whole action
+    (for every coroutine using it); the action's rate is then halved and
+    ramps back up to its base rate with each successful call.
+    """
+    
+    def __init__(self, limits):
+        now = time.monotonic()
+        self.buckets = {
+            action: {
+                'base_rate': rate,
+                'rate': rate,
+                'capacity': burst,
+                'tokens': burst,
+                'updated': now,
+                'blocked_until': 0,
+            }
+            for action, (rate, burst) in limits.items()
+        }
+        self.lock = asyncio.Lock()
+    
+    async def acquire(self, action):
+        """Wait until the action may run"""
+        bucket = self.buckets[action]
+        while True:
+            async with self.lock:
+                now = time.monotonic()
+                bucket['tokens'] = min(bucket['capacity'],
+                                       bucket['tokens'] + (now - bucket['updated']) * bucket['rate'])
+                bucket['updated'] = now
+                if now >= bucket['blocked_until'] and bucket['tokens'] >= 1:
+                    bucket['tokens'] -= 1
+                    return
+                wait_time = max(bucket['blocked_until'] - now, (1 - bucket['tokens']) / bucket['rate'])
+            await asyncio.sleep(wait_time)
+    
+    def on_flood_wait(self, action, seconds):
+        """Block the action for the server-given time and back off its rate"""
+        bucket = self.buckets[action]
+        bucket['blocked_until'] = max(bucket['blocked_until'], time.monotonic() + seconds)
+        bucket['rate'] = max(bucket['base_rate'] * RATE_MIN_FACTOR, bucket['rate'] / 2)
+        bucket['tokens'] = 0
+    
+    def on_success(self, action):
+        """Ramp the action's rate back up after a FloodWait cleared"""
+        bucket = self.buckets[action]
+        if bucket['rate'] < bucket['base_rate']:
+            bucket['rate'] = min(bucket['base_rate'], bucket['rate'] * RATE_RECOVERY_FACTOR)
+    
+    async def call(self, action, make_request):
+        """
+        Run make_request() (a coroutine factory) under the action's limit,
+        waiting out FloodWaits exactly as long as the server asks
+        """
+        for attempt in range(FLOOD_WAIT_MAX_RETRIES + 1):
+            await self.acquire(action)
+            try:
+                result = await make_request()
+            except errors.FloodWaitError as e:
+                if attempt == FLOOD_WAIT_MAX_RETRIES:
+                    raise
+                print(f"⏳ FloodWait on {action}: waiting exactly {e.seconds}s as requested by Telegram")
+                self.on_flood_wait(action, e.seconds)
+                continue
+            self.on_success(action)
+            return result
+
+# Shared by every coroutine talking to Telegram
+rate_limiter = RateLimiter(RATE_LIMITS)
+
+# Global cap on simultaneous video uploads, whichever folder they belong to
+upload_slots = asyncio.Semaphore(MAX_CONCURRENT_UPLOADS)
+
 def generate_username(channel_name, suffix=None):
     """Generate username from channel name with multiple fallback options"""
     if suffix is None:
@@ -47,64 +180,24 @@ def generate_username(channel_name, suffix=None):
     
     return final_username
 
-def search_anime_poster(anime_name):
+async def search_anime_poster(anime_name):
     """
     Search for anime poster using AniList GraphQL API
     Returns image URL if found, None otherwise
     """
     try:
-        # GraphQL query for AniList API
-        query = '''
-        query ($search: String) {
-            Media (search: $search, type: ANIME) {
-                title {
-                    romaji
-                    english
-                }
-                coverImage {
-                    large
-                    extraLarge
-                }
-            }
-        }
-        '''
-        
-        variables = {'search': anime_name}
-        
-        response = requests.post(
-            'https://graphql.anilist.co',
-            json={'query': query, 'variables': variables},
-            timeout=10
-        )
-        response.raise_for_status()
-        
-        data = response.json()
-        
-        if (data.get('data') and 
-            data['data'].get('Media') and 
-            data['data']['Media'].get('coverImage')):
-            
-            # Prefer extraLarge, fall back to large
-            image_url = (data['data']['Media']['coverImage'].get('extraLarge') or 
-                        data['data']['Media']['coverImage'].get('large'))
-            return image_url
-            
+        return await anilist.get_client().search_poster(anime_name)
     except Exception as e:
         print(f"Error searching for {anime_name}: {e}")
     
     return None
 
-def download_image(img_url, folder_path, anime_name):
+async def download_image(img_url, folder_path, anime_name):
     """
     Download image from URL and save to folder
     """
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        
-        response = requests.get(img_url, headers=headers, timeout=15)
-        response.raise_for_status()
+        content = await anilist.get_client().fetch_poster(img_url)
         
         # Determine file extension from URL or Content-Type
         if '.' in img_url:
@@ -117,13 +210,11 @@ def download_image(img_url, folder_path, anime_name):
             # Default to jpg if cannot determine
             file_extension = 'jpg'
         
-        # Clean anime name for filename
-        clean_name = "".join(c for c in anime_name if c.isalnum() or c in (' ', '-', '_')).rstrip()
         filename = f"poster.{file_extension}"
         filepath = os.path.join(folder_path, filename)
         
         with open(filepath, 'wb') as f:
-            f.write(response.content)
+            f.write(content)
         
         print(f"✓ Downloaded poster for: {anime_name}")
         return filepath
@@ -157,29 +248,24 @@ def get_anime_folders():
 
 def get_video_files(folder_path):
     """
-    Get all video files from a folder with size checking
+    Get all video files from a folder with size checking, in episode order
+    Files over the Telegram limit are kept; they are uploaded in parts
     """
-    video_extensions = ['.mp4', '.mkv', '.avi', '.mov', '.wmv', '.flv', '.webm']
     video_files = []
     
     try:
-        for file in os.listdir(folder_path):
-            file_path = os.path.join(folder_path, file)
-            if os.path.isfile(file_path) and any(file.lower().endswith(ext) for ext in video_extensions):
-                file_size = os.path.getsize(file_path)
-                file_size_gb = file_size / (1024*1024*1024)
+        # Shares comb.py's folder index: one scandir pass, natural episode order
+        for entry in media_index.get_folder_index(folder_path).get_videos():
+            file_size_gb = entry['size'] / (1024*1024*1024)
+            
+            # Check if file is too large for Telegram
+            if entry['size'] > MAX_UPLOAD_BYTES:
+                print(f"⚠️ File too large for Telegram: {entry['name']} ({file_size_gb:.2f} GB), it will be split into parts")
                 
-                # Check if file is too large for Telegram
-                if file_size_gb > 1.9:  # Telegram limit is ~2GB
-                    print(f"⚠️ File too large for Telegram: {file} ({file_size_gb:.2f} GB)")
-                    continue
-                    
-                video_files.append(file_path)
+            video_files.append(entry['path'])
     except Exception as e:
         print(f"Error reading video files from {folder_path}: {e}")
     
-    # Sort files naturally (episode 1, episode 2, etc.)
-    video_files.sort()
     return video_files
 
 async def create_public_telegram_channel(client, channel_name):
@@ -200,11 +286,11 @@ async def create_public_telegram_channel(client, channel_name):
     try:
         # Step 1: Create the channel (initially private)
         print("Creating channel...")
-        result = await client(functions.channels.CreateChannelRequest(
+        result = await rate_limiter.call('create_channel', lambda: client(functions.channels.CreateChannelRequest(
             title=channel_name,
             about=f"This is {channel_name} anime channel",
             megagroup=False,  # False for broadcast channel
-        ))
+        )))
         
         channel = result.chats[0]
         print(f"✅ Channel created successfully! (Currently private)")
@@ -215,10 +301,10 @@ async def create_public_telegram_channel(client, channel_name):
         max_attempts = 5
         for attempt in range(max_attempts):
             try:
-                await client(functions.channels.UpdateUsernameRequest(
+                await rate_limiter.call('update_username', lambda: client(functions.channels.UpdateUsernameRequest(
                     channel=channel.id,
                     username=channel_username
-                ))
+                )))
                 
                 print(f"🌐 Channel is now public!")
                 print(f"🔗 Channel Link: https://t.me/{channel_username}")
@@ -245,53 +331,254 @@ async def upload_channel_photo(client, channel, image_path):
     """
     try:
         print(f"🖼️ Uploading channel photo...")
-        await client(functions.channels.EditPhotoRequest(
+        photo = await client.upload_file(image_path)
+        await rate_limiter.call('edit_photo', lambda: client(functions.channels.EditPhotoRequest(
             channel=channel.id,
-            photo=await client.upload_file(image_path)
-        ))
+            photo=photo
+        )))
         print(f"✅ Channel photo set successfully!")
         return True
     except Exception as e:
         print(f"❌ Error setting channel photo: {e}")
         return False
 
-async def upload_videos_to_channel(client, channel, folder_path):
+def get_episode_key(video_file):
+    """Ledger key (series, episode) for a video inside an anime folder"""
+    return layout.get_series_key(video_file), media_index.extract_episode_number(os.path.basename(video_file))
+
+def is_already_uploaded(video_file):
     """
-    Upload all video files from folder to channel with retry logic and progress monitoring
+    Check the ledger for a video a previous run already uploaded
+    The (series, episode) row is checked first; a file that has been moved away
+    since (to done/) counts as uploaded, one that is still here must be unchanged
     """
-    video_files = get_video_files(folder_path)
+    series, episode = get_episode_key(video_file)
+    if episode is None:
+        return False
+    try:
+        row = ledger.get_ledger().get(series, episode)
+    except sqlite3.Error:
+        return False
+    if not ledger.has_reached(row, 'uploaded'):
+        return False
+    return not os.path.exists(video_file) or ledger.is_file_current(row, video_file)
+
+def record_upload(video_file, upload_time):
+    """Record a finished upload in the ledger"""
+    series, episode = get_episode_key(video_file)
+    if episode is None:
+        return
+    try:
+        ledger.get_ledger().record(series, episode, 'uploaded', path=video_file, seconds=upload_time)
+    except sqlite3.Error as e:
+        print(f"⚠️ Could not update ledger: {e}")
+
+async def parallel_upload_file(client, file_path, progress_callback=None,
+                               parts_in_flight=UPLOAD_PARTS_IN_FLIGHT, part_size=UPLOAD_PART_SIZE):
+    """
+    Upload a file's parts with several requests in flight instead of one part at a time.
+    They share the client's single MTProto connection: this hides the round trip of
+    each part, it does not add bandwidth the way separate connections would.
+    Confirmed parts are saved in the ledger, so a retry or a restart of the script
+    resends only the missing parts under the same file id.
+    progress_callback(current, total) follows Telethon's contract.
+    Returns an InputFile/InputFileBig handle that can be passed to send_file.
+    """
+    file_size = os.path.getsize(file_path)
+    total_parts = max(1, (file_size + part_size - 1) // part_size)
+    is_big = file_size > BIG_FILE_THRESHOLD
+    file_name = os.path.basename(file_path)
+    
+    # Continue a previous partial upload of this exact file if Telegram should still have its parts
+    try:
+        upload_state = ledger.get_ledger().get_upload_state(file_path, part_size)
+    except sqlite3.Error:
+        upload_state = None
+    if upload_state and upload_state['total_parts'] == total_parts:
+        file_id = upload_state['file_id']
+        confirmed_parts = upload_state['parts']
+        print(f"♻️ Resuming upload of {file_name}: {len(confirmed_parts)}/{total_parts} parts already sent")
+    else:
+        file_id = random.getrandbits(63)
+        confirmed_parts = set()
+    
+    part_queue = asyncio.Queue()
+    for part_index in range(total_parts):
+        if part_index not in confirmed_parts:
+            part_queue.put_nowait(part_index)
+    
+    last_part_size = file_size - (total_parts - 1) * part_size
+    uploaded_bytes = sum(last_part_size if i == total_parts - 1 else part_size for i in confirmed_parts)
+    if progress_callback and uploaded_bytes:
+        progress_callback(uploaded_bytes, file_size)
+    
+    last_save = time.time()
+    
+    def save_upload_state():
+        try:
+            ledger.get_ledger().save_upload_state(file_path, file_id, part_size, total_parts, confirmed_parts)
+        except (sqlite3.Error, OSError) as e:
+            print(f"⚠️ Could not save upload state: {e}")
+    
+    async def sender():
+        nonlocal uploaded_bytes, last_save
+        # Each sender reads through its own file handle so seeks don't race
+        with open(file_path, 'rb') as f:
+            while True:
+                try:
+                    part_index = part_queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                
+                f.seek(part_index * part_size)
+                part = f.read(part_size)
+                if is_big:
+                    request = functions.upload.SaveBigFilePartRequest(file_id, part_index, total_parts, part)
+                else:
+                    request = functions.upload.SaveFilePartRequest(file_id, part_index, part)
+                
+                for attempt in range(UPLOAD_PART_RETRIES):
+                    try:
+                        if not await rate_limiter.call('upload_part', lambda: client(request)):
+                            raise RuntimeError(f"Telegram rejected part {part_index}")
+                        break
+                    except Exception:
+                        if attempt == UPLOAD_PART_RETRIES - 1:
+                            raise
+                        await asyncio.sleep(2 ** attempt)
+                
+                confirmed_parts.add(part_index)
+                uploaded_bytes += len(part)
+                if progress_callback:
+                    progress_callback(uploaded_bytes, file_size)
+                
+                if time.time() - last_save >= UPLOAD_STATE_SAVE_INTERVAL:
+                    last_save = time.time()
+                    save_upload_state()
+    
+    senders = [asyncio.ensure_future(sender()) for _ in range(max(1, min(parts_in_flight, part_queue.qsize())))]
+    try:
+        await asyncio.gather(*senders)
+    except Exception:
+        for task in senders:
+            task.cancel()
+        raise
+    finally:
+        # Whatever happened, remember what Telegram already has
+        save_upload_state()
     
+    if is_big:
+        return types.InputFileBig(id=file_id, parts=total_parts, name=file_name)
+    return types.InputFile(id=file_id, parts=total_parts, name=file_name, md5_checksum='')
+
+def get_video_metadata(video_file):
+    """
+    Probe a video and extract its thumbnail so send_file can pass real attributes.
+    Returns a dict with duration, width, height and thumb (a JPEG path or None).
+    """
+    metadata = {'duration': 0, 'width': 0, 'height': 0, 'thumb': None}
+    probe = media.probe_media(video_file)
+    if probe:
+        metadata['duration'] = probe['duration'] or 0
+        metadata['width'] = probe['width'] or 0
+        metadata['height'] = probe['height'] or 0
+    
+    os.makedirs(THUMBNAIL_DIR, exist_ok=True)
+    thumb_name = hashlib.sha1(os.path.abspath(video_file).encode('utf-8')).hexdigest() + '.jpg'
+    metadata['thumb'] = media.extract_thumbnail(video_file, os.path.join(THUMBNAIL_DIR, thumb_name),
+                                                metadata['duration'])
+    return metadata
+
+async def prepare_video_metadata(video_files):
+    """
+    Get metadata for many videos with a pool of ffprobe/ffmpeg workers
+    Returns {video_file: metadata}
+    """
     if not video_files:
-        print("❌ No video files found in the folder!")
-        return 0
+        return {}
     
-    print(f"🎬 Found {len(video_files)} video files to upload")
+    print(f"🖼️ Preparing thumbnails and attributes for {len(video_files)} video(s)...")
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers=METADATA_WORKERS) as pool:
+        results = await asyncio.gather(*(
+            loop.run_in_executor(pool, get_video_metadata, video_file) for video_file in video_files
+        ), return_exceptions=True)
     
-    uploaded_count = 0
-    for i, video_file in enumerate(video_files, 1):
+    metadata = {}
+    for video_file, result in zip(video_files, results):
+        if isinstance(result, Exception):
+            print(f"⚠️ Could not read metadata of {os.path.basename(video_file)}: {result}")
+            continue
+        metadata[video_file] = result
+    return metadata
+
+def remove_thumbnail(metadata):
+    """Delete a thumbnail made by get_video_metadata"""
+    if metadata and metadata.get('thumb') and os.path.exists(metadata['thumb']):
+        try:
+            os.remove(metadata['thumb'])
+        except OSError:
+            pass
+
+def clear_upload_state(video_file):
+    """Forget a file's saved partial upload"""
+    try:
+        ledger.get_ledger().clear_upload_state(video_file)
+    except sqlite3.Error:
+        pass
+
+async def upload_video_file(client, channel, video_file, index=1, total_files=1, metadata=None,
+                            caption=None, source_file=None):
+    """
+    Upload a single video file to the channel with retry logic and progress monitoring
+    metadata comes from get_video_metadata; it is computed here when not given
+    source_file is the episode a part belongs to: the ledger is then left to the caller
+    and metrics are recorded under that episode
+    Returns True if the upload succeeded (or the ledger shows it already did)
+    """
+    if source_file is None and is_already_uploaded(video_file):
+        print(f"⏭️ Already uploaded (ledger): {os.path.basename(video_file)}")
+        return True
+    
+    if metadata is None:
+        metadata = await asyncio.to_thread(get_video_metadata, video_file)
+    try:
+        # Real duration/dimensions and a thumb make the video streamable with a preview right away
+        video_attributes = None
+        if metadata['width'] and metadata['height']:
+            video_attributes = [types.DocumentAttributeVideo(
+                duration=int(metadata['duration']),
+                w=metadata['width'],
+                h=metadata['height'],
+                supports_streaming=True
+            )]
+    
+        upload_estimator = telemetry.get_estimator('upload')
         max_retries = 3
         for attempt in range(max_retries):
+            start_time = time.time()
             try:
                 # Get caption from filename (without extension)
-                caption = os.path.splitext(os.path.basename(video_file))[0]
+                caption = caption or os.path.splitext(os.path.basename(video_file))[0]
                 file_size_gb = os.path.getsize(video_file) / (1024*1024*1024)
-                
-                print(f"⬆️ Uploading ({i}/{len(video_files)}): {caption}")
+
+                print(f"⬆️ Uploading ({index}/{total_files}): {caption}")
                 print(f"📊 File size: {file_size_gb:.2f} GB")
-                
+
                 # Progress tracking variables
                 start_time = time.time()
                 last_progress = 0
                 last_time = start_time
                 uploaded_bytes = 0
-                
+
                 def progress_callback(current, total):
                     nonlocal last_progress, last_time, uploaded_bytes
                     current_time = time.time()
                     uploaded_bytes = current
-                    
+                    upload_estimator.update(video_file, current)
+
                     percent = (current / total) * 100 if total > 0 else 0
-                    
+
                     # Calculate speed every 5 seconds or when significant progress is made
                     time_diff = current_time - last_time
                     if time_diff >= 5 or current == total:  # Update every 5 seconds or at completion
@@ -299,7 +586,7 @@ async def upload_videos_to_channel(client, channel, folder_path):
                         if time_diff > 0:
                             speed_mbps = (progress_diff * 8) / (time_diff * 1000000)  # Convert to Mbps
                             speed_mbps_display = min(speed_mbps, 1000)  # Cap display at 1000 Mbps
-                            
+
                             time_elapsed = current_time - start_time
                             if current > 0 and current < total:
                                 # Estimate remaining time
@@ -312,80 +599,237 @@ async def upload_videos_to_channel(client, channel, folder_path):
                                     remaining_time = " | ETA: Calculating..."
                             else:
                                 remaining_time = ""
-                            
-                            print(f"📤 Progress: {percent:.1f}% | Speed: {speed_mbps_display:.2f} Mbps{remaining_time}", end='\r')
-                        
+
+                            print(f"📤 {caption}: {percent:.1f}% | Speed: {speed_mbps_display:.2f} Mbps{remaining_time}", end='\r')
+
                         last_progress = current
                         last_time = current_time
+
+                async with upload_slots:
+                    # Don't count time spent waiting for a free upload slot
+                    start_time = last_time = time.time()
+                    # Every attempt starts a fresh baseline (resumed parts were sent earlier)
+                    upload_estimator.finish(video_file)
                 
-                # Upload the video file with progress callback
-                await client.send_file(
-                    entity=channel.id,
-                    file=video_file,
-                    caption=caption,
-                    supports_streaming=True,
-                    progress_callback=progress_callback
-                )
-                
+                    # Upload the parts in parallel, then attach the uploaded handle to the message
+                    uploaded_file = await parallel_upload_file(client, video_file, progress_callback)
+                    await rate_limiter.call('send_message', lambda: client.send_file(
+                        entity=channel.id,
+                        file=uploaded_file,
+                        caption=caption,
+                        attributes=video_attributes,
+                        thumb=metadata['thumb'],
+                        supports_streaming=True
+                    ))
+
                 upload_time = time.time() - start_time
                 speed_gb_h = (file_size_gb / (upload_time / 3600)) if upload_time > 0 else 0
-                
-                uploaded_count += 1
+                clear_upload_state(video_file)
+
+                upload_estimator.finish(video_file)
                 print(f"\n✅ Uploaded: {caption} in {upload_time:.1f}s ({speed_gb_h:.2f} GB/h)")
-                
-                break  # Success, break out of retry loop
-                
+                if source_file is None:
+                    record_upload(video_file, upload_time)
+                series, episode = get_episode_key(source_file or video_file)
+                metrics.record_stage('upload', upload_time, series, episode,
+                                     nbytes=metrics.get_file_size(video_file), retries=attempt)
+
+                return True
+
             except Exception as e:
+                series, episode = get_episode_key(source_file or video_file)
+                metrics.record_stage('upload', time.time() - start_time, series, episode, retries=attempt, error=e)
+                if isinstance(e, FILE_PART_ERRORS):
+                    # Telegram no longer has (all) the saved parts, start this file over
+                    clear_upload_state(video_file)
                 if attempt < max_retries - 1:
                     wait_time = (attempt + 1) * 30  # 30, 60, 90 seconds
                     print(f"⚠️ Upload failed, retrying in {wait_time}s... (Attempt {attempt + 1}/{max_retries})")
                     await asyncio.sleep(wait_time)
                 else:
                     print(f"❌ Failed to upload {video_file} after {max_retries} attempts: {e}")
-        
-        # Increased delay between uploads
-        if i < len(video_files):
-            delay = random.uniform(10, 30)  # 10-30 second delay
-            print(f"⏳ Waiting {delay:.1f} seconds before next upload...")
-            await asyncio.sleep(delay)
     
-    print(f"🎉 Upload completed! {uploaded_count}/{len(video_files)} videos uploaded successfully")
-    return uploaded_count
+        return False
+    finally:
+        # Skipped, failed or cancelled: never leave the thumbnail in the shared temp dir
+        remove_thumbnail(metadata)
+
+def get_parts_dir(video_file):
+    """Scratch folder for the parts of an oversized video (next to it, so moves stay renames)"""
+    stem = os.path.splitext(os.path.basename(video_file))[0]
+    return os.path.join(os.path.dirname(os.path.abspath(video_file)), PARTS_DIR_NAME, stem)
+
+def load_parts_manifest(video_file):
+    """Manifest of an earlier split of this exact file, or None"""
+    manifest_path = os.path.join(get_parts_dir(video_file), PARTS_MANIFEST)
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        stat = os.stat(video_file)
+        if manifest['size'] != stat.st_size or manifest['mtime'] != stat.st_mtime_ns:
+            return None
+        if not all(os.path.exists(part) for part in manifest['parts']):
+            return None
+        return manifest
+    except (OSError, ValueError, KeyError):
+        return None
+
+def save_parts_manifest(video_file, manifest):
+    """Write the parts manifest atomically"""
+    manifest_path = os.path.join(get_parts_dir(video_file), PARTS_MANIFEST)
+    temp_path = manifest_path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(temp_path, manifest_path)
 
-async def test_upload_speed(client, channel):
-    """Test upload speed with a small file"""
-    test_file = "test_upload.bin"
+def split_video_file(video_file):
+    """
+    Split an oversized video into parts Telegram accepts, reusing an earlier split
+    of the same file. Stream copy only: no re-encoding, cuts on keyframes.
+    Returns the manifest ({'parts', 'uploaded', ...}) or None if it cannot be split.
+    """
+    manifest = load_parts_manifest(video_file)
+    if manifest:
+        return manifest
+    
+    parts_dir = get_parts_dir(video_file)
+    shutil.rmtree(parts_dir, ignore_errors=True)
+    
+    # The parts are a full second copy of the episode
+    needed = os.path.getsize(video_file) + disk_budget.DISK_RESERVE_BYTES
+    free = shutil.disk_usage(os.path.dirname(os.path.abspath(video_file))).free
+    if free < needed:
+        print(f"❌ Not enough disk space to split {os.path.basename(video_file)}: "
+              f"{free / 1024**3:.2f} GB free, {needed / 1024**3:.2f} GB needed")
+        return None
+    
+    print(f"✂️ Splitting {os.path.basename(video_file)} into parts under {MAX_UPLOAD_BYTES / 1024**3:.1f} GB...")
+    start_time = time.time()
+    parts = media.split_video(video_file, parts_dir, MAX_UPLOAD_BYTES)
+    if not parts:
+        shutil.rmtree(parts_dir, ignore_errors=True)
+        return None
     
+    print(f"✅ Split into {len(parts)} parts in {time.time() - start_time:.1f}s")
+    stat = os.stat(video_file)
+    manifest = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'parts': parts, 'uploaded': []}
+    save_parts_manifest(video_file, manifest)
+    return manifest
+
+def remove_parts(video_file):
+    """Delete the parts of a video (and the parts folder once it is empty)"""
+    parts_dir = get_parts_dir(video_file)
+    shutil.rmtree(parts_dir, ignore_errors=True)
     try:
-        # Create a 5MB test file (smaller for faster testing)
-        print("🧪 Testing upload speed to Telegram servers...")
-        with open(test_file, 'wb') as f:
-            f.write(os.urandom(5 * 1024 * 1024))  # 5MB
-        
-        start_time = time.time()
-        
-        def progress_callback(current, total):
-            percent = (current / total) * 100
-            print(f"🧪 Speed Test Progress: {percent:.1f}%", end='\r')
+        os.rmdir(os.path.dirname(parts_dir))
+    except OSError:
+        pass
+
+async def upload_split_video(client, channel, video_file, index=1, total_files=1, budget=None):
+    """
+    Upload an oversized video as numbered parts, in order, captioned 'Part k/n'
+    Parts already sent by an earlier run are skipped
+    With a DiskBudget (pipeline) the parts are reserved while they are on disk
+    Returns True once every part is uploaded
+    """
+    budget_key = ('parts', os.path.abspath(video_file))
+    try:
+        return await upload_video_parts(client, channel, video_file, index, total_files, budget, budget_key)
+    finally:
+        # Parts are kept for a resumed run after a failure, and keep their budget then
+        if budget is not None and not os.path.exists(get_parts_dir(video_file)):
+            budget.release(budget_key)
+
+async def upload_video_parts(client, channel, video_file, index, total_files, budget, budget_key):
+    """Split (or reuse the split of) a video and upload its parts in order"""
+    if budget is not None:
+        budget.reserve(budget_key, os.path.getsize(video_file))
+    try:
+        manifest = await asyncio.to_thread(split_video_file, video_file)
+    except Exception as e:
+        manifest = None
+        print(f"❌ Error splitting {os.path.basename(video_file)}: {e}")
+    if manifest and budget is not None:
+        budget.settle(budget_key, sum(metrics.get_file_size(part) or 0 for part in manifest['parts']))
+    if not manifest:
+        print(f"❌ Could not split {os.path.basename(video_file)} for Telegram, skipping it")
+        return False
+    
+    caption = os.path.splitext(os.path.basename(video_file))[0]
+    parts = manifest['parts']
+    start_time = time.time()
+    for part_number, part in enumerate(parts, 1):
+        if part_number in manifest['uploaded']:
+            print(f"⏭️ Already uploaded: {caption} - Part {part_number}/{len(parts)}")
+            continue
         
-        await client.send_file(
-            entity=channel.id,
-            file=test_file,
-            caption="Speed test file - please ignore",
-            progress_callback=progress_callback
-        )
+        uploaded = await upload_video_file(client, channel, part, index, total_files,
+                                           caption=f"{caption} - Part {part_number}/{len(parts)}",
+                                           source_file=video_file)
+        if not uploaded:
+            return False
+        manifest['uploaded'].append(part_number)
+        save_parts_manifest(video_file, manifest)
+    
+    record_upload(video_file, time.time() - start_time)
+    remove_parts(video_file)
+    return True
+
+async def upload_episode(client, channel, video_file, index=1, total_files=1, metadata=None, budget=None):
+    """
+    Upload one episode, in parts if it is over the Telegram limit
+    budget is the pipeline's DiskBudget, which has to account for the parts
+    """
+    try:
+        if is_already_uploaded(video_file):
+            print(f"⏭️ Already uploaded (ledger): {os.path.basename(video_file)}")
+            return True
         
-        upload_time = time.time() - start_time
-        speed_mbps = (5 * 8) / upload_time  # Convert to Mbps (5MB * 8 bits/byte / time)
-        print(f"\n📊 Actual upload speed to Telegram: {speed_mbps:.2f} Mbps")
-        return speed_mbps
+        if not os.path.isfile(video_file):
+            print(f"❌ Video file is missing: {video_file}")
+            return False
         
-    except Exception as e:
-        print(f"❌ Speed test failed: {e}")
-        return None
+        if os.path.getsize(video_file) > MAX_UPLOAD_BYTES:
+            return await upload_split_video(client, channel, video_file, index, total_files, budget)
+        return await upload_video_file(client, channel, video_file, index, total_files, metadata)
     finally:
-        if os.path.exists(test_file):
-            os.remove(test_file)
+        # A prepared thumbnail that was never sent (skipped or split) goes too
+        remove_thumbnail(metadata)
+
+async def upload_videos_to_channel(client, channel, folder_path):
+    """
+    Upload all video files from folder to channel with retry logic and progress monitoring
+    """
+    video_files = get_video_files(folder_path)
+    
+    if not video_files:
+        print("❌ No video files found in the folder!")
+        return 0
+    
+    print(f"🎬 Found {len(video_files)} video files to upload")
+    
+    # Skip what a previous run already uploaded (and the delays around it)
+    pending_files = [video_file for video_file in video_files if not is_already_uploaded(video_file)]
+    uploaded_count = len(video_files) - len(pending_files)
+    if uploaded_count:
+        print(f"⏭️ {uploaded_count} video(s) already uploaded according to the ledger")
+    
+    # Probe and thumbnail every pending file up front, in parallel (parts get theirs once cut)
+    metadata = await prepare_video_metadata([video_file for video_file in pending_files
+                                             if os.path.getsize(video_file) <= MAX_UPLOAD_BYTES])
+    
+    try:
+        for i, video_file in enumerate(pending_files, uploaded_count + 1):
+            # Pacing between uploads is handled by rate_limiter
+            if await upload_episode(client, channel, video_file, i, len(video_files), metadata.pop(video_file, None)):
+                uploaded_count += 1
+    finally:
+        # Thumbnails of episodes never reached (the loop was interrupted)
+        for leftover in metadata.values():
+            remove_thumbnail(leftover)
+    
+    print(f"🎉 Upload completed! {uploaded_count}/{len(video_files)} videos uploaded successfully")
+    return uploaded_count
 
 def move_folder_to_done(folder_name):
     """
@@ -407,8 +851,8 @@ def move_folder_to_done(folder_name):
             destination_path = f"{original_destination}_{counter}"
             counter += 1
         
-        # Move the folder
-        shutil.move(source_path, destination_path)
+        # Move the folder (a plain rename when done/ is on the same filesystem)
+        layout.move_into_place(source_path, destination_path)
         print(f"📦 Moved folder to: {destination_path}")
         return True
         
@@ -416,49 +860,99 @@ def move_folder_to_done(folder_name):
         print(f"❌ Error moving folder {folder_name} to done directory: {e}")
         return False
 
-async def process_anime_folder(client, folder_name):
+async def get_recorded_channel(client, folder_name):
     """
-    Process a single anime folder: create channel, upload poster, upload videos
+    Get the channel a previous run created for this folder, if it still exists
     """
-    print(f"\n{'='*60}")
-    print(f"🚀 Processing: {folder_name}")
-    print(f"{'='*60}")
+    try:
+        row = ledger.get_ledger().get_channel(folder_name)
+    except sqlite3.Error:
+        return None
+    if not row:
+        return None
     
+    try:
+        channel = await client.get_entity(types.PeerChannel(row['channel_id']))
+        print(f"♻️ Reusing channel from previous run: {channel.title} (ID: {channel.id})")
+        return channel
+    except Exception as e:
+        print(f"⚠️ Recorded channel {row['channel_id']} is not available ({e}), creating a new one")
+        return None
+
+async def prepare_channel(client, folder_name):
+    """
+    Search poster, create the public channel and set its photo
+    Returns the channel object, or None if the channel could not be created
+    """
     folder_path = os.path.join(BASE_PATH, folder_name)
     
+    # Resume into the channel a previous run already created
+    channel = await get_recorded_channel(client, folder_name)
+    if channel:
+        return channel
+    
     # Step 1: Search and download poster
     print("🔍 Searching for anime poster...")
-    poster_url = search_anime_poster(folder_name)
+    poster_start = time.time()
+    poster_url = await search_anime_poster(folder_name)
     
     poster_path = None
     if poster_url:
-        poster_path = download_image(poster_url, folder_path, folder_name)
+        poster_path = await download_image(poster_url, folder_path, folder_name)
         if not poster_path:
             print("⚠️ Could not download poster, continuing without it...")
     else:
         print("⚠️ No poster found, continuing without it...")
+    metrics.record_stage('poster', time.time() - poster_start, folder_name,
+                         nbytes=metrics.get_file_size(poster_path),
+                         error=None if poster_path else ('DownloadFailed' if poster_url else 'NotFound'))
     
     # Step 2: Create Telegram channel
+    channel_start = time.time()
     channel, username = await create_public_telegram_channel(client, folder_name)
+    metrics.record_stage('channel_create', time.time() - channel_start, folder_name,
+                         error=None if channel else 'CreateFailed')
     
     if not channel:
         print(f"❌ Failed to create channel for {folder_name}, skipping...")
-        return False
+        return None
+    
+    try:
+        ledger.get_ledger().record_channel(folder_name, channel.id, username)
+    except sqlite3.Error as e:
+        print(f"⚠️ Could not record channel in ledger: {e}")
     
     # Step 3: Upload channel photo if poster was downloaded
     if poster_path and os.path.exists(poster_path):
         await upload_channel_photo(client, channel, poster_path)
     
-    # Step 4: Run speed test (optional)
-    run_speed_test = True  # Set to False to skip speed test
-    if run_speed_test:
-        await test_upload_speed(client, channel)
-        await asyncio.sleep(5)  # Brief pause after speed test
+    return channel
+
+async def process_anime_folder(client, folder_name):
+    """
+    Process a single anime folder: create channel, upload poster, upload videos
+    """
+    print(f"\n{'='*60}")
+    print(f"🚀 Processing: {folder_name}")
+    print(f"{'='*60}")
+    
+    folder_path = os.path.join(BASE_PATH, folder_name)
+    
+    # A public channel is only worth creating for a folder with something to upload
+    if not get_video_files(folder_path):
+        print(f"⚠️ No video files in {folder_name}, skipping it (no channel created)")
+        return False
     
-    # Step 5: Upload all videos to the channel
+    # Steps 1-3: Poster, channel creation and channel photo
+    channel = await prepare_channel(client, folder_name)
+    
+    if not channel:
+        return False
+    
+    # Step 4: Upload all videos to the channel
     uploaded_count = await upload_videos_to_channel(client, channel, folder_path)
     
-    # Step 6: Move folder to done directory if at least one video was uploaded
+    # Step 5: Move folder to done directory if at least one video was uploaded
     if uploaded_count > 0:
         print(f"📦 Moving folder to done directory...")
         if move_folder_to_done(folder_name):
@@ -488,25 +982,38 @@ async def main():
     print(f"📊 Found {len(anime_folders)} anime folders")
     
     # Initialize Telegram client (keeping your original session name)
-    async with TelegramClient('session_name', API_ID, API_HASH) as client:
+    async with TelegramClient('session_name', API_ID, API_HASH, flood_sleep_threshold=FLOOD_SLEEP_THRESHOLD) as client:
         print("🔗 Connecting to Telegram...")
         await client.start()
         print("✅ Successfully logged in!")
         
-        # Process each folder
-        successful_processing = 0
-        for i, folder_name in enumerate(anime_folders, 1):
-            print(f"\n📦 Processing folder {i}/{len(anime_folders)}")
-            if await process_anime_folder(client, folder_name):
-                successful_processing += 1
-            
-            # Increased delay between processing folders
-            if i < len(anime_folders):
-                delay = random.uniform(60, 120)  # 1-2 minute delay
-                print(f"⏳ Waiting {delay:.1f} seconds before next folder...")
-                await asyncio.sleep(delay)
+        # Resolve every poster in one batched AniList lookup (cached for later runs)
+        print("🔍 Looking up posters on AniList...")
+        await anilist.get_client().search_posters(anime_folders)
+        
+        # Process several folders at once; each one gets its own channel
+        print(f"⚙️ Processing up to {FOLDER_CONCURRENCY} folder(s) at once, "
+              f"{MAX_CONCURRENT_UPLOADS} upload(s) in flight")
+        folder_slots = asyncio.Semaphore(FOLDER_CONCURRENCY)
+        
+        async def run_folder(i, folder_name):
+            async with folder_slots:
+                print(f"\n📦 Processing folder {i}/{len(anime_folders)}")
+                # A failure in one folder must not take the others down
+                try:
+                    return await process_anime_folder(client, folder_name)
+                except Exception as e:
+                    print(f"❌ Unexpected error while processing {folder_name}: {e}")
+                    return False
+        
+        # Pacing between folders is handled by rate_limiter
+        results = await asyncio.gather(*(
+            run_folder(i, folder_name) for i, folder_name in enumerate(anime_folders, 1)
+        ))
+        successful_processing = sum(1 for result in results if result)
     
     print(f"\n🎊 All done! Successfully processed {successful_processing}/{len(anime_folders)} anime folders")
+    telemetry.report()
     print(f"📁 Processed folders moved to: {DONE_PATH}")
 
 if __name__ == "__main__":
@@ -0,0 +1,227 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+# Get the directory where the script is located
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# AniList API settings
+ANILIST_URL = 'https://graphql.anilist.co'
+ANILIST_REQUESTS_PER_MINUTE = 30   # AniList's (degraded) limit; 429s are honoured on top of this
+ANILIST_BATCH_SIZE = 10            # Titles resolved per aliased GraphQL request
+ANILIST_MAX_RETRIES = 3            # Attempts per request on 429/network errors
+HTTP_POOL_SIZE = 8                 # Keep-alive connections per host
+
+# On-disk cache of search results and poster bytes
+METADATA_CACHE_DIR = os.path.join(SCRIPT_DIR, ".anilist_cache")
+METADATA_CACHE_TTL = 7 * 24 * 3600
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+MEDIA_FIELDS = '''
+    title {
+        romaji
+        english
+    }
+    coverImage {
+        large
+        extraLarge
+    }
+'''
+
+def normalize_title(title):
+    """Cache key for a search title"""
+    return ' '.join(title.lower().split())
+
+def build_batch_query(titles):
+    """
+    Build one aliased GraphQL query resolving several titles:
+    t0: Media(search: $s0, type: ANIME) {...} t1: Media(search: $s1, ...) ...
+    Returns (query, variables).
+    """
+    params = ', '.join(f'$s{i}: String' for i in range(len(titles)))
+    fields = '\n'.join(f't{i}: Media(search: $s{i}, type: ANIME) {{{MEDIA_FIELDS}}}' for i in range(len(titles)))
+    query = f'query ({params}) {{\n{fields}\n}}'
+    variables = {f's{i}': title for i, title in enumerate(titles)}
+    return query, variables
+
+def get_cover_url(media):
+    """Prefer extraLarge, fall back to large"""
+    cover = (media or {}).get('coverImage') or {}
+    return cover.get('extraLarge') or cover.get('large')
+
+class AniListClient:
+    """
+    Async AniList metadata client.
+    Blocking HTTP runs in worker threads on one pooled requests.Session, titles are
+    resolved in batches with aliased GraphQL queries under a shared rate limit, and
+    search results and poster bytes are cached on disk for METADATA_CACHE_TTL.
+    """
+
+    def __init__(self, cache_dir=METADATA_CACHE_DIR, ttl=METADATA_CACHE_TTL,
+                 requests_per_minute=ANILIST_REQUESTS_PER_MINUTE):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.interval = 60 / requests_per_minute
+        self.next_request = 0
+        self.rate_lock = threading.Lock()
+        self.cache_lock = threading.Lock()
+
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = USER_AGENT
+        adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self.search_cache_path = os.path.join(cache_dir, 'search.json')
+        self.search_cache = self.load_search_cache()
+
+    def load_search_cache(self):
+        """Load cached search results, dropping expired ones"""
+        try:
+            with open(self.search_cache_path, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        now = time.time()
+        return {key: entry for key, entry in cache.items() if now - entry.get('cached_at', 0) < self.ttl}
+
+    def save_search_cache(self):
+        """Write the search cache atomically"""
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            temp_path = self.search_cache_path + '.tmp'
+            with self.cache_lock:
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    json.dump(self.search_cache, f)
+                os.replace(temp_path, self.search_cache_path)
+        except OSError as e:
+            print(f"⚠️ Could not save AniList cache: {e}")
+
+    def wait_for_rate_limit(self):
+        """Space AniList requests out to stay under the rate limit"""
+        with self.rate_lock:
+            now = time.monotonic()
+            wait_time = self.next_request - now
+            self.next_request = max(now, self.next_request) + self.interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+    def post_graphql(self, query, variables):
+        """Blocking GraphQL request with rate limiting and 429 handling"""
+        for attempt in range(ANILIST_MAX_RETRIES):
+            self.wait_for_rate_limit()
+            try:
+                response = self.session.post(ANILIST_URL, json={'query': query, 'variables': variables}, timeout=10)
+            except requests.RequestException as e:
+                if attempt == ANILIST_MAX_RETRIES - 1:
+                    raise
+                print(f"⚠️ AniList request failed ({e}), retrying...")
+                time.sleep(2 ** attempt)
+                continue
+
+            if response.status_code == 429:
+                retry_after = int(response.headers.get('Retry-After') or 60)
+                print(f"⏳ AniList rate limit hit, waiting {retry_after}s")
+                with self.rate_lock:
+                    self.next_request = max(self.next_request, time.monotonic() + retry_after)
+                continue
+
+            # A title with no match makes AniList answer 404 with the other aliases still in data
+            data = response.json()
+            if data.get('data') is None:
+                response.raise_for_status()
+            return data['data'] or {}
+
+        raise RuntimeError("AniList rate limit retries exhausted")
+
+    def resolve_batch(self, titles):
+        """Blocking lookup of one batch of titles, returns {title: cover_url or None}"""
+        query, variables = build_batch_query(titles)
+        data = self.post_graphql(query, variables)
+        return {title: get_cover_url(data.get(f't{i}')) for i, title in enumerate(titles)}
+
+    async def search_posters(self, titles):
+        """
+        Resolve poster URLs for many titles at once.
+        Returns {title: url or None}; cached titles cost no network call.
+        """
+        results = {}
+        missing = []
+        for title in titles:
+            entry = self.search_cache.get(normalize_title(title))
+            if entry is not None:
+                results[title] = entry['url']
+            elif title not in missing:
+                missing.append(title)
+
+        if not missing:
+            return results
+
+        batches = [missing[i:i + ANILIST_BATCH_SIZE] for i in range(0, len(missing), ANILIST_BATCH_SIZE)]
+        batch_results = await asyncio.gather(
+            *(asyncio.to_thread(self.resolve_batch, batch) for batch in batches),
+            return_exceptions=True
+        )
+
+        now = time.time()
+        for batch, batch_result in zip(batches, batch_results):
+            if isinstance(batch_result, Exception):
+                print(f"Error searching AniList for {', '.join(batch)}: {batch_result}")
+                continue
+            for title, url in batch_result.items():
+                results[title] = url
+                # Misses are cached too, so re-runs don't keep asking
+                self.search_cache[normalize_title(title)] = {'url': url, 'cached_at': now}
+
+        self.save_search_cache()
+        return results
+
+    async def search_poster(self, title):
+        """Resolve a single title's poster URL"""
+        return (await self.search_posters([title])).get(title)
+
+    def get_poster_cache_path(self, url):
+        """Cache file for a poster URL"""
+        return os.path.join(self.cache_dir, 'posters', hashlib.sha256(url.encode('utf-8')).hexdigest())
+
+    def fetch_bytes(self, url):
+        """Blocking download of a poster, served from the disk cache when fresh"""
+        cache_path = self.get_poster_cache_path(url)
+        try:
+            if time.time() - os.path.getmtime(cache_path) < self.ttl:
+                with open(cache_path, 'rb') as f:
+                    return f.read()
+        except OSError:
+            pass
+
+        response = self.session.get(url, timeout=15)
+        response.raise_for_status()
+        content = response.content
+
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            with open(cache_path + '.tmp', 'wb') as f:
+                f.write(content)
+            os.replace(cache_path + '.tmp', cache_path)
+        except OSError as e:
+            print(f"⚠️ Could not cache poster: {e}")
+        return content
+
+    async def fetch_poster(self, url):
+        """Get a poster's bytes without blocking the event loop"""
+        return await asyncio.to_thread(self.fetch_bytes, url)
+
+_client = None
+
+def get_client():
+    """Get the process-wide AniList client, creating it on first use"""
+    global _client
+    if _client is None:
+        _client = AniListClient()
+    return _client
@@ -0,0 +1,390 @@
+import os
+import sys
+import json
+import time
+import types
+import shutil
+import asyncio
+import tempfile
+import importlib
+import threading
+import subprocess
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import downen
+import comb
+import media_index
+import media
+import ledger
+import metrics
+
+# 1.py is not a valid identifier, so load it through importlib
+uploader = importlib.import_module('1')
+
+# Benchmark defaults (override with: python3 benchmark.py [episodes] [seconds] [keep])
+BENCH_EPISODES = 4           # Synthetic episodes to generate
+BENCH_DURATION = 30          # Seconds per episode
+BENCH_SERIES = "Bench Series"
+BENCH_EMBED_SERIES = "Bench Series Embed"   # Separate series so the ledger doesn't mark the copies as embedded
+BENCH_PART_LATENCY = 0.05    # Simulated round trip per uploaded part (seconds)
+
+# Synthetic episode flavours, cycled through so every conversion action gets exercised
+BENCH_PROFILES = [
+    {'name': 'h264-480p-mp4', 'ext': 'mp4', 'width': 854, 'height': 480, 'subtitle': 'vtt',
+     'codecs': ['-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p', '-c:a', 'aac']},
+    {'name': 'h264-720p-mkv-ac3', 'ext': 'mkv', 'width': 1280, 'height': 720, 'subtitle': 'srt',
+     'codecs': ['-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p', '-c:a', 'ac3']},
+    {'name': 'mpeg4-1080p-avi', 'ext': 'avi', 'width': 1920, 'height': 1080, 'subtitle': 'vtt',
+     'codecs': ['-c:v', 'mpeg4', '-q:v', '4', '-c:a', 'ac3']},
+    {'name': 'h264-1080p-mkv', 'ext': 'mkv', 'width': 1920, 'height': 1080, 'subtitle': 'srt',
+     'codecs': ['-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p', '-c:a', 'aac']},
+]
+
+def get_cpu_seconds():
+    """CPU seconds used by this process and its finished children (ffmpeg)"""
+    if resource is None:
+        return time.process_time()
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+def get_peak_rss_mb():
+    """Peak RSS of this process and of the largest child so far, in MB (None where unsupported)"""
+    if resource is None:
+        return None, None
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    unit = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit
+    return own, children
+
+def get_folder_video_bytes(folder_path):
+    """Total size of the videos in a folder"""
+    return sum(os.path.getsize(os.path.join(folder_path, f)) for f in os.listdir(folder_path)
+               if media_index.is_video_file(f))
+
+class StageTimer:
+    """
+    Measure wall time and CPU seconds of one benchmark stage.
+    RSS is ru_maxrss, a high-water mark for the whole process: it is recorded as
+    the peak so far when the stage ends, not the stage's own peak.
+    """
+
+    def __init__(self, results, stage):
+        self.results = results
+        self.stage = stage
+        self.nbytes = 0
+        self.files = 0
+
+    def __enter__(self):
+        print(f"\n{'='*60}\n⏱️ Stage: {self.stage}\n{'='*60}")
+        self.start = time.perf_counter()
+        self.cpu_start = get_cpu_seconds()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self.start
+        own_rss, child_rss = get_peak_rss_mb()
+        self.results.append({
+            'stage': self.stage,
+            'files': self.files,
+            'mb': self.nbytes / (1024 * 1024),
+            'seconds': wall,
+            'mb_per_s': self.nbytes / (1024 * 1024) / wall if wall > 0 else 0,
+            'cpu_seconds': get_cpu_seconds() - self.cpu_start,
+            'peak_rss_so_far_mb': own_rss,
+            'peak_child_rss_so_far_mb': child_rss,
+            'error': repr(exc) if exc else None,
+        })
+        return False
+
+def write_subtitle(path, duration, fmt):
+    """Write a synthetic SRT or WebVTT subtitle with a cue every two seconds"""
+    def timestamp(seconds, separator):
+        return f"{int(seconds // 3600):02d}:{int(seconds % 3600 // 60):02d}:{int(seconds % 60):02d}{separator}000"
+
+    lines = ['WEBVTT', ''] if fmt == 'vtt' else []
+    separator = '.' if fmt == 'vtt' else ','
+    for i, start in enumerate(range(0, int(duration), 2), 1):
+        if fmt == 'srt':
+            lines.append(str(i))
+        lines.append(f"{timestamp(start, separator)} --> {timestamp(start + 2, separator)}")
+        lines.append(f"Benchmark line {i}")
+        lines.append('')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines))
+
+def generate_episode(source_dir, episode_number, duration, profile):
+    """Render one synthetic episode with ffmpeg's test sources (noise keeps the encoders honest)"""
+    video_path = os.path.join(source_dir, f"episode_{episode_number}.{profile['ext']}")
+    subtitle_path = os.path.join(source_dir, f"episode_{episode_number}.{profile['subtitle']}")
+    cmd = [
+        'ffmpeg', '-v', 'error',
+        '-f', 'lavfi', '-i', f"testsrc2=size={profile['width']}x{profile['height']}:rate=24",
+        '-f', 'lavfi', '-i', f"sine=frequency={220 * episode_number}:sample_rate=48000",
+        '-t', str(duration),
+        '-vf', 'noise=alls=12:allf=t',
+    ] + profile['codecs'] + ['-y', video_path]
+    subprocess.run(cmd, check=True, capture_output=True)
+    write_subtitle(subtitle_path, duration, profile['subtitle'])
+    return {'episode': episode_number, 'profile': profile, 'video': video_path, 'subtitle': subtitle_path}
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """Static file handler with single byte-range support, as yt-dlp's chunked downloads expect"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        range_header = self.headers.get('Range')
+        if not range_header or not os.path.isfile(path):
+            return super().send_head()
+
+        size = os.path.getsize(path)
+        try:
+            start_text, _, end_text = range_header.replace('bytes=', '').partition('-')
+            start = int(start_text) if start_text else max(0, size - int(end_text))
+            end = min(int(end_text), size - 1) if end_text and start_text else size - 1
+        except ValueError:
+            return super().send_head()
+        if start >= size:
+            self.send_error(416, "Requested Range Not Satisfiable")
+            return None
+
+        f = open(path, 'rb')
+        f.seek(start)
+        self.send_response(206)
+        self.send_header('Content-Type', self.guess_type(path))
+        self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        self.range_remaining = end - start + 1
+        return f
+
+    def copyfile(self, source, outputfile):
+        remaining = getattr(self, 'range_remaining', None)
+        if remaining is None:
+            return super().copyfile(source, outputfile)
+        while remaining > 0:
+            chunk = source.read(min(64 * 1024, remaining))
+            if not chunk:
+                break
+            outputfile.write(chunk)
+            remaining -= len(chunk)
+
+def start_media_server(directory):
+    """Serve the synthetic episodes over local HTTP, returns (server, base_url)"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), partial(RangeRequestHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+class FakeExtractor:
+    """
+    Local stand-in for the HiAnime extractor: builds the info dict yt-dlp would
+    return (a single dubbed format plus an English subtitle, pointing at the
+    local server) and seeds downen's info cache with it, so the real download
+    path runs without any extraction request.
+    """
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+
+    def register(self, episode):
+        """Seed the info cache for an episode and return its page URL"""
+        profile = episode['profile']
+        page_url = f"{self.base_url}/watch/{episode['episode']}"
+        info = {
+            'id': f"bench-{episode['episode']}",
+            'title': f"{BENCH_SERIES} Episode {episode['episode']}",
+            'series': BENCH_SERIES,
+            'episode_number': episode['episode'],
+            'episode': f"Episode {episode['episode']}",
+            'ext': profile['ext'],
+            'extractor': 'generic',
+            'extractor_key': 'Generic',
+            'webpage_url': page_url,
+            'original_url': page_url,
+            'formats': [{
+                'format_id': f"{profile['name']}-dub",
+                'format_note': 'dub',
+                'url': f"{self.base_url}/{os.path.basename(episode['video'])}",
+                'ext': profile['ext'],
+                'width': profile['width'],
+                'height': profile['height'],
+                'protocol': 'http',
+            }],
+            'subtitles': {'en': [{
+                'ext': profile['subtitle'],
+                'url': f"{self.base_url}/{os.path.basename(episode['subtitle'])}",
+            }]},
+        }
+        downen.save_cached_info(page_url, info)
+        return page_url
+
+class FakeTelegramClient:
+    """Local upload sink that accepts file parts with a simulated round trip and discards them"""
+
+    def __init__(self, part_latency=BENCH_PART_LATENCY):
+        self.part_latency = part_latency
+        self.bytes_received = 0
+        self.messages = []
+
+    async def __call__(self, request):
+        await asyncio.sleep(self.part_latency)
+        self.bytes_received += len(request.bytes)
+        return True
+
+    async def send_file(self, entity, file, **kwargs):
+        await asyncio.sleep(self.part_latency)
+        self.messages.append({'entity': entity, 'caption': kwargs.get('caption')})
+
+def isolate_state(workspace):
+    """Point the ledger, caches and metrics at the workspace so production state is untouched"""
+    ledger._ledger = ledger.Ledger(os.path.join(workspace, 'ledger.db'))
+    metrics._recorder = metrics.MetricsRecorder(os.path.join(workspace, 'metrics'), script='benchmark')
+    downen.INFO_CACHE_DIR = os.path.join(workspace, 'info_cache')
+    uploader.THUMBNAIL_DIR = os.path.join(workspace, 'thumbs')
+
+def run_transcode_stage(series_folder, timer):
+    """
+    Finalize every downloaded episode through downen's TranscodePool, the same
+    path downen and pipeline.py use (probe, convert with the subtitle muxed in,
+    staging, rename into place, ledger)
+    """
+    library_dir = os.path.dirname(series_folder)
+    transcode_pool = downen.TranscodePool()
+    futures = []
+    try:
+        for entry in media_index.get_folder_index(series_folder).get_videos():
+            timer.files += 1
+            timer.nbytes += entry['size']
+            action = downen.get_conversion_action(entry['path'])
+            print(f"  {entry['name']}: {action}")
+            futures.append(transcode_pool.submit(entry['path'], entry['episode'], BENCH_SERIES,
+                                                 True, library_dir, action=action))
+    finally:
+        transcode_pool.shutdown()
+
+    failed = [future for future in futures if not downen.resolve_result_files(future)]
+    if failed:
+        print(f"❌ {len(failed)} episode(s) failed to transcode")
+
+def prepare_embed_folder(series_folder, generated, embed_folder):
+    """
+    The transcode stage already muxes the subtitles, so comb.py would find nothing
+    to do. Give it what it gets in production instead: each transcoded MP4
+    copied next to its separate subtitle, under a series the ledger doesn't know.
+    """
+    os.makedirs(embed_folder)
+    videos = {entry['episode']: entry['path'] for entry in media_index.get_folder_index(series_folder).get_videos()}
+    for episode in generated:
+        video_path = videos.get(episode['episode'])
+        if not video_path:
+            continue
+        name = f"Episode {episode['episode']}"
+        shutil.copyfile(video_path, os.path.join(embed_folder, name + os.path.splitext(video_path)[1]))
+        shutil.copyfile(episode['subtitle'], os.path.join(embed_folder, name + os.path.splitext(episode['subtitle'])[1]))
+
+def print_report(results):
+    """Print the per-stage table"""
+    print(f"\n{'='*60}\n📊 Benchmark results\n{'='*60}")
+    print(f"{'stage':<10} {'files':>5} {'MB':>9} {'sec':>8} {'MB/s':>8} {'CPU s':>8} {'RSS MB':>8} {'ffmpeg':>8}")
+    for r in results:
+        own_rss = f"{r['peak_rss_so_far_mb']:.0f}" if r['peak_rss_so_far_mb'] is not None else 'n/a'
+        child_rss = f"{r['peak_child_rss_so_far_mb']:.0f}" if r['peak_child_rss_so_far_mb'] is not None else 'n/a'
+        print(f"{r['stage']:<10} {r['files']:>5} {r['mb']:>9.1f} {r['seconds']:>8.2f} {r['mb_per_s']:>8.2f} "
+              f"{r['cpu_seconds']:>8.2f} {own_rss:>8} {child_rss:>8}" + (f"  ❌ {r['error']}" if r['error'] else ''))
+    print("RSS columns are peaks so far (process-wide ru_maxrss at the end of each stage), not per-stage peaks")
+
+def run_benchmark(episodes=BENCH_EPISODES, duration=BENCH_DURATION, keep=False):
+    """Generate synthetic media and push it through download, transcode, embed and upload"""
+    if not downen.check_ffmpeg() or not media.check_ffprobe():
+        print("❌ FFmpeg and ffprobe are required for the benchmark")
+        return None
+
+    workspace = tempfile.mkdtemp(prefix='anime_bench_')
+    source_dir = os.path.join(workspace, 'source')
+    library_dir = os.path.join(workspace, 'library')
+    series_folder = os.path.join(library_dir, BENCH_SERIES)
+    os.makedirs(source_dir)
+    os.makedirs(library_dir)
+    isolate_state(workspace)
+    print(f"📁 Benchmark workspace: {workspace}")
+
+    results = []
+    server = None
+    try:
+        with StageTimer(results, 'generate') as timer:
+            generated = [generate_episode(source_dir, i, duration, BENCH_PROFILES[(i - 1) % len(BENCH_PROFILES)])
+                         for i in range(1, episodes + 1)]
+            timer.files = len(generated)
+            timer.nbytes = sum(os.path.getsize(episode['video']) for episode in generated)
+
+        server, base_url = start_media_server(source_dir)
+        extractor = FakeExtractor(base_url)
+        ydl_opts = downen.get_ydl_opts(library_dir, False)
+
+        with StageTimer(results, 'download') as timer:
+            entries = [{'url': extractor.register(episode)} for episode in generated]
+            downen.download_playlist_concurrently(entries, ydl_opts, False, library_dir,
+                                                  workers=downen.DOWNLOAD_WORKERS, max_retries=2)
+            timer.files = len(entries)
+            timer.nbytes = get_folder_video_bytes(series_folder)
+
+        with StageTimer(results, 'transcode') as timer:
+            run_transcode_stage(series_folder, timer)
+
+        embed_folder = os.path.join(workspace, 'embed', BENCH_EMBED_SERIES)
+        prepare_embed_folder(series_folder, generated, embed_folder)
+        with StageTimer(results, 'embed') as timer:
+            timer.nbytes = get_folder_video_bytes(embed_folder)
+            timer.files = comb.process_folder(embed_folder)
+        if not timer.files:
+            # No work was done, so the MB/s would be meaningless
+            results[-1].update(mb=0, mb_per_s=0, error='no episode embedded')
+
+        client = FakeTelegramClient()
+        with StageTimer(results, 'upload') as timer:
+            channel = types.SimpleNamespace(id=1, title=BENCH_SERIES)
+            timer.files = asyncio.run(uploader.upload_videos_to_channel(client, channel, series_folder))
+            timer.nbytes = client.bytes_received
+    except Exception as e:
+        print(f"❌ Benchmark failed: {e}")
+    finally:
+        if server:
+            server.shutdown()
+
+    print_report(results)
+    with open(os.path.join(workspace, 'benchmark.json'), 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+
+    if keep:
+        print(f"\n📁 Workspace kept at: {workspace}")
+    else:
+        shutil.rmtree(workspace, ignore_errors=True)
+    return results
+
+def main():
+    episodes = BENCH_EPISODES
+    duration = BENCH_DURATION
+    try:
+        if len(sys.argv) > 1:
+            episodes = max(1, int(sys.argv[1]))
+        if len(sys.argv) > 2:
+            duration = max(2, int(sys.argv[2]))
+    except ValueError:
+        print(f"⚠️ Invalid arguments, using {BENCH_EPISODES} episode(s) of {BENCH_DURATION}s")
+    keep = len(sys.argv) > 3 and sys.argv[3].lower() in ['keep', 'true', '1', 'yes', 'y']
+
+    run_benchmark(episodes, duration, keep)
+
+if __name__ == "__main__":
+    main()
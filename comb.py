@@ -1,50 +1,22 @@
 import os
-import re
 import subprocess
 import shutil
 import tempfile
 import sys
+import time
+import sqlite3
+import threading
+import media
+import ledger
+import metrics
+import media_index
+import layout
+from media_index import get_file_extension
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-def extract_episode_number(filename):
-    """Extract episode number from filename"""
-    patterns = [
-        r'[Ee]pisode\s*(\d+)',
-        r'[Ee]p\s*(\d+)',
-        r'\s-\s(\d+)\s-',
-        r'\s(\d+)\s*[-_]',
-        r'\[(\d+)\]',
-        r'\b(\d{1,3})\b'
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, filename)
-        if match:
-            episode_num = int(match.group(1))
-            if 1 <= episode_num <= 999:
-                return episode_num
-    return None
-
-def get_file_extension(filename):
-    """Get file extension"""
-    return os.path.splitext(filename)[1]
-
-def is_video_file(filename):
-    """Check if file is a video file"""
-    video_extensions = ['.mp4', '.mkv', '.avi', '.mov', '.wmv', '.flv', '.webm', '.m4v']
-    return any(filename.lower().endswith(ext) for ext in video_extensions)
-
-def is_subtitle_file(filename):
-    """Check if file is a subtitle file"""
-    subtitle_extensions = ['.srt', '.ass', '.ssa', '.vtt', '.sub']
-    return any(filename.lower().endswith(ext) for ext in subtitle_extensions)
-
-def find_matching_subtitle(video_file, subtitle_files, episode_num):
-    """Find subtitle file that matches the video file by episode number"""
-    for sub_file in subtitle_files:
-        sub_episode = extract_episode_number(sub_file)
-        if sub_episode == episode_num:
-            return sub_file
-    return None
+# Parallel embedding settings (stream copy, so the disk is the limit, not the CPU)
+EMBED_WORKERS = 4             # Episodes embedded at the same time across all folders
+EMBED_JOBS_PER_DEVICE = 2     # Cap on simultaneous embeds on one storage device
 
 def embed_subtitle(video_path, subtitle_path, output_path):
     """Embed subtitle into video using FFmpeg"""
@@ -66,20 +38,20 @@ def embed_subtitle(video_path, subtitle_path, output_path):
             '-c:a', 'copy',           # Copy audio stream (no re-encoding)
             '-c:s', 'mov_text',       # Convert WebVTT to mov_text for MP4 compatibility
             '-metadata:s:s:0', 'language=eng',  # Set subtitle language to English
+            '-movflags', '+faststart', # Enable fast start for streaming
             '-y',                     # Overwrite output file if exists
             output_path
         ]
         
         print(f"  🔄 Running FFmpeg command...")
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        media.run_ffmpeg(cmd)
         
-        if result.returncode == 0:
-            print(f"  ✅ Successfully embedded subtitles: {os.path.basename(output_path)}")
-            return True
-        else:
-            print(f"  ❌ FFmpeg error: {result.stderr}")
-            return False
+        print(f"  ✅ Successfully embedded subtitles: {os.path.basename(output_path)}")
+        return True
             
+    except subprocess.TimeoutExpired as e:
+        print(f"  ❌ FFmpeg stalled for {e.timeout:.0f}s and was stopped")
+        return False
     except subprocess.CalledProcessError as e:
         print(f"  ❌ FFmpeg failed: {e.stderr}")
         return False
@@ -87,63 +59,151 @@ def embed_subtitle(video_path, subtitle_path, output_path):
         print(f"  ❌ Error embedding subtitles: {str(e)}")
         return False
 
-def process_folder(folder_path):
-    """Process all video files in a folder and embed subtitles"""
+def embed_episode(folder_path, video_file, subtitle_file, episode_num):
+    """
+    Embed one subtitle into one episode, replacing the originals.
+    Returns the final output filename, or None if embedding failed.
+    """
+    video_path = os.path.join(folder_path, video_file)
+    subtitle_path = os.path.join(folder_path, subtitle_file)
+    
+    # Create output filename with temporary name first
+    temp_output = os.path.join(folder_path, f"temp_episode_{episode_num:02d}{get_file_extension(video_file)}")
+    final_output_filename = f"Episode {episode_num:02d}{get_file_extension(video_file)}"
+    final_output_path = os.path.join(folder_path, final_output_filename)
+    
+    print(f"  🎬 Processing: {video_file}")
+    print(f"  📝 With subtitle: {subtitle_file}")
+    print(f"  💾 Output: {final_output_filename}")
+    
+    # Embed subtitle to temporary file first
+    embed_start = time.time()
+    series = layout.get_series_key(video_path)
+    if not embed_subtitle(video_path, subtitle_path, temp_output):
+        metrics.record_stage('embed', time.time() - embed_start, series, episode_num, error='EmbedFailed')
+        return None
+    
+    # Delete original files
+    os.remove(video_path)
+    os.remove(subtitle_path)
+    
+    # Rename temporary file to final name
+    os.rename(temp_output, final_output_path)
+    
+    try:
+        ledger.get_ledger().record(series, episode_num, 'embedded',
+                                   path=final_output_path, seconds=time.time() - embed_start)
+    except sqlite3.Error as e:
+        print(f"  ⚠️ Could not update ledger: {e}")
+    metrics.record_stage('embed', time.time() - embed_start, series, episode_num,
+                         nbytes=metrics.get_file_size(final_output_path))
+    
+    return final_output_filename
+
+def is_already_embedded(folder_path, video_file, episode_num):
+    """Check the ledger for a video that already went through subtitle embedding"""
+    video_path = os.path.join(folder_path, video_file)
     try:
-        files = os.listdir(folder_path)
+        row = ledger.get_ledger().get(layout.get_series_key(video_path), episode_num)
+    except sqlite3.Error:
+        return False
+    return ledger.has_reached(row, 'embedded') and ledger.is_file_current(row, video_path)
+
+def find_embed_jobs(folder_path):
+    """
+    Find the videos in a folder that still need their subtitle embedded
+    Returns a list of (folder_path, video_file, subtitle_file, episode_num)
+    """
+    # One scandir pass; episode numbers are parsed once per file and cached
+    index = media_index.get_folder_index(folder_path)
+    video_entries = index.get_videos()
+    
+    print(f"  📹 Found {len(video_entries)} video files")
+    print(f"  📝 Found {len(index.get_subtitles())} subtitle files")
+    
+    jobs = []
+    queued_episodes = set()
+    
+    # Check each video file in episode order
+    for video_entry in video_entries:
+        video_file = video_entry['name']
+        episode_num = video_entry['episode']
         
-        # Separate video and subtitle files
-        video_files = [f for f in files if is_video_file(f) and os.path.isfile(os.path.join(folder_path, f))]
-        subtitle_files = [f for f in files if is_subtitle_file(f) and os.path.isfile(os.path.join(folder_path, f))]
+        if episode_num is None:
+            print(f"  ❌ Could not extract episode number from: {video_file}")
+            continue
         
-        print(f"  📹 Found {len(video_files)} video files")
-        print(f"  📝 Found {len(subtitle_files)} subtitle files")
+        if is_already_embedded(folder_path, video_file, episode_num):
+            print(f"  ✅ Already has embedded subtitles (ledger): {video_file}")
+            continue
         
-        processed_count = 0
-        kept_videos = []  # Track the embedded videos we're keeping
+        # Two videos of one episode would fight over the same subtitle and temp file
+        if episode_num in queued_episodes:
+            print(f"  ⚠️ Another video of episode {episode_num} is already queued, skipping: {video_file}")
+            continue
         
-        # Process each video file
-        for video_file in video_files:
-            video_path = os.path.join(folder_path, video_file)
-            episode_num = extract_episode_number(video_file)
-            
-            if episode_num is None:
-                print(f"  ❌ Could not extract episode number from: {video_file}")
-                continue
-            
-            # Find matching subtitle
-            subtitle_file = find_matching_subtitle(video_file, subtitle_files, episode_num)
-            
-            if subtitle_file is None:
-                print(f"  ❌ No matching subtitle found for: {video_file}")
-                continue
-            
-            subtitle_path = os.path.join(folder_path, subtitle_file)
-            
-            # Create output filename with temporary name first
-            temp_output = os.path.join(folder_path, f"temp_episode_{episode_num:02d}{get_file_extension(video_file)}")
-            final_output_filename = f"Episode {episode_num:02d}{get_file_extension(video_file)}"
-            final_output_path = os.path.join(folder_path, final_output_filename)
-            
-            print(f"  🎬 Processing: {video_file}")
-            print(f"  📝 With subtitle: {subtitle_file}")
-            print(f"  💾 Output: {final_output_filename}")
-            
-            # Embed subtitle to temporary file first
-            if embed_subtitle(video_path, subtitle_path, temp_output):
-                # Delete original files
-                os.remove(video_path)
-                os.remove(subtitle_path)
-                
-                # Rename temporary file to final name
-                os.rename(temp_output, final_output_path)
-                
-                processed_count += 1
-                kept_videos.append(final_output_filename)
-            
-            print("-" * 40)
+        # Find matching subtitle
+        subtitle_entry = index.find_subtitle(episode_num)
+        
+        if subtitle_entry is None:
+            print(f"  ❌ No matching subtitle found for: {video_file}")
+            continue
         
-        return processed_count
+        jobs.append((folder_path, video_file, subtitle_entry['name'], episode_num))
+        queued_episodes.add(episode_num)
+    
+    return jobs
+
+_device_slots = {}
+_device_slots_lock = threading.Lock()
+
+def get_device_slot(path):
+    """Semaphore limiting concurrent embeds on the storage device holding path"""
+    try:
+        device = os.stat(path).st_dev
+    except OSError:
+        device = None
+    with _device_slots_lock:
+        if device not in _device_slots:
+            _device_slots[device] = threading.Semaphore(EMBED_JOBS_PER_DEVICE)
+        return _device_slots[device]
+
+def run_embed_job(folder_path, video_file, subtitle_file, episode_num):
+    """Embed one episode once its device has a free slot"""
+    with get_device_slot(folder_path):
+        return embed_episode(folder_path, video_file, subtitle_file, episode_num)
+
+def run_embed_jobs(jobs, workers=EMBED_WORKERS):
+    """
+    Run embed jobs, several at once when workers > 1
+    Returns {folder_path: processed_count}
+    """
+    processed = {}
+    if workers <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            if embed_episode(*job):
+                processed[job[0]] = processed.get(job[0], 0) + 1
+            print("-" * 40)
+        return processed
+    
+    print(f"  ⚙️ Embedding {len(jobs)} episode(s) with {workers} worker(s), "
+          f"max {EMBED_JOBS_PER_DEVICE} per device")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run_embed_job, *job): job for job in jobs}
+        for future in as_completed(futures):
+            folder_path, video_file = futures[future][:2]
+            try:
+                if future.result():
+                    processed[folder_path] = processed.get(folder_path, 0) + 1
+            except Exception as e:
+                print(f"  ❌ Error embedding {video_file}: {str(e)}")
+    return processed
+
+def process_folder(folder_path, workers=1):
+    """Process all video files in a folder and embed subtitles"""
+    try:
+        jobs = find_embed_jobs(folder_path)
+        return run_embed_jobs(jobs, workers).get(folder_path, 0)
                 
     except Exception as e:
         print(f"  ❌ Error processing folder {folder_path}: {str(e)}")
@@ -186,8 +246,9 @@ def main():
     # Get all items in the directory
     items = os.listdir(target_directory)
     
-    # Filter only directories (exclude files)
-    folders = [item for item in items if os.path.isdir(os.path.join(target_directory, item))]
+    # Filter only directories (exclude files and hidden work dirs like .staging)
+    folders = [item for item in items if os.path.isdir(os.path.join(target_directory, item))
+               and not item.startswith('.')]
     
     if not folders:
         print("❌ No folders found in the directory!")
@@ -196,18 +257,31 @@ def main():
     print(f"📂 Found {len(folders)} folder(s): {', '.join(folders)}")
     print("=" * 60)
     
-    total_processed = 0
+    # Optional number of parallel embed workers
+    workers = EMBED_WORKERS
+    if len(sys.argv) > 1:
+        try:
+            workers = max(1, int(sys.argv[1]))
+        except ValueError:
+            print(f"⚠️ Invalid worker count '{sys.argv[1]}', using {EMBED_WORKERS}")
     
-    # Process each folder
+    # Collect the work of every folder first so the workers can run across folders
+    all_jobs = []
     for folder in folders:
         folder_path = os.path.join(target_directory, folder)
-        print(f"\n🔄 Processing folder: {folder}")
+        print(f"\n🔄 Scanning folder: {folder}")
         print("-" * 50)
         
-        processed_count = process_folder(folder_path)
-        total_processed += processed_count
-        
-        if processed_count == 0:
+        try:
+            all_jobs.extend(find_embed_jobs(folder_path))
+        except Exception as e:
+            print(f"  ❌ Error processing folder {folder_path}: {str(e)}")
+    
+    processed = run_embed_jobs(all_jobs, workers)
+    total_processed = sum(processed.values())
+    
+    for folder in folders:
+        if processed.get(os.path.join(target_directory, folder), 0) == 0:
             print(f"  ℹ️  No files were processed in '{folder}'")
     
     print("\n" + "=" * 60)
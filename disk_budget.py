@@ -0,0 +1,183 @@
+import os
+import shutil
+import threading
+
+def parse_budget_env(name='ANIME_DISK_BUDGET_GB'):
+    """Budget cap in bytes from an env var in GB, or None if unset or invalid"""
+    value = os.environ.get(name)
+    if not value:
+        return None
+    try:
+        budget_gb = float(value)
+        if budget_gb <= 0:
+            raise ValueError(value)
+    except ValueError:
+        print(f"⚠️ Invalid {name} '{value}', ignoring it (expected a positive number of GB)")
+        return None
+    return int(budget_gb * 1024**3)
+
+# Disk budget settings; ANIME_DISK_BUDGET_GB caps the budget below the free space
+DISK_BUDGET_BYTES = parse_budget_env()
+DISK_RESERVE_BYTES = 2 * 1024**3    # Always leave this much free for the OS, logs and the ledger
+DISK_BUDGET_POLL = 5                # Seconds between re-checks while waiting for budget
+
+class DiskBudgetError(Exception):
+    """An episode can never fit in the disk budget"""
+
+class DiskBudget:
+    """
+    Admission control for disk space.
+    Each episode reserves its estimated peak footprint (source + transcode output)
+    before downloading, settles to its real size once finalized, and is released
+    only once its file is gone from the disk. Work is only admitted while the
+    reservations fit the budget (the configured cap or the free space at start
+    minus a reserve, whichever is smaller) and the real free space, re-read on
+    every check, still covers what in-progress episodes will write plus the reserve.
+
+    With release_on_upload, admission waits for uploads to free budget (pipeline
+    mode, where uploaded episodes are deleted). Without it nothing is released
+    during the run, so an episode that does not fit once every pending transcode
+    has settled raises DiskBudgetError.
+
+    With ordered, episodes are admitted in playlist order (acquire's order, and
+    pass_turn for episodes that never acquire). Uploads run in playlist order, so
+    budget must never go to a later episode while an earlier one is still waiting:
+    the later one could only be released after the earlier one was uploaded.
+    """
+
+    def __init__(self, path, budget_bytes=DISK_BUDGET_BYTES, reserve_bytes=DISK_RESERVE_BYTES,
+                 release_on_upload=False, ordered=False):
+        self.path = path
+        self.reserve_bytes = reserve_bytes
+        free = shutil.disk_usage(path).free
+        self.capacity = max(0, free - reserve_bytes)
+        if budget_bytes is not None:
+            self.capacity = min(self.capacity, budget_bytes)
+        self.release_on_upload = release_on_upload
+        self.ordered = ordered
+        self.next_order = 1       # Playlist index whose turn it is to be admitted
+        self.passed_orders = set()
+        self.reservations = {}    # key -> {'bytes', 'settled', 'path'}
+        self.condition = threading.Condition()
+
+    @property
+    def reserved(self):
+        """Bytes currently reserved"""
+        return sum(reservation['bytes'] for reservation in self.reservations.values())
+
+    def has_unsettled(self):
+        """Check if some reservation can still shrink (download or transcode in progress)"""
+        return any(not reservation['settled'] for reservation in self.reservations.values())
+
+    def get_free_bytes(self):
+        """Free space on the budget's filesystem right now (None if it can't be read)"""
+        try:
+            return shutil.disk_usage(self.path).free
+        except OSError:
+            return None
+
+    def fits(self, nbytes):
+        """Check that nbytes more fit the reservations and the real free space"""
+        if self.reserved + nbytes > self.capacity:
+            return False
+        free = self.get_free_bytes()
+        if free is None:
+            return True
+        # Episodes still downloading or transcoding will grow up to their estimate
+        pending = sum(reservation['bytes'] for reservation in self.reservations.values()
+                      if not reservation['settled'])
+        return free - pending - nbytes >= self.reserve_bytes
+
+    def pass_turn(self, order):
+        """Mark a playlist index as done with admission (admitted, skipped or failed)"""
+        with self.condition:
+            self.passed_orders.add(order)
+            while self.next_order in self.passed_orders:
+                self.passed_orders.discard(self.next_order)
+                self.next_order += 1
+            self.condition.notify_all()
+
+    def acquire(self, key, nbytes, order=None):
+        """
+        Block until nbytes fit in the budget, then reserve them under key.
+        order is the episode's playlist index; an ordered budget admits it only
+        once every earlier index has passed its turn.
+        """
+        with self.condition:
+            if key in self.reservations:
+                return
+            while self.ordered and order is not None and order > self.next_order:
+                self.condition.wait(timeout=DISK_BUDGET_POLL)
+            announced = False
+            while not self.fits(nbytes):
+                if not self.reservations and nbytes > self.capacity:
+                    raise DiskBudgetError(
+                        f"needs ~{nbytes / 1024**3:.2f} GB but the disk budget is {self.capacity / 1024**3:.2f} GB")
+                if not self.release_on_upload and not self.has_unsettled():
+                    raise DiskBudgetError(
+                        f"disk budget exhausted ({self.reserved / 1024**3:.2f}/{self.capacity / 1024**3:.2f} GB "
+                        f"in use, ~{nbytes / 1024**3:.2f} GB needed); upload and move finished folders first")
+                if not announced:
+                    print(f"⏸ Waiting for disk budget: {self.reserved / 1024**3:.2f}/{self.capacity / 1024**3:.2f} GB "
+                          f"reserved, ~{nbytes / 1024**3:.2f} GB needed")
+                    announced = True
+                self.condition.wait(timeout=DISK_BUDGET_POLL)
+            self.reservations[key] = {'bytes': nbytes, 'settled': False, 'path': None}
+        if order is not None:
+            self.pass_turn(order)
+
+    def reserve(self, key, nbytes):
+        """
+        Reserve bytes about to be written outside admission (e.g. the parts of an
+        oversized upload) without waiting, so later downloads account for them
+        """
+        with self.condition:
+            self.reservations[key] = {'bytes': nbytes, 'settled': False, 'path': None}
+
+    def settle(self, key, nbytes, path=None):
+        """Replace an estimate with what the episode really occupies now that it is finished"""
+        with self.condition:
+            reservation = self.reservations.get(key)
+            if reservation is None:
+                return
+            reservation.update(bytes=nbytes, settled=True, path=os.path.abspath(path) if path else None)
+            self.condition.notify_all()
+
+    def release(self, key):
+        """Give an episode's budget back"""
+        with self.condition:
+            if self.reservations.pop(key, None) is not None:
+                self.condition.notify_all()
+
+    def release_path(self, path):
+        """
+        Give back the budget of the episode whose final file is path, but only once
+        that file is gone (pipeline.py deletes uploaded episodes when configured to;
+        done/ moves only happen after the run). An uploaded file that stays on
+        disk still uses its bytes
+        """
+        path = os.path.abspath(path)
+        if os.path.exists(path):
+            return False
+        with self.condition:
+            for key, reservation in list(self.reservations.items()):
+                if reservation['path'] == path:
+                    del self.reservations[key]
+                    self.condition.notify_all()
+                    return True
+        return False
+
+    def update_path(self, old_path, new_path):
+        """Follow an episode's final file when a later stage renames it"""
+        old_path = os.path.abspath(old_path)
+        with self.condition:
+            for reservation in self.reservations.values():
+                if reservation['path'] == old_path:
+                    reservation['path'] = os.path.abspath(new_path)
+                    return True
+        return False
+
+    def report(self):
+        """One-line budget status"""
+        return (f"Disk budget: {self.reserved / 1024**3:.2f}/{self.capacity / 1024**3:.2f} GB reserved "
+                f"by {len(self.reservations)} episode(s)")
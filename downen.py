@@ -2,11 +2,70 @@ import yt_dlp
 import sys
 import os
 import subprocess
-import shutil
 import re
-import requests
 import time
+import json
+import copy
+import shutil
+import hashlib
+import sqlite3
 import threading
+import media
+import ledger
+import telemetry
+import metrics
+import layout
+import disk_budget
+import encoder_tuning
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed
+from urllib.parse import urlparse
+
+# Playlist worker pool settings
+DOWNLOAD_WORKERS = 3          # Episodes downloaded at the same time
+MAX_DOWNLOADS_PER_HOST = 3    # Cap on simultaneous downloads from a single host
+DOWNLOAD_START_DELAY = 3      # Seconds between download starts on the same host
+
+# Transcode pool settings
+TRANSCODE_THREADS_PER_JOB = 4  # x264 threads per encode; pool size = cores // threads
+
+# x264 settings; with a host profile (python3 encoder_tuning.py) the preset is
+# picked per encode to keep pace with the measured download throughput
+X264_PRESET = 'fast'   # Used when the host is not calibrated or nothing was downloaded yet
+X264_CRF = 23
+PRESET_MIN_DOWNLOAD_SECONDS = 30   # Download seconds measured before the estimate is trusted
+PRESET_MAX_REQUIRED_SPEED = 20     # Cap on the realtime factor encodes are asked to keep up with
+
+# Chunked encoding: long files are cut at keyframes and the chunks encoded in parallel
+CHUNKED_ENCODE_MIN_DURATION = 40 * 60  # Seconds; shorter episodes encode in one pass (the pool runs several)
+CHUNK_ENCODE_THREADS = 2               # x264 threads per chunk; chunk workers = job's threads // this
+CHUNKS_PER_WORKER = 2                  # Extra chunks so one slow chunk doesn't leave cores idle at the end
+
+# Seconds between conversion progress lines
+FFMPEG_PROGRESS_INTERVAL = 15
+
+# Telegram target: anything within these limits is stream-copied instead of re-encoded
+TARGET_HEIGHT = 480
+TARGET_VIDEO_BITRATE = 1500 * 1000   # bits/s, roughly what -crf 23 gives at 480p
+TELEGRAM_VIDEO_CODECS = ['h264']
+TELEGRAM_AUDIO_CODECS = ['aac']
+TELEGRAM_PIX_FMTS = ['yuv420p', 'yuvj420p']
+
+# Disk footprint estimates for admission control (see disk_budget.py)
+TARGET_AUDIO_BITRATE = 128 * 1000          # bits/s, matches -b:a 128k
+DEFAULT_EPISODE_DURATION = 24 * 60         # Seconds, when the extractor doesn't say
+DEFAULT_EPISODE_BYTES = 400 * 1024 * 1024  # Source size when no size or bitrate is known
+
+# Format cost model: transcode work is priced in bytes so it can be weighed against download size
+TELEGRAM_MAX_UPLOAD_BYTES = int(1.9 * 1024**3)   # Same cap 1.py applies before uploading
+TRANSCODE_COST_PER_SECOND = 300 * 1000            # A full 480p encode of one media second ~ downloading 300 KB
+TRANSCODE_ACTION_WEIGHTS = {'copy': 0, 'remux': 0.02, 'audio': 0.1, 'encode': 1.0}
+
+# Extracted metadata cache (stream URLs expire, so keep the TTL short)
+INFO_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.info_cache')
+INFO_CACHE_TTL = 3 * 3600     # Seconds before a cached info dict is re-extracted
+
+# Download errors that usually mean the cached stream URLs went stale
+STALE_INFO_ERRORS = ['403', '404', '410', 'forbidden', 'expired', 'not found']
 
 def check_ffmpeg():
     """Check if ffmpeg is available"""
@@ -24,110 +83,361 @@ def check_aria2():
     except (subprocess.CalledProcessError, FileNotFoundError, subprocess.TimeoutExpired):
         return False
 
-def speed_test():
-    """Test download speed to identify bottlenecks"""
-    test_url = "http://speedtest.ftp.otenet.gr/files/test1Mb.db"
+def record_download_progress(d):
+    """yt-dlp progress hook feeding the download throughput estimator"""
+    key = d.get('tmpfilename') or d.get('filename')
+    estimator = telemetry.get_estimator('download')
+    if d.get('status') == 'downloading':
+        estimator.update(key, d.get('downloaded_bytes') or 0)
+    elif d.get('status') == 'finished':
+        if estimator.has_stream(key):
+            estimator.update(key, d.get('downloaded_bytes') or d.get('total_bytes') or 0)
+        else:
+            # External downloaders (aria2c) only report once, at the end: spread the
+            # bytes over the download's duration instead of one second
+            estimator.add_span(d.get('total_bytes') or d.get('downloaded_bytes') or 0, d.get('elapsed'))
+        estimator.finish(key)
+
+def choose_conversion_action(input_file, probe=None):
+    """
+    Pick the cheapest way to make a file Telegram-compatible:
+    'copy'   - already an H.264/AAC MP4 within target, nothing to do
+    'remux'  - compatible streams in another container, stream-copy to MP4
+    'audio'  - compatible video, only the audio needs transcoding to AAC
+    'encode' - full libx264 encode to 480p
+    """
+    is_mp4 = input_file.lower().endswith('.mp4')
+    if probe is None:
+        probe = media.probe_media(input_file)
+    if not probe or not probe.get('vcodec'):
+        # Without ffprobe fall back to the old rule: re-encode anything not MP4
+        return 'copy' if is_mp4 else 'encode'
+    
+    height = probe.get('height') or 0
+    video_bit_rate = probe.get('video_bit_rate') or probe.get('bit_rate') or 0
+    
+    video_ok = (
+        probe['vcodec'] in TELEGRAM_VIDEO_CODECS
+        and (probe.get('pix_fmt') or 'yuv420p') in TELEGRAM_PIX_FMTS
+        # Content already at or below the target size/bitrate isn't worth re-encoding
+        and (height <= TARGET_HEIGHT or (0 < video_bit_rate <= TARGET_VIDEO_BITRATE))
+    )
+    audio_ok = probe.get('acodec') is None or probe['acodec'] in TELEGRAM_AUDIO_CODECS
+    
+    if not video_ok:
+        return 'encode'
+    if not audio_ok:
+        return 'audio'
+    return 'copy' if is_mp4 else 'remux'
+
+def get_video_encode_args(preset=X264_PRESET):
+    """libx264 settings for a full 480p encode"""
+    return [
+        '-c:v', 'libx264',        # H.264 video codec
+        '-preset', preset,        # Encoding speed
+        '-crf', str(X264_CRF),    # Quality setting
+        '-vf', 'scale=854:480',   # Force 480p resolution
+    ]
+
+def choose_x264_preset(input_file, duration, threads=None, parallel_jobs=1):
+    """
+    Slowest preset the host's calibration says still keeps up with downloads.
+    Downloads deliver (download rate / source bitrate) media seconds per second;
+    the parallel_jobs encodes of `threads` threads must match that together.
+    """
+    snapshot = telemetry.get_estimator('download').snapshot()
+    download_mbps = snapshot['average_mbps']
+    source_bytes = metrics.get_file_size(input_file)
+    if not download_mbps or not source_bytes or not duration:
+        return X264_PRESET
+    if snapshot['active_seconds'] < PRESET_MIN_DOWNLOAD_SECONDS:
+        # A few seconds of samples say little about the link
+        return X264_PRESET
+
+    # Tiny sources or a bursty link must not push every encode to ultrafast
+    required_speed = min((download_mbps * 1000000 / 8) / (source_bytes / duration), PRESET_MAX_REQUIRED_SPEED)
+    preset = encoder_tuning.choose_preset(required_speed, threads or os.cpu_count() or 1, parallel_jobs)
+    if preset is None:
+        return X264_PRESET
+    print(f"🎛 x264 preset {preset}: downloads arrive at {required_speed:.1f}x realtime "
+          f"shared by {parallel_jobs} encode(s)")
+    return preset
+
+def get_chunk_layout(threads=None):
+    """
+    (workers, threads per chunk) sharing an encode's thread budget: the job's
+    threads (TranscodePool's share plus any idle slots it borrowed) or every
+    core when running on its own
+    """
+    thread_budget = threads or os.cpu_count() or 1
+    chunk_threads = min(CHUNK_ENCODE_THREADS, thread_budget)
+    return max(1, thread_budget // chunk_threads), chunk_threads
+
+def should_encode_in_chunks(action, duration, threads=None):
+    """Check if a conversion is long enough (and its thread budget big enough) for chunked encoding"""
+    return (
+        action == 'encode'
+        and CHUNKED_ENCODE_MIN_DURATION is not None
+        and bool(duration) and duration >= CHUNKED_ENCODE_MIN_DURATION
+        and get_chunk_layout(threads)[0] >= 2
+    )
+
+def escape_concat_path(path):
+    """Quote a path for an ffmpeg concat list"""
+    return "'" + os.path.abspath(path).replace("'", "'\\''") + "'"
+
+def encode_in_chunks(input_file, output_file, duration, stall_timeout=media.FFMPEG_STALL_TIMEOUT,
+                     subtitle_file=None, progress_callback=None, preset=X264_PRESET, threads=None):
+    """
+    Encode the video of a long file as GOP-aligned chunks in parallel, within
+    the job's thread budget (threads; every core if not given).
+    The video stream is cut at keyframes in one stream-copy pass, each chunk is
+    encoded independently, then the chunks are joined with the concat demuxer
+    (no re-encode) while the audio (and subtitle) is muxed once from the source.
+    Returns run_ffmpeg-style stats, or None if the source has too few keyframes to cut.
+    """
+    workers, chunk_threads = get_chunk_layout(threads)
+    points = media.choose_split_points(media.get_keyframe_times(input_file), duration,
+                                       workers * CHUNKS_PER_WORKER)
+    if not points:
+        return None
     
+    start_time = time.time()
+    chunk_dir = output_file + '.chunks'
+    shutil.rmtree(chunk_dir, ignore_errors=True)
+    os.makedirs(chunk_dir)
     try:
-        start_time = time.time()
-        response = requests.get(test_url, stream=True)
-        total_size = 0
+        # Cut the video stream only; audio is taken from the source in the final mux
+        media.run_ffmpeg([
+            'ffmpeg',
+            '-i', input_file,
+            '-map', '0:v:0',
+            '-c', 'copy',
+            '-f', 'segment',
+            '-segment_times', ','.join(f"{t:.6f}" for t in points),
+            '-reset_timestamps', '1',
+            '-y',
+            os.path.join(chunk_dir, 'source%04d.mkv')
+        ], duration=duration, stall_timeout=stall_timeout)
+        
+        sources = [os.path.join(chunk_dir, f'source{k:04d}.mkv') for k in range(len(points) + 1)]
+        sources = [source for source in sources if os.path.exists(source)]
+        bounds = [0] + points + [duration]
+        if len(sources) == len(bounds) - 1:
+            chunk_durations = [end - start for start, end in zip(bounds, bounds[1:])]
+        else:
+            chunk_durations = [duration / len(sources)] * len(sources)
+        print(f"🧩 Encoding {len(sources)} chunks on {workers} worker(s) x {chunk_threads} thread(s)...")
+        
+        lock = threading.Lock()
+        chunk_progress = {}   # chunk -> (out_time_seconds, fps)
         
-        for chunk in response.iter_content(chunk_size=8192):
-            total_size += len(chunk)
-            elapsed = time.time() - start_time
-            if elapsed > 0:
-                speed = total_size / elapsed / 1024  # KB/s
-                print(f"\rSpeed Test: {speed:.2f} KB/s", end='')
+        def encode_chunk(k):
+            source = sources[k]
+            encoded = os.path.join(chunk_dir, f'chunk{k:04d}.mp4')
+            
+            def on_progress(progress):
+                with lock:
+                    chunk_progress[k] = (progress['out_time_seconds'], 0 if progress['done'] else progress['fps'])
+                    encoded_seconds = sum(out_time for out_time, _ in chunk_progress.values())
+                    fps = sum(chunk_fps for _, chunk_fps in chunk_progress.values())
+                if progress_callback:
+                    progress_callback({
+                        'frame': None,
+                        'fps': fps,
+                        'out_time_seconds': encoded_seconds,
+                        'speed': f"{encoded_seconds / max(time.time() - start_time, 0.001):.2f}x",
+                        'percent': min(encoded_seconds / duration * 100, 100),
+                        'done': False,
+                    })
             
-            if elapsed > 10:  # Test for 10 seconds max
-                break
+            chunk_stats = media.run_ffmpeg(
+                ['ffmpeg', '-i', source, '-map', '0:v:0'] + get_video_encode_args(preset) +
+                ['-threads', str(chunk_threads), '-y', encoded],
+                duration=chunk_durations[k], stall_timeout=stall_timeout, progress_callback=on_progress
+            )
+            os.remove(source)   # Free the copy as soon as its chunk is encoded
+            return encoded, chunk_stats
         
-        print(f"\nFinal Speed: {speed:.2f} KB/s")
-        return speed
-    except Exception as e:
-        print(f"Speed test failed: {e}")
-        return 0
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='chunk') as pool:
+            results = list(pool.map(encode_chunk, range(len(sources))))
+        
+        concat_list = os.path.join(chunk_dir, 'chunks.txt')
+        with open(concat_list, 'w', encoding='utf-8') as f:
+            for encoded, _ in results:
+                f.write(f"file {escape_concat_path(encoded)}\n")
+        
+        cmd = ['ffmpeg', '-f', 'concat', '-safe', '0', '-i', concat_list, '-i', input_file]
+        if subtitle_file:
+            cmd += ['-i', subtitle_file]
+        cmd += [
+            '-map', '0:v:0',          # Joined video chunks
+            '-map', '1:a:0?',         # Audio straight from the source, encoded once
+        ]
+        if subtitle_file:
+            cmd += ['-map', '2:s', '-c:s', 'mov_text', '-metadata:s:s:0', 'language=eng']
+        cmd += [
+            '-c:v', 'copy',           # Chunks are already H.264, join without re-encoding
+            '-c:a', 'aac',
+            '-b:a', '128k',
+            '-movflags', '+faststart',
+            '-y',
+            output_file
+        ]
+        media.run_ffmpeg(cmd, duration=duration, stall_timeout=stall_timeout)
+    finally:
+        shutil.rmtree(chunk_dir, ignore_errors=True)
+    
+    elapsed = time.time() - start_time
+    frames = sum(chunk_stats['frames'] for _, chunk_stats in results)
+    return {
+        'frames': frames,
+        'elapsed': elapsed,
+        'fps': frames / elapsed if elapsed > 0 else 0,
+        'out_time': duration,
+        'chunks': len(results),
+    }
 
-def convert_for_telegram(input_file, output_file, timeout=300):
-    """Convert video to Telegram-compatible format with 480p quality and timeout"""
+def convert_for_telegram(input_file, output_file, stall_timeout=media.FFMPEG_STALL_TIMEOUT, threads=None, stats=None,
+                         action='encode', subtitle_file=None, duration=None, transcode_pool=None):
+    """
+    Convert video to Telegram-compatible format with 480p quality.
+    action is one of choose_conversion_action's results ('remux', 'audio' or 'encode').
+    If subtitle_file is given it is muxed in the same pass as a mov_text track.
+    threads caps the encoder threads; if a stats dict is given it is filled with
+    the job's frames, fps and elapsed seconds.
+    Encodes of files longer than CHUNKED_ENCODE_MIN_DURATION are split into
+    keyframe-aligned chunks encoded in parallel within `threads` (see encode_in_chunks),
+    plus the idle slots of transcode_pool for the length of the encode; the
+    x264 preset comes from choose_x264_preset.
+    The job is only stopped if its progress stalls for stall_timeout seconds or it
+    runs past a budget scaled from the media duration.
+    """
+    borrowed_threads = None
     try:
-        print(f"Starting FFmpeg conversion with {timeout} second timeout...")
+        if duration is None:
+            probe = media.probe_media(input_file)
+            duration = probe.get('duration') if probe else None
+        budget = media.get_ffmpeg_budget(duration)
+        budget_note = f", {budget:.0f}s budget" if budget else ""
+        if transcode_pool is not None and should_encode_in_chunks(action, duration, os.cpu_count()):
+            # A long encode alone in the pool takes the idle workers' cores too
+            borrowed_threads = transcode_pool.borrow_threads()
+            if borrowed_threads > (threads or 0):
+                print(f"🧵 Borrowing idle transcode slots: {borrowed_threads} threads for this encode")
+            threads = borrowed_threads
+        chunked = should_encode_in_chunks(action, duration, threads)
+        preset = X264_PRESET
+        if action == 'encode':
+            # Pool jobs run side by side; a chunked job splits its share again
+            cpu_count = os.cpu_count() or 1
+            parallel_jobs = max(1, cpu_count // threads) if threads else 1
+            encode_threads = threads
+            if chunked:
+                chunk_workers, encode_threads = get_chunk_layout(threads)
+                parallel_jobs *= chunk_workers
+            preset = choose_x264_preset(input_file, duration, encode_threads, parallel_jobs)
+        print(f"Starting FFmpeg {action} ({stall_timeout}s stall timeout{budget_note})...")
         
-        cmd = [
-            'ffmpeg', '-i', input_file,
-            '-c:v', 'libx264',        # H.264 video codec
-            '-c:a', 'aac',            # AAC audio codec
-            '-b:a', '128k',           # Audio bitrate
-            '-movflags', '+faststart', # Enable fast start for streaming
-            '-preset', 'fast',        # Encoding speed
-            '-crf', '23',             # Quality setting
-            '-vf', 'scale=854:480',   # Force 480p resolution
+        cmd = ['ffmpeg', '-i', input_file]
+        if subtitle_file:
+            cmd += ['-i', subtitle_file]  # Subtitle muxed in the same pass
+        cmd += [
+            '-map', '0:v:0',          # Main video stream
+            '-map', '0:a:0?',         # First audio stream, if any
+        ]
+        if subtitle_file:
+            cmd += [
+                '-map', '1:s',                      # Subtitle stream from second input
+                '-c:s', 'mov_text',                 # MP4-compatible subtitle codec
+                '-metadata:s:s:0', 'language=eng',  # Set subtitle language to English
+            ]
+        if action == 'encode':
+            cmd += get_video_encode_args(preset)
+        else:
+            cmd += ['-c:v', 'copy']       # Video is already compatible, no re-encoding
+        if action == 'remux':
+            cmd += ['-c:a', 'copy']       # Audio is already AAC
+        else:
+            cmd += [
+                '-c:a', 'aac',            # AAC audio codec
+                '-b:a', '128k',           # Audio bitrate
+            ]
+        cmd += ['-movflags', '+faststart']  # Enable fast start for streaming
+        if threads:
+            cmd += ['-threads', str(threads)]  # Keep parallel encodes from oversubscribing the CPU
+        cmd += [
             '-y',                     # Overwrite output file
             output_file
         ]
         
-        # Run with timeout and capture output
-        process = subprocess.run(
-            cmd, 
-            check=True, 
-            capture_output=True, 
-            text=True,
-            timeout=timeout
-        )
+        # Stream ffmpeg's progress feed and print a status line now and then
+        label = os.path.basename(input_file)
+        last_print = [0]
+        
+        def print_progress(progress):
+            now = time.time()
+            if now - last_print[0] < FFMPEG_PROGRESS_INTERVAL and not progress['done']:
+                return
+            last_print[0] = now
+            percent = f"{progress['percent']:.1f}%" if progress['percent'] is not None else f"{progress['out_time_seconds']:.0f}s"
+            print(f"⏳ {label}: {percent} | {progress['fps']:.0f} fps | {progress['speed'] or '?'}")
+        
+        job_stats = None
+        if chunked:
+            job_stats = encode_in_chunks(input_file, output_file, duration, stall_timeout=stall_timeout,
+                                         subtitle_file=subtitle_file, progress_callback=print_progress,
+                                         preset=preset, threads=threads)
+            if job_stats is None:
+                print("⚠ Not enough keyframes to encode in chunks, using a single pass")
+        if job_stats is None:
+            job_stats = media.run_ffmpeg(cmd, duration=duration, stall_timeout=stall_timeout,
+                                         progress_callback=print_progress)
+        if stats is not None:
+            stats.update(job_stats)
         
         print("✓ FFmpeg conversion completed successfully")
         return True
         
-    except subprocess.TimeoutExpired:
-        print(f"✗ FFmpeg conversion timed out after {timeout} seconds")
-        # Try to kill any lingering FFmpeg processes
-        try:
-            if os.name == 'nt':  # Windows
-                subprocess.run(['taskkill', '/f', '/im', 'ffmpeg.exe'], 
-                             capture_output=True, timeout=10)
-            else:  # Linux/Mac
-                subprocess.run(['pkill', '-f', 'ffmpeg'], 
-                             capture_output=True, timeout=10)
-        except:
-            pass
+    except subprocess.TimeoutExpired as e:
+        # run_ffmpeg already stopped this job's own process group
+        print(f"✗ FFmpeg conversion stopped after {e.timeout:.0f}s without finishing")
         return False
     except subprocess.CalledProcessError as e:
         print(f"✗ FFmpeg conversion failed: {e}")
         if e.stderr:
-            print(f"FFmpeg error: {e.stderr[:500]}...")  # Print first 500 chars
+            print(f"FFmpeg error: ...{e.stderr[-500:]}")  # Print last 500 chars
         return False
     except Exception as e:
         print(f"✗ Unexpected error during conversion: {e}")
         return False
+    finally:
+        if borrowed_threads is not None:
+            transcode_pool.return_threads(borrowed_threads)
 
-def rename_files_for_telegram(original_file, episode_number, series_name, base_directory):
-    """Rename files to simple episode format"""
+def rename_files_for_telegram(original_file, episode_number, series_name, base_directory, subtitles_embedded=False):
+    """
+    Put a file at its final 'Episode N' location (see layout.py).
+    Downloads already land there, so this is usually a no-op; anything else is
+    a same-filesystem rename. Videos with embedded subtitles get comb.py's
+    final 'Episode XX' name.
+    """
     try:
-        # Create series folder path - now in the same directory as script
-        series_folder = os.path.join(base_directory, series_name)
-        os.makedirs(series_folder, exist_ok=True)
-        
         # Get file extension
         file_ext = os.path.splitext(original_file)[1].lower()
         
         # Determine if it's a video or subtitle file
-        if file_ext in ['.mp4', '.mkv', '.avi', '.mov']:
-            # Video file
-            new_filename = f"Episode {episode_number}{file_ext}"
-            new_filepath = os.path.join(series_folder, new_filename)
-        elif file_ext in ['.srt', '.vtt', '.ass']:
-            # Subtitle file
-            new_filename = f"Episode {episode_number}{file_ext}"
-            new_filepath = os.path.join(series_folder, new_filename)
-        else:
+        if file_ext not in layout.VIDEO_EXTENSIONS and file_ext not in layout.SUBTITLE_EXTENSIONS:
             print(f"Unknown file type: {file_ext}")
             return original_file
         
+        new_filepath = layout.get_episode_path(base_directory, series_name, episode_number, file_ext,
+                                               subtitles_embedded=subtitles_embedded)
+        
         # Move and rename the file
-        if original_file != new_filepath:
-            shutil.move(original_file, new_filepath)
-            print(f"✓ Renamed to: {new_filename}")
+        if os.path.abspath(original_file) != os.path.abspath(new_filepath):
+            layout.move_into_place(original_file, new_filepath)
+            print(f"✓ Renamed to: {os.path.basename(new_filepath)}")
         
         return new_filepath
         
@@ -157,21 +467,82 @@ def classify_format(fmt):
     # If neither, it's RAW or UNKNOWN (Safe to download if Dub isn't there)
     return 'raw'
 
-def get_strict_format_hierarchy(formats):
+def estimate_source_bytes(fmt, duration=None):
+    """
+    Estimate a format's download size: filesize, then filesize_approx, then
+    bitrate x duration, then a default scaled by resolution.
+    Returns (bytes, known) where known is False for the last-resort guess.
+    """
+    duration = duration or fmt.get('duration') or DEFAULT_EPISODE_DURATION
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if size:
+        return int(size), True
+    if fmt.get('tbr'):
+        return int(fmt['tbr'] * 1000 / 8 * duration), True
+    height = fmt.get('height') or TARGET_HEIGHT
+    return int(DEFAULT_EPISODE_BYTES * height / TARGET_HEIGHT), False
+
+def predict_conversion_action(fmt):
+    """
+    Predict choose_conversion_action from a format's metadata, before downloading.
+    Unknown codecs (common for HLS) are assumed to be H.264/AAC.
+    """
+    vcodec = (fmt.get('vcodec') or 'avc1').lower()
+    acodec = (fmt.get('acodec') or 'mp4a').lower()
+    height = fmt.get('height') or 0
+    video_bit_rate = (fmt.get('vbr') or fmt.get('tbr') or 0) * 1000
+    
+    video_ok = (
+        vcodec.startswith(('avc1', 'h264'))
+        and (height <= TARGET_HEIGHT or 0 < video_bit_rate <= TARGET_VIDEO_BITRATE)
+    )
+    audio_ok = acodec == 'none' or acodec.startswith(('mp4a', 'aac'))
+    if not video_ok:
+        return 'encode'
+    if not audio_ok:
+        return 'audio'
+    return 'copy' if (fmt.get('ext') or '').lower() == 'mp4' else 'remux'
+
+def predict_output_bytes(fmt, action, duration=None):
+    """Predicted size of the file that gets uploaded"""
+    source_bytes, _ = estimate_source_bytes(fmt, duration)
+    if action != 'encode':
+        # Stream copies keep the source size (an AAC re-encode barely changes it)
+        return source_bytes
+    duration = duration or fmt.get('duration') or DEFAULT_EPISODE_DURATION
+    return min(source_bytes, int(duration * (TARGET_VIDEO_BITRATE + TARGET_AUDIO_BITRATE) / 8))
+
+def get_format_cost(fmt, duration=None, convert_for_telegram_flag=True):
+    """
+    Pipeline cost of a format in bytes-equivalent: bytes to download plus the
+    predicted transcode work (TRANSCODE_COST_PER_SECOND per media second,
+    scaled by how heavy the predicted action is).
+    """
+    source_bytes, _ = estimate_source_bytes(fmt, duration)
+    if not convert_for_telegram_flag:
+        return source_bytes
+    action = predict_conversion_action(fmt)
+    media_seconds = duration or fmt.get('duration') or DEFAULT_EPISODE_DURATION
+    # Decoding a bigger source costs more, so encodes scale with the source height
+    scale = max(1.0, (fmt.get('height') or TARGET_HEIGHT) / TARGET_HEIGHT) if action == 'encode' else 1.0
+    return source_bytes + media_seconds * TRANSCODE_COST_PER_SECOND * TRANSCODE_ACTION_WEIGHTS[action] * scale
+
+def get_strict_format_hierarchy(formats, duration=None, convert_for_telegram_flag=True):
     """
     Selects format based on strict hierarchy:
     1. CATEGORY: DUB > RAW > SUB (Always prefers Dub)
-    2. QUALITY: LOW > HIGH (Within the chosen category, picks lowest resolution first)
+    2. COST: within the chosen category, the format with the lowest predicted
+       download + transcode cost whose upload will fit Telegram's size limit
+       (falls back to the smallest predicted upload if none is guaranteed to fit)
     """
     
     dub_formats = []
     raw_formats = [] # Formats that are NOT subbed, but not explicitly dubbed
     sub_formats = []
 
-    for fmt in formats:
-        # Skip video-only or audio-only streams usually found in DASH unless strictly necessary
-        # We classify everything provided.
-        
+    # Audio-only streams are useless on their own; keep them only if nothing else exists
+    video_formats = [fmt for fmt in formats if fmt.get('vcodec') != 'none']
+    for fmt in video_formats or formats:
         category = classify_format(fmt)
         
         if category == 'dub':
@@ -181,32 +552,439 @@ def get_strict_format_hierarchy(formats):
         else:
             sub_formats.append(fmt)
 
-    # Helper to sort by resolution (height) ASCENDING (Low -> High)
-    # This ensures 360p is picked before 1080p
-    def sort_by_low_quality(fmt_list):
-        return sorted(fmt_list, key=lambda x: x.get('height') or 0, reverse=False)
+    def pick_cheapest(fmt_list):
+        if convert_for_telegram_flag:
+            fits = [fmt for fmt in fmt_list
+                    if predict_output_bytes(fmt, predict_conversion_action(fmt), duration) <= TELEGRAM_MAX_UPLOAD_BYTES]
+        else:
+            fits = [fmt for fmt in fmt_list if estimate_source_bytes(fmt, duration)[0] <= TELEGRAM_MAX_UPLOAD_BYTES]
+        if not fits:
+            print("  ⚠ No format is predicted to fit Telegram's size limit, taking the smallest")
+            return min(fmt_list, key=lambda fmt: (estimate_source_bytes(fmt, duration)[0], fmt.get('height') or 0))
+        # Lower resolution breaks ties, as before
+        best = min(fits, key=lambda fmt: (get_format_cost(fmt, duration, convert_for_telegram_flag),
+                                          fmt.get('height') or 0))
+        source_bytes, known = estimate_source_bytes(best, duration)
+        size_note = f"~{source_bytes / (1024 * 1024):.0f} MB" if known else "size unknown"
+        print(f"  -> Cost model: {best.get('format_id')} ({best.get('height') or '?'}p, {size_note}, "
+              f"predicted {predict_conversion_action(best) if convert_for_telegram_flag else 'no conversion'})")
+        return best
 
     if dub_formats:
         print("  ✓ DETECTED: Dubbed versions available.")
-        print("  -> Selecting LOWEST quality Dubbed version.")
-        # Return lowest quality dub
-        return sort_by_low_quality(dub_formats)[0]
+        print("  -> Selecting cheapest Dubbed version.")
+        return pick_cheapest(dub_formats)
     
     if raw_formats:
         print("  ⚠ No Explicit Dub found. Switching to Non-Subbed (Raw) versions.")
-        print("  -> Selecting LOWEST quality Raw version.")
-        # Return lowest quality raw
-        return sort_by_low_quality(raw_formats)[0]
+        print("  -> Selecting cheapest Raw version.")
+        return pick_cheapest(raw_formats)
         
     if sub_formats:
         print("  ⚠ Only Subbed versions found. Downloading Sub as last resort.")
-        print("  -> Selecting LOWEST quality Subbed version.")
-        return sort_by_low_quality(sub_formats)[0]
+        print("  -> Selecting cheapest Subbed version.")
+        return pick_cheapest(sub_formats)
 
     return None
 
-def download_video_with_subtitles_with_retry(url, ydl_opts, convert_for_telegram_flag=True, base_directory=None, max_retries=10):
-    """Download a single video with retry logic for failed attempts"""
+def get_info_cache_path(url):
+    """Get the cache file path for a URL"""
+    url_hash = hashlib.sha256(url.encode('utf-8')).hexdigest()[:32]
+    return os.path.join(INFO_CACHE_DIR, f"{url_hash}.json")
+
+def load_cached_info(url, ttl=INFO_CACHE_TTL):
+    """Load a cached info dict for a URL, or None if missing or expired"""
+    cache_path = get_info_cache_path(url)
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+        if entry.get('url') != url or time.time() - entry.get('cached_at', 0) > ttl:
+            return None
+        return entry.get('info')
+    except (OSError, ValueError):
+        return None
+
+def save_cached_info(url, info):
+    """Persist an info dict for a URL (written atomically)"""
+    try:
+        os.makedirs(INFO_CACHE_DIR, exist_ok=True)
+        cache_path = get_info_cache_path(url)
+        temp_path = f"{cache_path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'url': url, 'cached_at': time.time(), 'info': info}, f)
+        os.replace(temp_path, cache_path)
+    except (OSError, TypeError, ValueError) as e:
+        print(f"Note: Could not cache metadata for {url}: {e}")
+
+def invalidate_cached_info(url):
+    """Drop the cached info dict for a URL"""
+    try:
+        os.remove(get_info_cache_path(url))
+    except OSError:
+        pass
+
+def extract_info_cached(ydl, url):
+    """Extract info for a URL, reusing the on-disk cache when it is still fresh"""
+    info = load_cached_info(url)
+    if info is not None:
+        print("✓ Using cached metadata (skipping extraction)")
+        return info
+    
+    info = ydl.sanitize_info(ydl.extract_info(url, download=False))
+    save_cached_info(url, info)
+    return info
+
+def is_stale_info_error(error):
+    """Check if a download error looks like expired stream URLs"""
+    message = str(error).lower()
+    return any(pattern in message for pattern in STALE_INFO_ERRORS)
+
+def estimate_episode_footprint(fmt, info, convert_for_telegram_flag=True):
+    """
+    Estimate an episode's peak disk use in bytes: the source (from the format's
+    filesize/filesize_approx, else its bitrate x duration) plus, when converting,
+    the transcode output at the Telegram target, which coexists with the source
+    until finalize_episode removes it. The reservation is settled to the real
+    size afterwards, so this only needs to be in the right ballpark.
+    """
+    fmt = fmt or {}
+    duration = info.get('duration') or fmt.get('duration') or DEFAULT_EPISODE_DURATION
+    source_bytes, _ = estimate_source_bytes(fmt, duration)
+    
+    if not convert_for_telegram_flag:
+        return source_bytes
+    # Stream-copied output is about the source size; an encode is capped by the target bitrate
+    return source_bytes + predict_output_bytes(fmt, 'encode', duration)
+
+def settle_disk_budget(budget, budget_key, final_files):
+    """Swap an episode's estimate for the size of its final files (or release it on failure)"""
+    if budget is None or budget_key is None:
+        return
+    if not final_files:
+        budget.release(budget_key)
+        return
+    existing = [path for path in final_files if os.path.exists(path)]
+    budget.settle(budget_key, sum(os.path.getsize(path) for path in existing),
+                  path=existing[0] if existing else None)
+
+def get_conversion_action(filename, convert_for_telegram_flag=True):
+    """Get the conversion action for a downloaded file ('copy' if no conversion will run)"""
+    if not convert_for_telegram_flag or not check_ffmpeg():
+        return 'copy'
+    return choose_conversion_action(filename)
+
+# Subtitle files yt-dlp writes next to the video, in order of preference
+SUBTITLE_PATTERNS = ['.en.srt', '.en.vtt', '.en.ass', '.srt', '.vtt', '.ass']
+
+def find_downloaded_subtitles(filename):
+    """Get the subtitle files written next to a downloaded video, best match first"""
+    base_name = os.path.splitext(filename)[0]
+    return [base_name + pattern for pattern in SUBTITLE_PATTERNS if os.path.exists(base_name + pattern)]
+
+def finalize_episode(filename, episode_number, series_name, convert_for_telegram_flag=True, base_directory=None,
+                     threads=None, stats=None, action=None, transcode_pool=None):
+    """
+    Convert (if needed) and rename a downloaded episode and its subtitles.
+    The subtitle track is muxed in the same ffmpeg pass as the conversion.
+    transcode_pool is the TranscodePool running this job, if any (see convert_for_telegram).
+    Returns the list of final file paths.
+    """
+    final_files = []
+    finalize_start = time.time()
+    converted = False
+
+    # Downloads live in <base>/<series>/
+    if base_directory is None:
+        base_directory = os.path.dirname(os.path.dirname(os.path.abspath(filename)))
+
+    if action is None:
+        action = get_conversion_action(filename, convert_for_telegram_flag)
+
+    # Mux the subtitle in the same pass; a compatible MP4 still needs a remux to add the track
+    subtitle_files = find_downloaded_subtitles(filename)
+    embed_subtitle = subtitle_files[0] if subtitle_files and action != 'copy' else None
+    remux_only_for_subtitle = False
+    if subtitle_files and action == 'copy' and convert_for_telegram_flag and check_ffmpeg():
+        action = 'remux'
+        embed_subtitle = subtitle_files[0]
+        remux_only_for_subtitle = True
+
+    # Convert for Telegram if requested, ffmpeg is available AND the probe says it's needed
+    if action != 'copy':
+        action_labels = {
+            'remux': "Remuxing to MP4 (stream copy, no re-encode)...",
+            'audio': "Transcoding audio to AAC (video stream copied)...",
+            'encode': "Converting for Telegram compatibility (480p)...",
+        }
+        print(action_labels.get(action, action_labels['encode']))
+        if embed_subtitle:
+            print(f"  + Embedding subtitle: {os.path.basename(embed_subtitle)}")
+        # Convert into the staging dir (same filesystem), then rename into place
+        output_file = layout.get_staging_path(
+            base_directory,
+            layout.get_episode_path(base_directory, series_name, episode_number, '.mp4', subtitles_embedded=True)
+        )
+
+        transcode_start = time.time()
+        transcode_retries = 0
+        converted = convert_for_telegram(filename, output_file, threads=threads, stats=stats,
+                                         action=action, subtitle_file=embed_subtitle,
+                                         transcode_pool=transcode_pool)
+        if not converted and embed_subtitle and not remux_only_for_subtitle:
+            # A broken subtitle shouldn't cost us the conversion
+            print("⚠ Retrying conversion without the subtitle track...")
+            embed_subtitle = None
+            transcode_retries += 1
+            converted = convert_for_telegram(filename, output_file, threads=threads, stats=stats,
+                                             action=action, transcode_pool=transcode_pool)
+
+        metrics.record_stage('transcode', time.time() - transcode_start, series_name, episode_number,
+                             nbytes=metrics.get_file_size(output_file) if converted else None,
+                             retries=transcode_retries, error=None if converted else 'ConversionFailed',
+                             action=action, subtitle_embedded=bool(converted and embed_subtitle))
+
+        if converted:
+            print(f"✓ Telegram-compatible version created")
+            # Remove original file to save space
+            if os.path.exists(filename):
+                os.remove(filename)
+                print("✓ Original file removed")
+            
+            # The subtitles now live inside the video
+            if embed_subtitle:
+                for subtitle_file in subtitle_files:
+                    os.remove(subtitle_file)
+                print("✓ Subtitle embedded, subtitle files removed")
+
+            # Rename the converted file
+            renamed_file = rename_files_for_telegram(
+                output_file, episode_number, series_name, base_directory,
+                subtitles_embedded=bool(embed_subtitle)
+            )
+            final_files.append(renamed_file)
+        else:
+            print("✗ Failed to create Telegram-compatible version")
+            # Keep original file and rename it
+            renamed_file = rename_files_for_telegram(
+                filename, episode_number, series_name, base_directory
+            )
+            final_files.append(renamed_file)
+    else:
+        # Skip conversion if file is already a compatible MP4 or FFmpeg not available
+        if convert_for_telegram_flag and not check_ffmpeg():
+            print("⚠ FFmpeg not found. Cannot convert for Telegram.")
+        elif convert_for_telegram_flag:
+            print("✓ File is already a Telegram-compatible MP4, skipping conversion")
+
+        # Rename the original file
+        renamed_file = rename_files_for_telegram(
+            filename, episode_number, series_name, base_directory
+        )
+        final_files.append(renamed_file)
+
+    # Also rename subtitle files that were not embedded
+    for subtitle_file in find_downloaded_subtitles(filename):
+        renamed_subtitle = rename_files_for_telegram(
+            subtitle_file, episode_number, series_name, base_directory
+        )
+        final_files.append(renamed_subtitle)
+
+    # The ready video is 'transcoded' (even if it needed no work) or 'embedded' when it carries the
+    # subtitles; a failed conversion stays 'downloaded' so the next run retries it
+    if action == 'copy':
+        video_state = 'transcoded'
+    elif not converted:
+        video_state = 'downloaded'
+    else:
+        video_state = 'embedded' if embed_subtitle else 'transcoded'
+    record_in_ledger(series_name, episode_number, video_state, path=final_files[0],
+                     seconds=time.time() - finalize_start)
+
+    return final_files
+
+def record_in_ledger(series_name, episode_number, state, **fields):
+    """Record an episode's state in the ledger without letting ledger errors break the download"""
+    if episode_number is None:
+        return
+    try:
+        ledger.get_ledger().record(series_name, episode_number, state, **fields)
+    except (sqlite3.Error, ValueError) as e:
+        print(f"Note: Could not update ledger: {e}")
+
+def find_episode_subtitles(video_path):
+    """Get subtitle files already renamed next to an episode video"""
+    base_name = os.path.splitext(video_path)[0]
+    return [base_name + ext for ext in ['.srt', '.vtt', '.ass'] if os.path.exists(base_name + ext)]
+
+# Result of an episode a previous run already uploaded; its files have usually
+# been moved to done/ since, so there is nothing left to hand to later stages
+ALREADY_UPLOADED = object()
+
+def resume_from_ledger(url, convert_for_telegram_flag=True, base_directory=None):
+    """
+    Use the ledger to skip work a previous run already did for this URL.
+    Returns the episode's final file list if nothing (more than finalizing) is needed,
+    ALREADY_UPLOADED if the episode was uploaded, else None.
+    """
+    try:
+        row = ledger.get_ledger().get_by_url(url)
+    except sqlite3.Error as e:
+        print(f"Note: Could not read ledger: {e}")
+        return None
+    if not row:
+        return None
+    
+    if ledger.has_reached(row, 'uploaded'):
+        print(f"✓ Ledger: {row['series']} episode {row['episode']} was already uploaded, skipping")
+        return ALREADY_UPLOADED
+    
+    if not ledger.is_file_current(row):
+        return None
+    
+    if ledger.has_reached(row, 'transcoded'):
+        print(f"✓ Ledger: {row['series']} episode {row['episode']} is already processed, skipping download")
+        return [row['path']] + find_episode_subtitles(row['path'])
+    
+    if row['state'] == 'downloaded':
+        # Crashed between download and conversion: only the conversion is missing
+        print(f"✓ Ledger: {row['series']} episode {row['episode']} is already downloaded, resuming conversion")
+        return finalize_episode(row['path'], row['episode'], row['series'], convert_for_telegram_flag, base_directory)
+    
+    return None
+
+class TranscodePool:
+    """
+    Runs finalize_episode (and therefore convert_for_telegram) on a separate
+    thread pool so downloads keep going while encodes run.
+    The pool is sized from the core count and every job gets its own share of
+    encoder threads, so N parallel encodes don't oversubscribe the CPU.
+    Long files (CHUNKED_ENCODE_MIN_DURATION) split that share across
+    parallel chunks and borrow the shares of idle workers while nothing is
+    waiting; jobs that start meanwhile wait for those slots to come back, so the
+    total never goes over one share per worker.
+    """
+    
+    def __init__(self, workers=None, threads_per_job=None):
+        cpu_count = os.cpu_count() or 1
+        # A calibrated host knows which split of its cores gives the most throughput
+        self.threads_per_job = (threads_per_job or encoder_tuning.get_threads_per_job()
+                                or max(1, min(TRANSCODE_THREADS_PER_JOB, cpu_count)))
+        self.workers = workers or max(1, cpu_count // self.threads_per_job)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='transcode')
+        self.lock = threading.Lock()
+        self.slot_freed = threading.Condition(self.lock)
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.slots_in_use = 0     # Running jobs plus slots borrowed by long encodes
+        print(f"✓ Transcode pool: {self.workers} worker(s) x {self.threads_per_job} thread(s) on {cpu_count} core(s)")
+    
+    def queue_depth(self):
+        """Number of jobs waiting for a free worker"""
+        with self.lock:
+            return self.queued
+    
+    def report(self):
+        """Print the current queue depth"""
+        with self.lock:
+            print(f"🎞 Transcode queue: {self.queued} waiting, {self.running} running, {self.completed} done")
+    
+    def borrow_threads(self):
+        """
+        Encoder threads for a running job: its own share plus every idle worker's
+        share when no job is waiting. Give them back with return_threads.
+        """
+        with self.lock:
+            if self.queued:
+                return self.threads_per_job
+            idle = max(0, self.workers - self.slots_in_use)
+            self.slots_in_use += idle
+            return self.threads_per_job * (1 + idle)
+    
+    def return_threads(self, threads):
+        """Give back the idle slots taken by borrow_threads"""
+        borrowed = threads // self.threads_per_job - 1
+        if borrowed > 0:
+            with self.lock:
+                self.slots_in_use -= borrowed
+                self.slot_freed.notify_all()
+    
+    def submit(self, filename, episode_number, series_name, convert_for_telegram_flag=True, base_directory=None,
+               action='encode'):
+        """Queue an episode for conversion; returns a Future with the final file list"""
+        with self.lock:
+            self.queued += 1
+        self.report()
+        return self.executor.submit(
+            self._run_job, filename, episode_number, series_name, convert_for_telegram_flag, base_directory, action
+        )
+    
+    def _run_job(self, filename, episode_number, series_name, convert_for_telegram_flag, base_directory, action):
+        with self.lock:
+            # A long encode may hold this worker's slot
+            while self.slots_in_use >= self.workers:
+                self.slot_freed.wait()
+            self.queued -= 1
+            self.running += 1
+            self.slots_in_use += 1
+        
+        stats = {}
+        try:
+            return finalize_episode(
+                filename, episode_number, series_name, convert_for_telegram_flag, base_directory,
+                threads=self.threads_per_job, stats=stats, action=action, transcode_pool=self
+            )
+        finally:
+            with self.lock:
+                self.running -= 1
+                self.slots_in_use -= 1
+                self.completed += 1
+                self.slot_freed.notify_all()
+            if stats:
+                print(f"🎞 Transcoded {series_name} episode {episode_number}: "
+                      f"{stats['frames']} frames in {stats['elapsed']:.1f}s ({stats['fps']:.1f} fps)")
+            self.report()
+    
+    def shutdown(self, wait=True):
+        """Wait for queued encodes and stop the pool"""
+        self.executor.shutdown(wait=wait)
+
+def get_series_name(ydl, info):
+    """
+    Series folder name exactly as the download template will write it, which is
+    also the series key for the ledger, metrics and the disk budget
+    """
+    try:
+        return layout.get_series_key(ydl.prepare_filename(info))
+    except Exception:
+        return layout.get_series_folder_name(info.get('series') or 'Unknown Series')
+
+def resolve_result_files(result):
+    """Wait for a transcode Future if needed and return the final file list (None on failure)"""
+    if isinstance(result, Future):
+        try:
+            return result.result()
+        except Exception as e:
+            print(f"✗ Transcode job failed: {e}")
+            return None
+    return result
+
+def download_video_with_subtitles_with_retry(url, ydl_opts, convert_for_telegram_flag=True, base_directory=None, max_retries=10,
+                                             transcode_pool=None, budget=None, budget_order=None):
+    """
+    Download a single video with retry logic for failed attempts.
+    With a transcode_pool, episodes that need converting are queued on the pool and
+    a Future resolving to the final file list is returned instead of the list.
+    With a DiskBudget, the download waits until its estimated footprint fits
+    (and, for an ordered budget, until budget_order's turn).
+    """
+    # Re-runs only do the work the ledger says is missing
+    resumed_files = resume_from_ledger(url, convert_for_telegram_flag, base_directory)
+    if resumed_files:
+        return resumed_files
+    
+    info = None
+    budget_key = None
     for attempt in range(1, max_retries + 1):
         try:
             print(f"\n🔄 Attempt {attempt}/{max_retries} for URL: {url}")
@@ -215,12 +993,19 @@ def download_video_with_subtitles_with_retry(url, ydl_opts, convert_for_telegram
             current_opts = ydl_opts.copy()
 
             with yt_dlp.YoutubeDL(current_opts) as ydl:
-                # Extract info first to see what we're dealing with
-                info = ydl.extract_info(url, download=False)
+                # Extract info once; retries reuse it instead of hitting HiAnime again
+                extracted_now = info is None
+                if extracted_now:
+                    extract_start = time.time()
+                    info = extract_info_cached(ydl, url)
                 
                 title = info.get('title', 'Unknown title')
-                series_name = info.get('series', 'Unknown Series')
+                series_name = get_series_name(ydl, info)
                 episode_number = info.get('episode_number', 1)
+                if extracted_now:
+                    metrics.record_stage('extract', time.time() - extract_start,
+                                         series_name, episode_number, url=url)
+                    record_in_ledger(series_name, episode_number, 'extracted', url=url)
                 
                 print(f"Downloading: {title}")
                 print(f"Series: {series_name}, Episode: {episode_number}")
@@ -228,7 +1013,8 @@ def download_video_with_subtitles_with_retry(url, ydl_opts, convert_for_telegram
                 # === NEW SELECTION LOGIC ===
                 available_formats = info.get('formats', [])
                 
-                best_format = get_strict_format_hierarchy(available_formats)
+                best_format = get_strict_format_hierarchy(available_formats, info.get('duration'),
+                                                          convert_for_telegram_flag)
 
                 if best_format:
                     format_id = best_format['format_id']
@@ -251,67 +1037,61 @@ def download_video_with_subtitles_with_retry(url, ydl_opts, convert_for_telegram
                 if available_subs:
                     print(f"Available subtitle languages: {list(available_subs.keys())}")
                 
-                # Update the YDL object with the forced format
+                # Only start once the episode (plus its transcode output) fits on disk
+                if budget is not None and budget_key is None:
+                    selected = best_format or next((f for f in available_formats if f.get('format_id') == current_opts['format']), None)
+                    footprint = estimate_episode_footprint(selected, info, convert_for_telegram_flag)
+                    budget.acquire((series_name, episode_number), footprint, order=budget_order)
+                    budget_key = (series_name, episode_number)
+                
+                # Download from the already extracted info with the forced format
+                download_start = time.time()
                 with yt_dlp.YoutubeDL(current_opts) as ydl_final:
-                    ydl_final.download([url])
-                    filename = ydl_final.prepare_filename(info)
+                    result_info = ydl_final.process_ie_result(copy.deepcopy(info), download=True)
+                    filename = ydl_final.prepare_filename(result_info)
                 
                 print(f"✓ Completed: {title}")
+                record_in_ledger(series_name, episode_number, 'downloaded', url=url, path=filename,
+                                 seconds=time.time() - download_start)
+                metrics.record_stage('download', time.time() - download_start, series_name, episode_number,
+                                     nbytes=metrics.get_file_size(filename), retries=attempt - 1,
+                                     format_id=current_opts['format'])
                 
-                final_files = []
+                # Probe once to pick remux / audio-only / full encode
+                action = get_conversion_action(filename, convert_for_telegram_flag)
                 
-                # Convert for Telegram if requested and ffmpeg is available AND file is not already MP4
-                if convert_for_telegram_flag and check_ffmpeg() and not filename.lower().endswith('.mp4'):
-                    print("Converting for Telegram compatibility (480p)...")
-                    base_name = os.path.splitext(filename)[0]
-                    output_file = f"{base_name}_telegram.mp4"
-                    
-                    if convert_for_telegram(filename, output_file, timeout=300):
-                        print(f"✓ Telegram-compatible 480p version created")
-                        # Remove original file to save space
-                        if os.path.exists(filename):
-                            os.remove(filename)
-                            print("✓ Original file removed")
-                        
-                        # Rename the converted file
-                        renamed_file = rename_files_for_telegram(
-                            output_file, episode_number, series_name, base_directory
-                        )
-                        final_files.append(renamed_file)
-                    else:
-                        print("✗ Failed to create Telegram-compatible version")
-                        # Keep original file and rename it
-                        renamed_file = rename_files_for_telegram(
-                            filename, episode_number, series_name, base_directory
-                        )
-                        final_files.append(renamed_file)
-                else:
-                    # Skip conversion if file is already MP4 or FFmpeg not available
-                    if convert_for_telegram_flag and not check_ffmpeg():
-                        print("⚠ FFmpeg not found. Cannot convert for Telegram.")
-                    elif convert_for_telegram_flag and filename.lower().endswith('.mp4'):
-                        print("✓ File is already in MP4 format, skipping conversion")
-                    
-                    # Rename the original file
-                    renamed_file = rename_files_for_telegram(
-                        filename, episode_number, series_name, base_directory
+                # Hand full encodes to the transcode pool so this download worker can move on;
+                # stream-copy remuxes are cheap and run inline
+                if transcode_pool and action == 'encode':
+                    future = transcode_pool.submit(
+                        filename, episode_number, series_name, convert_for_telegram_flag, base_directory,
+                        action=action
                     )
-                    final_files.append(renamed_file)
-                
-                # Also rename subtitle files if they exist
-                subtitle_patterns = ['.en.srt', '.srt', '.vtt', '.ass']
-                for pattern in subtitle_patterns:
-                    subtitle_file = os.path.splitext(filename)[0] + pattern
-                    if os.path.exists(subtitle_file):
-                        renamed_subtitle = rename_files_for_telegram(
-                            subtitle_file, episode_number, series_name, base_directory
-                        )
-                        final_files.append(renamed_subtitle)
+                    if budget is not None:
+                        future.add_done_callback(
+                            lambda f: settle_disk_budget(budget, budget_key, resolve_result_files(f)))
+                    return future
                 
+                final_files = finalize_episode(
+                    filename, episode_number, series_name, convert_for_telegram_flag, base_directory,
+                    action=action
+                )
+                settle_disk_budget(budget, budget_key, final_files)
                 return final_files
                 
+        except disk_budget.DiskBudgetError as e:
+            # Retrying won't make the disk any bigger
+            print(f"✗ Not downloading {url}: {e}")
+            return None
         except Exception as e:
             print(f"✗ Error downloading {url} (Attempt {attempt}/{max_retries}): {e}")
+            metrics.record_stage('extract' if info is None else 'download', retries=attempt - 1, error=e, url=url)
+            
+            # Expired stream URLs need a fresh extraction on the next attempt
+            if info is not None and is_stale_info_error(e):
+                print("ℹ Cached stream URLs look stale, re-extracting on next attempt")
+                invalidate_cached_info(url)
+                info = None
             
             if attempt < max_retries:
                 # Calculate wait time with exponential backoff
@@ -321,7 +1101,7 @@ def download_video_with_subtitles_with_retry(url, ydl_opts, convert_for_telegram
                 
                 # Optional: Clear any partial downloads
                 try:
-                    if 'info' in locals():
+                    if info:
                         temp_filename = current_opts.get('outtmpl', {}).get('default', '%(title)s.%(ext)s')
                         if isinstance(temp_filename, str):
                             temp_file = temp_filename % info
@@ -332,10 +1112,125 @@ def download_video_with_subtitles_with_retry(url, ydl_opts, convert_for_telegram
                     print(f"Note: Could not clean up partial files: {cleanup_error}")
             else:
                 print(f"❌ All {max_retries} attempts failed for URL: {url}")
+                if budget is not None and budget_key is not None:
+                    budget.release(budget_key)
                 return None
     
     return None
 
+def download_playlist_concurrently(entries, ydl_opts, convert_for_telegram_flag=True, base_directory=None,
+                                   workers=DOWNLOAD_WORKERS, per_host_limit=MAX_DOWNLOADS_PER_HOST, max_retries=10,
+                                   on_complete=None, transcode_pool=None, budget=None):
+    """
+    Download playlist entries with a bounded worker pool.
+    Each episode keeps its own retry loop; a per-host semaphore caps how many
+    downloads hit the same server and starts on a host are spaced out.
+    If given, on_complete(index, result_files) is called from the worker as soon
+    as each entry finishes (result_files is None on failure), so a blocking
+    callback applies backpressure to the downloads.
+    With a transcode_pool, encodes run on the pool and on_complete fires once
+    the episode's transcode finishes. A DiskBudget is passed on to every episode,
+    with the playlist index as its admission order.
+    on_complete gets ALREADY_UPLOADED for episodes the ledger shows as uploaded.
+    Returns (all_downloaded_files, failed_videos) in playlist order.
+    """
+    total = len(entries)
+    failed_videos = []
+    jobs = []
+
+    for i, entry in enumerate(entries, 1):
+        if not entry:  # Some entries might be None
+            print(f"Empty entry at position {i}")
+            failed_videos.append((i, "Empty entry"))
+            if budget is not None:
+                budget.pass_turn(i)
+            if on_complete:
+                on_complete(i, None)
+            continue
+        video_url = entry.get('url') or entry.get('webpage_url')
+        if not video_url:
+            print(f"Could not get URL for video {i}")
+            failed_videos.append((i, "No URL"))
+            if budget is not None:
+                budget.pass_turn(i)
+            if on_complete:
+                on_complete(i, None)
+            continue
+        jobs.append((i, video_url))
+
+    host_semaphores = {}
+    host_last_start = {}
+    host_lock = threading.Lock()
+
+    def get_host_semaphore(video_url):
+        host = urlparse(video_url).netloc.lower()
+        with host_lock:
+            if host not in host_semaphores:
+                host_semaphores[host] = threading.Semaphore(per_host_limit)
+            return host, host_semaphores[host]
+
+    def wait_for_start_slot(host):
+        # Space out download starts on the same host to avoid being blocked
+        while True:
+            with host_lock:
+                now = time.time()
+                next_start = host_last_start.get(host, 0) + DOWNLOAD_START_DELAY
+                if now >= next_start:
+                    host_last_start[host] = now
+                    return
+                wait_time = next_start - now
+            time.sleep(wait_time)
+
+    def download_job(i, video_url):
+        host, semaphore = get_host_semaphore(video_url)
+        result_files = None
+        try:
+            with semaphore:
+                wait_for_start_slot(host)
+                print(f"\n--- Processing video {i}/{total} ---")
+                result_files = download_video_with_subtitles_with_retry(
+                    video_url, ydl_opts, convert_for_telegram_flag, base_directory, max_retries=max_retries,
+                    transcode_pool=transcode_pool, budget=budget, budget_order=i
+                )
+        finally:
+            # Resumed, failed or admitted: later episodes may take budget now
+            if budget is not None:
+                budget.pass_turn(i)
+            if on_complete:
+                if isinstance(result_files, Future):
+                    # Download is done, report the episode once its transcode finishes
+                    result_files.add_done_callback(lambda f: on_complete(i, resolve_result_files(f)))
+                else:
+                    on_complete(i, result_files)
+        return result_files
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {executor.submit(download_job, i, video_url): (i, video_url) for i, video_url in jobs}
+        for future in as_completed(futures):
+            i, video_url = futures[future]
+            try:
+                result_files = resolve_result_files(future.result())
+            except Exception as e:
+                print(f"✗ Worker error on video {i}: {e}")
+                result_files = None
+
+            if result_files is ALREADY_UPLOADED:
+                print(f"✓ Video {i} was already uploaded")
+            elif result_files:
+                results[i] = result_files
+                print(f"✓ Successfully processed video {i}")
+            else:
+                print(f"✗ Failed to process video {i} after {max_retries} attempts")
+                failed_videos.append((i, video_url))
+
+    all_downloaded_files = []
+    for i in sorted(results):
+        all_downloaded_files.extend(results[i])
+    failed_videos.sort(key=lambda item: item[0])
+
+    return all_downloaded_files, failed_videos
+
 def run_comb_script():
     """Run the comb.py script after all downloads are complete"""
     try:
@@ -361,7 +1256,7 @@ def run_comb_script():
 def get_ydl_opts(base_directory, convert_for_tg):
     """Get yt-dlp options"""
     ydl_opts = {
-        'outtmpl': os.path.join(base_directory, '%(series)s', '%(series)s - %(episode_number)s - %(episode)s.%(ext)s'),
+        'outtmpl': layout.get_download_outtmpl(base_directory),  # Final 'Episode N' name, no later move
         'verbose': False, # Reduced verbosity for cleaner output
         'concurrent_fragments': 5,
         'fragment_retries': 10,
@@ -372,6 +1267,7 @@ def get_ydl_opts(base_directory, convert_for_tg):
         'skip_unavailable_fragments': True,
         'continuedl': True,
         'noprogress': False,
+        'progress_hooks': [record_download_progress],
         'http_chunk_size': 10485760,
         'http_headers': {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
@@ -405,12 +1301,6 @@ def get_ydl_opts(base_directory, convert_for_tg):
     return ydl_opts
 
 def main():
-    # Test speed first
-    print("Running speed test...")
-    speed = speed_test()
-    if speed < 500:  # If less than 500 KB/s
-        print("⚠ Warning: Your connection speed seems slow for downloads")
-    
     if len(sys.argv) > 1:
         url = sys.argv[1]
     else:
@@ -433,6 +1323,14 @@ def main():
         if sys.argv[2].lower() in ['false', '0', 'no', 'n']:
             convert_for_tg = False
 
+    # Optional number of parallel download workers for playlists
+    download_workers = DOWNLOAD_WORKERS
+    if len(sys.argv) > 3:
+        try:
+            download_workers = max(1, int(sys.argv[3]))
+        except ValueError:
+            print(f"⚠ Invalid worker count '{sys.argv[3]}', using {DOWNLOAD_WORKERS}")
+
     # Use the new function to get ydl_opts
     ydl_opts = get_ydl_opts(base_directory, convert_for_tg)
 
@@ -444,36 +1342,23 @@ def main():
         if 'entries' in info:
             # It's a playlist
             print(f"Found playlist with {len(info['entries'])} videos")
-            all_downloaded_files = []
-            failed_videos = []
+            print(f"Using {download_workers} download worker(s), max {MAX_DOWNLOADS_PER_HOST} per host")
             
-            for i, entry in enumerate(info['entries'], 1):
-                if entry:  # Some entries might be None
-                    video_url = entry.get('url') or entry.get('webpage_url')
-                    if video_url:
-                        print(f"\n--- Processing video {i}/{len(info['entries'])} ---")
-                        result_files = download_video_with_subtitles_with_retry(
-                            video_url, ydl_opts, convert_for_tg, base_directory, max_retries=10
-                        )
-                        
-                        if result_files:
-                            all_downloaded_files.extend(result_files)
-                            print(f"✓ Successfully processed video {i}")
-                        else:
-                            print(f"✗ Failed to process video {i} after 10 attempts")
-                            failed_videos.append((i, video_url))
-                            continue
-                            
-                        # Add delay between downloads to avoid being blocked
-                        if i < len(info['entries']):
-                            print("Waiting 3 seconds before next download...")
-                            time.sleep(3)
-                    else:
-                        print(f"Could not get URL for video {i}")
-                        failed_videos.append((i, "No URL"))
-                else:
-                    print(f"Empty entry at position {i}")
-                    failed_videos.append((i, "Empty entry"))
+            # Encodes run on their own pool so downloads are never blocked by ffmpeg
+            transcode_pool = TranscodePool() if convert_for_tg else None
+            # Nothing is uploaded during this run, so stop admitting episodes before the disk fills
+            budget = disk_budget.DiskBudget(base_directory)
+            print(f"✓ {budget.report()}")
+            try:
+                all_downloaded_files, failed_videos = download_playlist_concurrently(
+                    info['entries'], ydl_opts, convert_for_tg, base_directory,
+                    workers=download_workers, max_retries=10, transcode_pool=transcode_pool,
+                    budget=budget
+                )
+            finally:
+                if transcode_pool:
+                    transcode_pool.shutdown()
+            print(f"💾 {budget.report()}")
                     
             print(f"\n🎉 Playlist download completed!")
             print(f"Successfully processed: {len(all_downloaded_files)} files")
@@ -491,8 +1376,11 @@ def main():
         else:
             # It's a single video
             print("Downloading single video...")
-            result_files = download_video_with_subtitles_with_retry(url, ydl_opts, convert_for_tg, base_directory, max_retries=10)
-            if result_files:
+            result_files = download_video_with_subtitles_with_retry(url, ydl_opts, convert_for_tg, base_directory, max_retries=10,
+                                                                   budget=disk_budget.DiskBudget(base_directory))
+            if result_files is ALREADY_UPLOADED:
+                print("✓ This video was already uploaded, nothing to do")
+            elif result_files:
                 print(f"🎉 Single video download completed!")
                 print(f"Files downloaded to: {base_directory}")
                 for file in result_files:
@@ -500,6 +1388,9 @@ def main():
             else:
                 print("❌ Failed to download video after 10 attempts")
         
+        # Measured from the real downloads, no test traffic needed
+        telemetry.report()
+        
         # Run comb.py after all downloads are complete
         run_comb_script()
                 
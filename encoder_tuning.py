@@ -0,0 +1,220 @@
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import tempfile
+import threading
+import subprocess
+import media
+
+# Get the directory where the script is located
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# One calibration profile per host, so a shared checkout works on every node
+PROFILE_DIR = os.path.join(SCRIPT_DIR, '.encoder_profiles')
+
+# Calibration defaults (override the clip length with: python3 encoder_tuning.py [seconds])
+CALIBRATION_SECONDS = 10                  # Length of the synthetic clip
+CALIBRATION_SOURCE = '1280x720'           # Clip resolution; it is encoded to 480p like real episodes
+CALIBRATION_PRESETS = ['ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium', 'slow']
+CALIBRATION_THREADS = [1, 2, 4, 8]        # Thread counts measured (capped at the core count)
+CALIBRATION_CRF = 23                      # Same quality setting as convert_for_telegram
+
+# Preset selection
+REFERENCE_PRESET = 'fast'     # Preset used to pick the best threads per encode
+SPEED_HEADROOM = 1.25         # Real episodes are harder to encode than the synthetic clip
+
+def get_profile_path(host=None):
+    """Profile file of a host (this one by default)"""
+    return os.path.join(PROFILE_DIR, f"{host or socket.gethostname()}.json")
+
+def get_thread_counts():
+    """Thread counts worth measuring on this host"""
+    cpu_count = os.cpu_count() or 1
+    return sorted({min(threads, cpu_count) for threads in CALIBRATION_THREADS} | {cpu_count})
+
+def generate_calibration_clip(path, seconds=CALIBRATION_SECONDS):
+    """Render a noisy synthetic clip (noise keeps x264 from coasting on flat frames)"""
+    cmd = [
+        'ffmpeg',
+        '-f', 'lavfi', '-i', f"testsrc2=size={CALIBRATION_SOURCE}:rate=24",
+        '-t', str(seconds),
+        '-vf', 'noise=alls=12:allf=t',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-qp', '0',   # Lossless, so decoding is all that's left
+        '-pix_fmt', 'yuv420p',
+        '-y', path
+    ]
+    subprocess.run(cmd, capture_output=True, check=True, timeout=300)
+    return path
+
+def measure_encode(clip, output_path, preset, threads, seconds=CALIBRATION_SECONDS):
+    """Encode the clip the way convert_for_telegram does and measure it"""
+    cmd = [
+        'ffmpeg',
+        '-i', clip,
+        '-c:v', 'libx264',
+        '-preset', preset,
+        '-crf', str(CALIBRATION_CRF),
+        '-vf', 'scale=854:480',
+        '-threads', str(threads),
+        '-an',
+        '-y', output_path
+    ]
+    stats = media.run_ffmpeg(cmd, duration=seconds)
+    return {
+        'preset': preset,
+        'threads': threads,
+        'fps': round(stats['fps'], 2),
+        # Media seconds encoded per wall second (1.0 = realtime)
+        'speed': round(seconds / stats['elapsed'], 3) if stats['elapsed'] > 0 else 0,
+        'bytes_per_second': round(os.path.getsize(output_path) / seconds),
+    }
+
+def calibrate(seconds=CALIBRATION_SECONDS):
+    """
+    Measure every preset at every thread count on a synthetic clip and save the
+    host's profile. Returns the profile dict.
+    """
+    work_dir = tempfile.mkdtemp(prefix='encoder_tuning_')
+    try:
+        print(f"🎬 Generating a {seconds}s {CALIBRATION_SOURCE} calibration clip...")
+        clip = generate_calibration_clip(os.path.join(work_dir, 'clip.mkv'), seconds)
+
+        results = []
+        for threads in get_thread_counts():
+            for preset in CALIBRATION_PRESETS:
+                try:
+                    result = measure_encode(clip, os.path.join(work_dir, 'out.mp4'), preset, threads, seconds)
+                except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+                    print(f"❌ {preset} x {threads} thread(s) failed: {e}")
+                    continue
+                results.append(result)
+                print(f"  {preset:<10} {threads:>2} thread(s): {result['fps']:7.1f} fps | "
+                      f"{result['speed']:5.2f}x realtime | {result['bytes_per_second'] * 8 / 1000:6.0f} kbps")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    profile = {
+        'host': socket.gethostname(),
+        'cpu_count': os.cpu_count() or 1,
+        'created': time.time(),
+        'clip_seconds': seconds,
+        'source': CALIBRATION_SOURCE,
+        'crf': CALIBRATION_CRF,
+        'results': results,
+    }
+    save_profile(profile)
+    return profile
+
+def save_profile(profile):
+    """Write this host's profile atomically"""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = get_profile_path(profile['host'])
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(profile, f, indent=2)
+    os.replace(temp_path, path)
+
+    global _profile, _profile_loaded
+    with _profile_lock:
+        _profile, _profile_loaded = profile, True
+
+def load_profile(path=None):
+    """This host's profile, or None if it was never calibrated (or the core count changed)"""
+    path = path or get_profile_path()
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            profile = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if profile.get('cpu_count') != (os.cpu_count() or 1):
+        print(f"⚠️ Encoder profile {os.path.basename(path)} was measured on {profile.get('cpu_count')} cores, "
+              f"ignoring it (run: python3 encoder_tuning.py)")
+        return None
+    if not profile.get('results'):
+        return None
+    return profile
+
+_profile = None
+_profile_loaded = False
+_profile_lock = threading.Lock()
+
+def get_profile():
+    """Get this host's profile, loading it on first use"""
+    global _profile, _profile_loaded
+    with _profile_lock:
+        if not _profile_loaded:
+            _profile = load_profile()
+            _profile_loaded = True
+        return _profile
+
+def get_results_for_threads(profile, threads):
+    """Measurements at the largest calibrated thread count not above threads"""
+    counts = sorted({result['threads'] for result in profile['results']})
+    usable = [count for count in counts if count <= threads]
+    count = usable[-1] if usable else counts[0]
+    return [result for result in profile['results'] if result['threads'] == count]
+
+def choose_preset(required_speed, threads, parallel_jobs=1, profile=None):
+    """
+    Slowest calibrated preset that still keeps pace: parallel_jobs encodes of
+    `threads` threads each must together reach required_speed (media seconds per
+    second, e.g. what downloads deliver). Falls back to the fastest preset when
+    none keeps up. Returns None without a profile.
+    """
+    profile = profile or get_profile()
+    if not profile:
+        return None
+
+    speeds = {result['preset']: result['speed'] for result in get_results_for_threads(profile, threads)}
+    presets = [preset for preset in CALIBRATION_PRESETS if preset in speeds]
+    if not presets:
+        return None
+
+    needed = required_speed * SPEED_HEADROOM / max(1, parallel_jobs)
+    keeping_pace = [preset for preset in presets if speeds[preset] >= needed]
+    return keeping_pace[-1] if keeping_pace else presets[0]
+
+def get_threads_per_job(profile=None):
+    """
+    Threads per encode that give the most total throughput when the cores are
+    shared by several encodes (x264 scales sublinearly), or None without a profile.
+    """
+    profile = profile or get_profile()
+    if not profile:
+        return None
+
+    cpu_count = profile['cpu_count']
+    best = None
+    for result in profile['results']:
+        if result['preset'] != REFERENCE_PRESET:
+            continue
+        total_speed = result['speed'] * max(1, cpu_count // result['threads'])
+        if best is None or total_speed > best[0]:
+            best = (total_speed, result['threads'])
+    return best[1] if best else None
+
+def main():
+    seconds = CALIBRATION_SECONDS
+    try:
+        if len(sys.argv) > 1:
+            seconds = max(2, int(sys.argv[1]))
+    except ValueError:
+        print(f"⚠️ Invalid clip length, using {CALIBRATION_SECONDS}s")
+
+    if not media.check_ffprobe() or not shutil.which('ffmpeg'):
+        print("❌ ffmpeg and ffprobe are required for calibration")
+        return
+
+    profile = calibrate(seconds)
+    if not profile['results']:
+        print("❌ No encode succeeded, profile not usable")
+        return
+
+    print(f"\n✅ Profile saved to {get_profile_path(profile['host'])}")
+    print(f"🧵 Best threads per encode: {get_threads_per_job(profile)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import os
+import shutil
+import hashlib
+
+try:
+    from yt_dlp.utils import sanitize_filename
+except ImportError:  # 1.py and comb.py only read existing folder names
+    sanitize_filename = None
+
+# Conversion outputs are written here first; it sits under the base directory
+# so publishing a finished file is a rename, never a copy
+STAGING_DIR_NAME = '.staging'
+
+VIDEO_EXTENSIONS = ['.mp4', '.mkv', '.avi', '.mov']
+SUBTITLE_EXTENSIONS = ['.srt', '.vtt', '.ass']
+
+def get_series_folder_name(series_name):
+    """
+    Folder name yt-dlp writes for %(series)s (':' and '/' become lookalike
+    characters). It is also the series key of the ledger in every script.
+    Safe to call on a name that is already sanitized.
+    """
+    series_name = str(series_name)
+    if sanitize_filename is None:
+        return series_name.replace('/', '⧸').replace(':', '：')
+    return sanitize_filename(series_name)
+
+def get_series_key(path):
+    """
+    Series key (ledger, metrics, channels) of a file inside a series folder:
+    the folder's name, i.e. get_series_folder_name of the series
+    """
+    return os.path.basename(os.path.dirname(os.path.abspath(path)))
+
+def get_series_dir(base_directory, series_name):
+    """Folder holding a series' episodes"""
+    return os.path.join(base_directory, get_series_folder_name(series_name))
+
+def get_episode_filename(episode_number, ext, subtitles_embedded=False):
+    """
+    Final file name of an episode artifact.
+    Videos with embedded subtitles get comb.py's 'Episode XX' name.
+    """
+    ext = ext.lower()
+    if ext in VIDEO_EXTENSIONS and subtitles_embedded and isinstance(episode_number, int):
+        return f"Episode {episode_number:02d}{ext}"
+    return f"Episode {episode_number}{ext}"
+
+def get_episode_path(base_directory, series_name, episode_number, ext, subtitles_embedded=False):
+    """Final path of an episode artifact"""
+    return os.path.join(get_series_dir(base_directory, series_name),
+                        get_episode_filename(episode_number, ext, subtitles_embedded))
+
+def get_download_outtmpl(base_directory):
+    """yt-dlp output template that downloads straight to the final 'Episode N.ext' name"""
+    return os.path.join(base_directory, '%(series)s', 'Episode %(episode_number)s.%(ext)s')
+
+def get_staging_path(base_directory, final_path):
+    """
+    Scratch path for an artifact that will end up at final_path.
+    Lives on the same filesystem as the library, so publishing it is a rename.
+    """
+    staging_dir = os.path.join(base_directory, STAGING_DIR_NAME)
+    os.makedirs(staging_dir, exist_ok=True)
+    # Keep names unique across series without nesting folders
+    tag = hashlib.sha1(os.path.abspath(final_path).encode('utf-8')).hexdigest()[:12]
+    return os.path.join(staging_dir, f"{tag}_{os.path.basename(final_path)}")
+
+def get_device(path):
+    """Device id of the filesystem holding path (or its nearest existing parent)"""
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+    return os.stat(path).st_dev
+
+def is_same_filesystem(path_a, path_b):
+    """Check if two paths live on the same filesystem (a move between them is a rename)"""
+    device_a = get_device(path_a)
+    return device_a is not None and device_a == get_device(path_b)
+
+def move_into_place(source, destination):
+    """
+    Move a file or folder to its final location.
+    Same filesystem: an atomic rename. Otherwise falls back to a copying move
+    and says so, since that costs a full copy of the data.
+    Returns the destination path.
+    """
+    if os.path.abspath(source) == os.path.abspath(destination):
+        return destination
+    os.makedirs(os.path.dirname(os.path.abspath(destination)), exist_ok=True)
+    if is_same_filesystem(source, os.path.dirname(os.path.abspath(destination))):
+        if os.path.isdir(source):
+            os.rename(source, destination)
+        else:
+            os.replace(source, destination)
+    else:
+        print(f"⚠ {os.path.dirname(os.path.abspath(destination))} is on another filesystem, copying {os.path.basename(source)}")
+        shutil.move(source, destination)
+    return destination
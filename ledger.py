@@ -0,0 +1,230 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+# Get the directory where the script is located
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Ledger shared by downen.py, comb.py, 1.py and pipeline.py
+LEDGER_PATH = os.path.join(SCRIPT_DIR, "pipeline_ledger.db")
+
+# Episode states in pipeline order
+STATES = ['extracted', 'downloaded', 'transcoded', 'embedded', 'uploaded']
+
+# Bytes hashed at each end of a file for its fingerprint
+FINGERPRINT_CHUNK = 1024 * 1024
+
+# Telegram drops uploaded file parts after a while, so old upload state is useless
+UPLOAD_STATE_TTL = 12 * 3600
+
+def file_fingerprint(path):
+    """
+    Quick content fingerprint: sha256 over the size plus the first and last MiB.
+    Cheap enough to run on multi-GB episodes every time a stage checks the ledger.
+    """
+    try:
+        size = os.path.getsize(path)
+        digest = hashlib.sha256(str(size).encode('ascii'))
+        with open(path, 'rb') as f:
+            digest.update(f.read(FINGERPRINT_CHUNK))
+            if size > FINGERPRINT_CHUNK:
+                f.seek(max(FINGERPRINT_CHUNK, size - FINGERPRINT_CHUNK))
+                digest.update(f.read(FINGERPRINT_CHUNK))
+        return digest.hexdigest()
+    except OSError:
+        return None
+
+def state_rank(state):
+    """Position of a state in the pipeline (-1 if unknown)"""
+    return STATES.index(state) if state in STATES else -1
+
+def state_rank_sql(column):
+    """SQL expression for state_rank of a state column"""
+    cases = ' '.join(f"WHEN '{state}' THEN {rank}" for rank, state in enumerate(STATES))
+    return f"(CASE {column} {cases} ELSE -1 END)"
+
+class Ledger:
+    """
+    SQLite record of every episode's progress through the pipeline.
+    One row per (series, episode) with the current state, file path, size,
+    fingerprint and per-stage timestamps/durations, plus one row per channel.
+    Safe to use from several threads; WAL mode lets the scripts share it.
+    """
+
+    def __init__(self, path=LEDGER_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            stage_columns = ''.join(f", {state}_at REAL, {state}_seconds REAL" for state in STATES)
+            self.conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS episodes (
+                    series TEXT NOT NULL,
+                    episode INTEGER NOT NULL,
+                    url TEXT,
+                    state TEXT NOT NULL,
+                    path TEXT,
+                    size INTEGER,
+                    fingerprint TEXT,
+                    updated_at REAL{stage_columns},
+                    PRIMARY KEY (series, episode)
+                )
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS episodes_url ON episodes (url)")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS uploads (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL,
+                    file_id INTEGER NOT NULL,
+                    part_size INTEGER NOT NULL,
+                    total_parts INTEGER NOT NULL,
+                    parts TEXT NOT NULL,
+                    updated_at REAL
+                )
+            """)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS channels (
+                    series TEXT PRIMARY KEY,
+                    channel_id INTEGER NOT NULL,
+                    username TEXT,
+                    created_at REAL
+                )
+            """)
+
+    def record(self, series, episode, state, url=None, path=None, seconds=None):
+        """
+        Record that an episode reached a state.
+        Size and fingerprint are taken from path when it exists.
+        The state only moves forward (a retry re-recording 'extracted' keeps
+        'downloaded'), unless the file itself changed: a new fingerprint wins.
+        """
+        if state not in STATES:
+            raise ValueError(f"Unknown ledger state: {state}")
+
+        size = fingerprint = None
+        if path and os.path.isfile(path):
+            size = os.path.getsize(path)
+            fingerprint = file_fingerprint(path)
+
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(f"""
+                INSERT INTO episodes (series, episode, url, state, path, size, fingerprint, updated_at,
+                                      {state}_at, {state}_seconds)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (series, episode) DO UPDATE SET
+                    url = COALESCE(excluded.url, url),
+                    state = CASE
+                        WHEN {state_rank_sql('excluded.state')} >= {state_rank_sql('state')}
+                             OR (excluded.fingerprint IS NOT NULL AND excluded.fingerprint IS NOT fingerprint)
+                        THEN excluded.state ELSE state END,
+                    path = COALESCE(excluded.path, path),
+                    size = COALESCE(excluded.size, size),
+                    fingerprint = COALESCE(excluded.fingerprint, fingerprint),
+                    updated_at = excluded.updated_at,
+                    {state}_at = excluded.{state}_at,
+                    {state}_seconds = excluded.{state}_seconds
+            """, (series, episode, url, state, path, size, fingerprint, now, now, seconds))
+
+    def get(self, series, episode):
+        """Get an episode's row as a dict, or None"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT * FROM episodes WHERE series = ? AND episode = ?", (series, episode)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def get_by_url(self, url):
+        """Get the most recently updated episode row for a URL, or None"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT * FROM episodes WHERE url = ? ORDER BY updated_at DESC LIMIT 1", (url,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def get_upload_state(self, path, part_size, ttl=UPLOAD_STATE_TTL):
+        """
+        Get the saved partial upload of a file as a dict with file_id, total_parts
+        and the set of confirmed parts, or None if there is none or it no longer
+        matches the file (size, mtime, part size) or has expired.
+        """
+        path = os.path.abspath(path)
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM uploads WHERE path = ?", (path,)).fetchone()
+        if not row:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if (row['size'] != stat.st_size or row['mtime'] != stat.st_mtime or row['part_size'] != part_size
+                or time.time() - (row['updated_at'] or 0) > ttl):
+            self.clear_upload_state(path)
+            return None
+        return {
+            'file_id': row['file_id'],
+            'total_parts': row['total_parts'],
+            'parts': set(json.loads(row['parts'])),
+        }
+
+    def save_upload_state(self, path, file_id, part_size, total_parts, parts):
+        """Persist which parts of a file Telegram has confirmed"""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with self.lock, self.conn:
+            self.conn.execute("""
+                INSERT OR REPLACE INTO uploads (path, size, mtime, file_id, part_size, total_parts, parts, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (path, stat.st_size, stat.st_mtime, file_id, part_size, total_parts,
+                  json.dumps(sorted(parts), separators=(',', ':')), time.time()))
+
+    def clear_upload_state(self, path):
+        """Forget a file's partial upload"""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM uploads WHERE path = ?", (os.path.abspath(path),))
+
+    def get_channel(self, series):
+        """Get the channel recorded for a series, or None"""
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM channels WHERE series = ?", (series,)).fetchone()
+        return dict(row) if row else None
+
+    def record_channel(self, series, channel_id, username=None):
+        """Remember the channel created for a series"""
+        with self.lock, self.conn:
+            self.conn.execute("""
+                INSERT INTO channels (series, channel_id, username, created_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (series) DO UPDATE SET
+                    channel_id = excluded.channel_id,
+                    username = COALESCE(excluded.username, username)
+            """, (series, channel_id, username, time.time()))
+
+def has_reached(row, state):
+    """Check if a ledger row is at or past a state"""
+    return bool(row) and state_rank(row['state']) >= state_rank(state)
+
+def is_file_current(row, path=None):
+    """Check that the file recorded in a row (or path) still has the recorded content"""
+    path = path or (row or {}).get('path')
+    if not row or not path or not os.path.isfile(path):
+        return False
+    if row.get('size') is not None and os.path.getsize(path) != row['size']:
+        return False
+    return row.get('fingerprint') is None or file_fingerprint(path) == row['fingerprint']
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+def get_ledger():
+    """Get the process-wide ledger, opening it on first use"""
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            _ledger = Ledger()
+        return _ledger
@@ -0,0 +1,348 @@
+import os
+import json
+import math
+import time
+import shutil
+import signal
+import threading
+import subprocess
+from collections import deque
+
+# ffmpeg watchdog settings
+FFMPEG_STALL_TIMEOUT = 120     # Seconds without progress before a job is considered stuck
+FFMPEG_BUDGET_BASE = 120       # Fixed part of the total time budget (seconds)
+FFMPEG_BUDGET_FACTOR = 6       # Extra budget per second of media (6x slower than realtime)
+FFMPEG_STDERR_LINES = 40       # stderr lines kept for error reports
+
+# Splitting oversized videos
+SPLIT_SIZE_MARGIN = 0.92       # Aim parts at this share of the limit (bitrate is never perfectly even)
+SPLIT_MAX_ATTEMPTS = 4         # Re-plans with one more part when a part still comes out too big
+
+def check_ffprobe():
+    """Check if ffprobe is available"""
+    return shutil.which('ffprobe') is not None
+
+def parse_int(value):
+    """Parse an ffprobe numeric string, returning None if missing"""
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+def parse_frame_rate(value):
+    """Parse an ffprobe frame rate like '24000/1001'"""
+    try:
+        num, _, den = str(value).partition('/')
+        return float(num) / float(den or 1)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+
+def probe_media(path, timeout=30):
+    """
+    Inspect a media file with ffprobe.
+    Returns a dict with container, codecs, resolution, bitrates, fps and duration,
+    or None if the file could not be probed.
+    """
+    cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-print_format', 'json',
+        '-show_format',
+        '-show_streams',
+        path
+    ]
+
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True, timeout=timeout)
+        data = json.loads(result.stdout or '{}')
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, FileNotFoundError, ValueError):
+        return None
+
+    streams = data.get('streams', [])
+    fmt = data.get('format', {})
+
+    # Skip cover art, which shows up as a video stream
+    video = next((s for s in streams if s.get('codec_type') == 'video'
+                  and not s.get('disposition', {}).get('attached_pic')), {})
+    audio = next((s for s in streams if s.get('codec_type') == 'audio'), {})
+    subtitles = [s.get('codec_name') for s in streams if s.get('codec_type') == 'subtitle']
+
+    return {
+        'container': fmt.get('format_name', ''),
+        'duration': float(fmt.get('duration') or video.get('duration') or 0),
+        'size': parse_int(fmt.get('size')),
+        'bit_rate': parse_int(fmt.get('bit_rate')),
+        'vcodec': video.get('codec_name'),
+        'pix_fmt': video.get('pix_fmt'),
+        'width': parse_int(video.get('width')),
+        'height': parse_int(video.get('height')),
+        'fps': parse_frame_rate(video.get('avg_frame_rate')) or parse_frame_rate(video.get('r_frame_rate')),
+        'video_bit_rate': parse_int(video.get('bit_rate')),
+        'acodec': audio.get('codec_name'),
+        'audio_bit_rate': parse_int(audio.get('bit_rate')),
+        'subtitle_codecs': subtitles,
+    }
+
+def extract_thumbnail(path, output_path, duration=None, max_size=320, timeout=60):
+    """
+    Save a representative JPEG frame of a video, scaled to fit max_size (Telegram's thumb limit).
+    Seeks past the opening (10% in) and lets ffmpeg's thumbnail filter pick the
+    most typical frame of the next 100, which avoids black and fade frames.
+    Returns output_path, or None on failure.
+    """
+    seek = duration * 0.1 if duration else 0
+    cmd = [
+        'ffmpeg',
+        '-v', 'error',
+        '-ss', f'{seek:.2f}',
+        '-i', path,
+        '-vf', f'thumbnail=100,scale={max_size}:{max_size}:force_original_aspect_ratio=decrease',
+        '-frames:v', '1',
+        '-q:v', '5',
+        '-y',
+        output_path
+    ]
+
+    try:
+        subprocess.run(cmd, capture_output=True, check=True, timeout=timeout)
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, FileNotFoundError):
+        return None
+    return output_path if os.path.exists(output_path) else None
+
+def start_process_group(cmd, **kwargs):
+    """Start a process in its own process group so it can be stopped without touching other jobs"""
+    if os.name == 'nt':
+        kwargs['creationflags'] = kwargs.get('creationflags', 0) | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs['start_new_session'] = True
+    return subprocess.Popen(cmd, **kwargs)
+
+def terminate_process_group(process, grace=5):
+    """Stop a process started with start_process_group and everything it spawned"""
+    if process.poll() is not None:
+        return
+    try:
+        if os.name == 'nt':
+            subprocess.run(['taskkill', '/f', '/t', '/pid', str(process.pid)],
+                           capture_output=True, timeout=10)
+        else:
+            os.killpg(process.pid, signal.SIGTERM)
+            try:
+                process.wait(timeout=grace)
+            except subprocess.TimeoutExpired:
+                os.killpg(process.pid, signal.SIGKILL)
+    except (OSError, subprocess.SubprocessError):
+        process.kill()
+    try:
+        process.wait(timeout=grace)
+    except subprocess.TimeoutExpired:
+        pass
+
+def get_ffmpeg_budget(duration):
+    """Total time allowed for an ffmpeg job on media of the given duration (None = no limit)"""
+    if not duration:
+        return None
+    return FFMPEG_BUDGET_BASE + duration * FFMPEG_BUDGET_FACTOR
+
+def run_ffmpeg(cmd, duration=None, stall_timeout=FFMPEG_STALL_TIMEOUT, budget=None, progress_callback=None):
+    """
+    Run an ffmpeg command with a machine-readable progress feed (-progress pipe:1).
+    Progress is parsed line by line as it arrives; the job is stopped when progress
+    stalls for stall_timeout seconds or the duration-scaled budget runs out, and
+    only the job's own process group is terminated.
+    progress_callback(progress) is called with each progress block (a dict with
+    frame, fps, out_time_seconds, speed and percent when the duration is known).
+    Returns a stats dict (frames, fps, elapsed); raises subprocess.TimeoutExpired
+    on stall/budget and subprocess.CalledProcessError on failure, like subprocess.run.
+    """
+    if budget is None:
+        budget = get_ffmpeg_budget(duration)
+
+    full_cmd = [cmd[0], '-hide_banner', '-nostats', '-progress', 'pipe:1'] + list(cmd[1:])
+    process = start_process_group(
+        full_cmd,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        encoding='utf-8',
+        errors='replace',
+        bufsize=1
+    )
+
+    start_time = time.time()
+    stderr_tail = deque(maxlen=FFMPEG_STDERR_LINES)
+    lock = threading.Lock()
+    state = {'last_progress': start_time, 'frame': 0, 'out_time': 0.0}
+
+    def read_stderr():
+        for line in process.stderr:
+            stderr_tail.append(line.rstrip())
+
+    def read_progress():
+        block = {}
+        for line in process.stdout:
+            key, _, value = line.strip().partition('=')
+            if key != 'progress':
+                block[key] = value
+                continue
+
+            # A 'progress=' line closes one block of key=value pairs
+            frame = parse_int(block.get('frame')) or 0
+            out_time = (parse_int(block.get('out_time_us')) or parse_int(block.get('out_time_ms')) or 0) / 1000000
+            # The first block reports out_time_us=INT64_MIN+1 before any frame is written
+            out_time = max(0.0, out_time)
+            with lock:
+                if frame > state['frame'] or out_time > state['out_time']:
+                    state['last_progress'] = time.time()
+                state['frame'] = max(frame, state['frame'])
+                state['out_time'] = max(out_time, state['out_time'])
+
+            if progress_callback:
+                progress = {
+                    'frame': frame,
+                    'fps': float(block.get('fps') or 0),
+                    'out_time_seconds': out_time,
+                    'speed': block.get('speed', '').strip(),
+                    'percent': min(out_time / duration * 100, 100) if duration else None,
+                    'done': value == 'end',
+                }
+                try:
+                    progress_callback(progress)
+                except Exception:
+                    pass
+            block = {}
+
+    readers = [threading.Thread(target=read_stderr, daemon=True),
+               threading.Thread(target=read_progress, daemon=True)]
+    for reader in readers:
+        reader.start()
+
+    timed_out = None
+    while process.poll() is None:
+        time.sleep(0.5)
+        now = time.time()
+        with lock:
+            stalled_for = now - state['last_progress']
+        if stall_timeout and stalled_for > stall_timeout:
+            timed_out = stall_timeout
+            print(f"✗ FFmpeg made no progress for {stalled_for:.0f}s, stopping this job")
+        elif budget and now - start_time > budget:
+            timed_out = budget
+            print(f"✗ FFmpeg exceeded its {budget:.0f}s budget, stopping this job")
+        if timed_out:
+            terminate_process_group(process)
+            break
+
+    for reader in readers:
+        reader.join(timeout=5)
+
+    stderr_text = '\n'.join(stderr_tail)
+    if timed_out:
+        raise subprocess.TimeoutExpired(full_cmd, timed_out, stderr=stderr_text)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, full_cmd, stderr=stderr_text)
+
+    elapsed = time.time() - start_time
+    return {
+        'frames': state['frame'],
+        'elapsed': elapsed,
+        'fps': state['frame'] / elapsed if elapsed > 0 else 0,
+        'out_time': state['out_time'],
+    }
+
+def get_keyframe_times(path, timeout=600):
+    """
+    Timestamps (seconds) of the video keyframes, read from packet flags so
+    nothing is decoded. Returns a sorted list (empty on failure).
+    """
+    cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time,flags',
+        '-of', 'csv=p=0',
+        path
+    ]
+
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True, timeout=timeout)
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, FileNotFoundError):
+        return []
+
+    keyframes = []
+    for line in result.stdout.splitlines():
+        pts_time, _, flags = line.partition(',')
+        if 'K' in flags:
+            try:
+                keyframes.append(float(pts_time))
+            except ValueError:
+                continue
+    return sorted(set(keyframes))
+
+def choose_split_points(keyframes, duration, parts):
+    """Pick the keyframe closest to each even split of the duration (never the first frame)"""
+    points = []
+    for k in range(1, parts):
+        ideal = duration * k / parts
+        candidates = [t for t in keyframes if t > (points[-1] if points else 0)]
+        if not candidates:
+            break
+        point = min(candidates, key=lambda t: abs(t - ideal))
+        if point < duration:
+            points.append(point)
+    return points
+
+def split_video(path, output_dir, max_bytes, name_prefix=None):
+    """
+    Cut a video into MP4 parts smaller than max_bytes with one stream-copy pass.
+    Cuts fall on keyframes (ffmpeg's segment muxer), every part starts at
+    timestamp 0 and gets +faststart. Returns the ordered part paths, or None
+    if the file cannot be split.
+    """
+    probe = probe_media(path)
+    size = os.path.getsize(path)
+    duration = (probe or {}).get('duration')
+    keyframes = get_keyframe_times(path)
+    if not duration or len(keyframes) < 2:
+        return None
+
+    os.makedirs(output_dir, exist_ok=True)
+    name_prefix = name_prefix or os.path.splitext(os.path.basename(path))[0]
+    parts = max(2, math.ceil(size / (max_bytes * SPLIT_SIZE_MARGIN)))
+
+    for attempt in range(SPLIT_MAX_ATTEMPTS):
+        points = choose_split_points(keyframes, duration, parts)
+        if not points:
+            return None
+        pattern = os.path.join(output_dir, f"{name_prefix} - part%03d.mp4")
+        cmd = [
+            'ffmpeg',
+            '-i', path,
+            '-map', '0:v:0',
+            '-map', '0:a?',
+            '-map', '0:s?',
+            '-c', 'copy',
+            '-c:s', 'mov_text',
+            '-f', 'segment',
+            '-segment_times', ','.join(f"{t:.6f}" for t in points),
+            '-reset_timestamps', '1',
+            '-avoid_negative_ts', 'make_zero',
+            '-segment_format', 'mp4',
+            '-segment_format_options', 'movflags=+faststart',
+            '-y',
+            pattern
+        ]
+        run_ffmpeg(cmd, duration=duration)
+
+        part_files = [os.path.join(output_dir, f"{name_prefix} - part{k:03d}.mp4") for k in range(len(points) + 1)]
+        part_files = [part for part in part_files if os.path.exists(part)]
+        if part_files and all(os.path.getsize(part) <= max_bytes for part in part_files):
+            return part_files
+
+        # Bitrate was uneven: remove this attempt and plan one more part
+        for part in part_files:
+            os.remove(part)
+        parts += 1
+
+    return None
@@ -0,0 +1,137 @@
+import os
+import re
+import threading
+
+VIDEO_EXTENSIONS = ['.mp4', '.mkv', '.avi', '.mov', '.wmv', '.flv', '.webm', '.m4v']
+SUBTITLE_EXTENSIONS = ['.srt', '.ass', '.ssa', '.vtt', '.sub']
+
+EPISODE_PATTERNS = [re.compile(pattern) for pattern in [
+    r'[Ee]pisode\s*(\d+)',
+    r'[Ee]p\s*(\d+)',
+    r'\s-\s(\d+)\s-',
+    r'\s(\d+)\s*[-_]',
+    r'\[(\d+)\]',
+    r'\b(\d{1,3})\b'
+]]
+
+NATURAL_SORT_SPLIT = re.compile(r'(\d+)')
+
+def extract_episode_number(filename):
+    """Extract episode number from filename"""
+    for pattern in EPISODE_PATTERNS:
+        match = pattern.search(filename)
+        if match:
+            episode_num = int(match.group(1))
+            if 1 <= episode_num <= 999:
+                return episode_num
+    return None
+
+def get_file_extension(filename):
+    """Get file extension"""
+    return os.path.splitext(filename)[1]
+
+def is_video_file(filename):
+    """Check if file is a video file"""
+    return any(filename.lower().endswith(ext) for ext in VIDEO_EXTENSIONS)
+
+def is_subtitle_file(filename):
+    """Check if file is a subtitle file"""
+    return any(filename.lower().endswith(ext) for ext in SUBTITLE_EXTENSIONS)
+
+def get_file_kind(filename):
+    """'video', 'subtitle' or None"""
+    if is_video_file(filename):
+        return 'video'
+    if is_subtitle_file(filename):
+        return 'subtitle'
+    return None
+
+def natural_sort_key(filename):
+    """Sort key that puts 'Episode 2' before 'Episode 10'"""
+    return [int(part) if part.isdigit() else part.lower() for part in NATURAL_SORT_SPLIT.split(filename)]
+
+class FolderIndex:
+    """
+    Index of the videos and subtitles in one folder.
+    Built with a single scandir pass; on refresh only entries whose size or
+    mtime changed are re-parsed. Episode lookups are dict hits, so matching a
+    video to its subtitle no longer rescans every subtitle name.
+    """
+
+    def __init__(self, folder_path):
+        self.folder_path = folder_path
+        self.entries = {}             # name -> entry dict
+        self.videos_by_episode = {}   # episode -> [video entries]
+        self.subtitles_by_episode = {}
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        """Rescan the folder, re-parsing only new or changed files"""
+        entries = {}
+        with os.scandir(self.folder_path) as scan:
+            for dir_entry in scan:
+                kind = get_file_kind(dir_entry.name)
+                if kind is None or not dir_entry.is_file():
+                    continue
+                stat = dir_entry.stat()
+                cached = self.entries.get(dir_entry.name)
+                if cached and cached['size'] == stat.st_size and cached['mtime'] == stat.st_mtime_ns:
+                    entries[dir_entry.name] = cached
+                    continue
+                entries[dir_entry.name] = {
+                    'name': dir_entry.name,
+                    'path': dir_entry.path,
+                    'kind': kind,
+                    'episode': extract_episode_number(dir_entry.name),
+                    'size': stat.st_size,
+                    'mtime': stat.st_mtime_ns,
+                }
+
+        videos_by_episode = {}
+        subtitles_by_episode = {}
+        for entry in sorted(entries.values(), key=lambda entry: natural_sort_key(entry['name'])):
+            target = videos_by_episode if entry['kind'] == 'video' else subtitles_by_episode
+            target.setdefault(entry['episode'], []).append(entry)
+
+        with self.lock:
+            self.entries = entries
+            self.videos_by_episode = videos_by_episode
+            self.subtitles_by_episode = subtitles_by_episode
+        return self
+
+    def get_videos(self):
+        """Video entries in episode order (files without a number last, naturally sorted)"""
+        with self.lock:
+            entries = [entry for entry in self.entries.values() if entry['kind'] == 'video']
+        return sorted(entries, key=lambda entry: (entry['episode'] is None, entry['episode'] or 0,
+                                                  natural_sort_key(entry['name'])))
+
+    def get_subtitles(self):
+        """Subtitle entries in natural order"""
+        with self.lock:
+            entries = [entry for entry in self.entries.values() if entry['kind'] == 'subtitle']
+        return sorted(entries, key=lambda entry: natural_sort_key(entry['name']))
+
+    def find_subtitle(self, episode_num):
+        """Subtitle entry for an episode, or None"""
+        with self.lock:
+            subtitles = self.subtitles_by_episode.get(episode_num)
+        return subtitles[0] if subtitles and episode_num is not None else None
+
+    def find_video(self, episode_num):
+        """Video entry for an episode, or None"""
+        with self.lock:
+            videos = self.videos_by_episode.get(episode_num)
+        return videos[0] if videos and episode_num is not None else None
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_folder_index(folder_path):
+    """Get the refreshed index of a folder, reusing what earlier scans already parsed"""
+    key = os.path.abspath(folder_path)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = FolderIndex(key)
+    return index.refresh()
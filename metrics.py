@@ -0,0 +1,165 @@
+import os
+import re
+import sys
+import json
+import time
+import threading
+import telemetry
+
+# Get the directory where the script is located
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Where events and the Prometheus textfile go; point ANIME_METRICS_DIR at
+# node_exporter's --collector.textfile.directory to have it scraped
+METRICS_DIR = os.environ.get('ANIME_METRICS_DIR', os.path.join(SCRIPT_DIR, 'metrics'))
+METRICS_EVENTS_FILE = 'events.jsonl'
+
+# Pipeline stages that report metrics
+STAGES = ['extract', 'download', 'transcode', 'embed', 'poster', 'channel_create', 'upload']
+
+def get_script_name():
+    """Name of the running script, used as a label so each script gets its own textfile"""
+    name = os.path.splitext(os.path.basename(sys.argv[0] or ''))[0]
+    name = re.sub(r'\W+', '_', name).strip('_')
+    return name or 'python'
+
+def get_error_class(error):
+    """Short class name for an exception or error string"""
+    if error is None:
+        return None
+    if isinstance(error, BaseException):
+        return type(error).__name__
+    return str(error)
+
+def escape_label(value):
+    """Escape a Prometheus label value"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels):
+    """Render {a: 1} as {a="1"}"""
+    return '{' + ','.join(f'{key}="{escape_label(value)}"' for key, value in labels.items()) + '}'
+
+class MetricsRecorder:
+    """
+    Records one event per stage run (per episode where it applies) with its
+    duration, bytes, retries and error class. Every event is appended to a
+    JSON-lines file and the running totals are rewritten as a Prometheus textfile.
+    """
+
+    def __init__(self, metrics_dir=METRICS_DIR, script=None):
+        self.metrics_dir = metrics_dir
+        self.script = script or get_script_name()
+        self.events_path = os.path.join(metrics_dir, METRICS_EVENTS_FILE)
+        self.textfile_path = os.path.join(metrics_dir, f'anime_pipeline_{self.script}.prom')
+        self.lock = threading.Lock()
+        self.runs = {}        # (stage, status) -> count
+        self.totals = {}      # stage -> {'seconds', 'bytes', 'retries'}
+        self.errors = {}      # (stage, error_class) -> count
+        self.last_event = 0
+        self.write_failed = False
+
+    def record(self, stage, seconds=None, series=None, episode=None, nbytes=None, retries=0, error=None, **extra):
+        """Record one run of a stage"""
+        error_class = get_error_class(error)
+        status = 'error' if error_class else 'ok'
+        event = {
+            'ts': time.time(),
+            'script': self.script,
+            'stage': stage,
+            'status': status,
+            'series': series,
+            'episode': episode,
+            'seconds': round(seconds, 3) if seconds is not None else None,
+            'bytes': nbytes,
+            'retries': retries,
+            'error': error_class,
+        }
+        if error is not None and isinstance(error, BaseException):
+            event['error_message'] = str(error)[:500]
+        event.update(extra)
+
+        with self.lock:
+            self.runs[(stage, status)] = self.runs.get((stage, status), 0) + 1
+            totals = self.totals.setdefault(stage, {'seconds': 0.0, 'bytes': 0, 'retries': 0})
+            totals['seconds'] += seconds or 0
+            totals['bytes'] += nbytes or 0
+            totals['retries'] += retries or 0
+            if error_class:
+                self.errors[(stage, error_class)] = self.errors.get((stage, error_class), 0) + 1
+            self.last_event = event['ts']
+
+            try:
+                os.makedirs(self.metrics_dir, exist_ok=True)
+                with open(self.events_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(event, default=str) + '\n')
+                self.write_textfile()
+            except OSError as e:
+                # Metrics must never break the pipeline; complain once
+                if not self.write_failed:
+                    print(f"⚠️ Could not write metrics to {self.metrics_dir}: {e}")
+                    self.write_failed = True
+
+    def render_textfile(self):
+        """Prometheus text exposition of the running totals"""
+        script = {'script': self.script}
+        lines = []
+
+        def metric(name, help_text, metric_type, samples):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            for labels, value in samples:
+                lines.append(f'{name}{format_labels({**script, **labels})} {value}')
+
+        metric('anime_pipeline_stage_runs_total', 'Stage runs by outcome.', 'counter',
+               [({'stage': stage, 'status': status}, count) for (stage, status), count in sorted(self.runs.items())])
+        metric('anime_pipeline_stage_seconds_total', 'Seconds spent in each stage.', 'counter',
+               [({'stage': stage}, f"{totals['seconds']:.3f}") for stage, totals in sorted(self.totals.items())])
+        metric('anime_pipeline_stage_bytes_total', 'Bytes produced or transferred by each stage.', 'counter',
+               [({'stage': stage}, totals['bytes']) for stage, totals in sorted(self.totals.items())])
+        metric('anime_pipeline_stage_retries_total', 'Retries needed by each stage.', 'counter',
+               [({'stage': stage}, totals['retries']) for stage, totals in sorted(self.totals.items())])
+        metric('anime_pipeline_stage_errors_total', 'Stage errors by error class.', 'counter',
+               [({'stage': stage, 'error': error}, count) for (stage, error), count in sorted(self.errors.items())])
+
+        throughput = []
+        for stage in ('download', 'upload'):
+            snapshot = telemetry.get_estimator(stage).snapshot()
+            if snapshot['total_bytes']:
+                for stat in ('current', 'average', 'p50', 'p90'):
+                    throughput.append(({'stage': stage, 'stat': stat}, f"{snapshot[stat + '_mbps']:.3f}"))
+        metric('anime_pipeline_throughput_mbps', 'Measured transfer throughput in megabits per second.', 'gauge',
+               throughput)
+
+        metric('anime_pipeline_last_event_timestamp_seconds', 'Time of the last recorded event.', 'gauge',
+               [({}, f'{self.last_event:.3f}')])
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self):
+        """Atomically replace the textfile so node_exporter never reads half of it"""
+        temp_path = self.textfile_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(self.render_textfile())
+        os.replace(temp_path, self.textfile_path)
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+def get_recorder():
+    """Get the process-wide metrics recorder, creating it on first use"""
+    global _recorder
+    with _recorder_lock:
+        if _recorder is None:
+            _recorder = MetricsRecorder()
+        return _recorder
+
+def record_stage(stage, seconds=None, series=None, episode=None, nbytes=None, retries=0, error=None, **extra):
+    """Record one run of a stage on the process-wide recorder"""
+    get_recorder().record(stage, seconds=seconds, series=series, episode=episode, nbytes=nbytes,
+                          retries=retries, error=error, **extra)
+
+def get_file_size(path):
+    """Size of a file, or None if it is missing"""
+    try:
+        return os.path.getsize(path)
+    except (OSError, TypeError):
+        return None
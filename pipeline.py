@@ -0,0 +1,281 @@
+import os
+import sys
+import queue
+import asyncio
+import importlib
+import threading
+import yt_dlp
+from telethon import TelegramClient
+
+import downen
+import comb
+import media_index
+import telemetry
+import disk_budget
+import layout
+
+# 1.py is not a valid identifier, so load it through importlib
+uploader = importlib.import_module('1')
+
+# Get the directory where the script is located
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Pipeline settings
+STAGE_QUEUE_SIZE = 4     # Max episodes waiting between two stages
+EMBED_WORKERS = 1        # Subtitle embedding threads
+
+# Delete each episode once it is uploaded so its disk budget can go to the next
+# download. When off, uploaded episodes stay on disk (and keep their budget)
+# until the series is moved to done/ after the run.
+DELETE_AFTER_UPLOAD = False
+
+# Marks the end of a stage's output
+STAGE_DONE = object()
+
+def split_episode_files(result_files):
+    """Split downloader output into (video_path, subtitle_path)"""
+    video_path = None
+    subtitle_path = None
+    for path in result_files or []:
+        if media_index.is_video_file(path) and video_path is None:
+            video_path = path
+        elif media_index.is_subtitle_file(path) and subtitle_path is None:
+            subtitle_path = path
+    return video_path, subtitle_path
+
+def download_stage(entries, ydl_opts, convert_for_tg, base_directory, workers, embed_queue, budget=None):
+    """Download (and transcode) episodes and hand each one to the embed stage as soon as it finishes"""
+    transcode_pool = downen.TranscodePool() if convert_for_tg else None
+    try:
+        downen.download_playlist_concurrently(
+            entries, ydl_opts, convert_for_tg, base_directory,
+            workers=workers, max_retries=10, transcode_pool=transcode_pool, budget=budget,
+            on_complete=lambda i, result_files: embed_queue.put((i, result_files))
+        )
+    except Exception as e:
+        print(f"✗ Download stage error: {e}")
+    finally:
+        # Pending encodes still report through on_complete, so wait for them first
+        if transcode_pool:
+            transcode_pool.shutdown()
+        embed_queue.put(STAGE_DONE)
+
+def embed_episode_files(result_files):
+    """
+    Embed the episode's subtitle if there is one.
+    Returns (folder_name, video_path) ready for upload, or (None, None) on failure.
+    """
+    video_path, subtitle_path = split_episode_files(result_files)
+    if not video_path:
+        return None, None
+
+    folder_path = os.path.dirname(video_path)
+    folder_name = layout.get_series_key(video_path)
+
+    if not subtitle_path:
+        print(f"  ℹ️  No separate subtitle for {os.path.basename(video_path)} (embedded or none), uploading as is")
+        return folder_name, video_path
+
+    video_file = os.path.basename(video_path)
+    episode_num = media_index.extract_episode_number(video_file)
+    if episode_num is None:
+        print(f"  ❌ Could not extract episode number from: {video_file}")
+        return folder_name, video_path
+
+    final_output_filename = comb.embed_episode(folder_path, video_file, os.path.basename(subtitle_path), episode_num)
+    if not final_output_filename:
+        # Embedding failed, the original video is still usable
+        return folder_name, video_path
+
+    return folder_name, os.path.join(folder_path, final_output_filename)
+
+def embed_stage(embed_queue, upload_queue, producers_left, budget=None):
+    """Embed subtitles for each downloaded episode and pass it on to the upload stage"""
+    while True:
+        item = embed_queue.get()
+        if item is STAGE_DONE:
+            # Let the other embed workers see the end marker too
+            embed_queue.put(STAGE_DONE)
+            break
+
+        i, result_files = item
+        folder_name, video_path = None, None
+        try:
+            # Already uploaded by an earlier run: only keep the upload order moving
+            if result_files is not downen.ALREADY_UPLOADED and result_files:
+                folder_name, video_path = embed_episode_files(result_files)
+                # Embedding renames the video; keep its disk reservation attached to it
+                original_path = split_episode_files(result_files)[0]
+                if budget is not None and video_path and original_path and video_path != original_path:
+                    budget.update_path(original_path, video_path)
+        except Exception as e:
+            print(f"  ❌ Embed stage error on video {i}: {e}")
+        upload_queue.put((i, folder_name, video_path))
+
+    with producers_left['lock']:
+        producers_left['count'] -= 1
+        if producers_left['count'] == 0:
+            upload_queue.put(STAGE_DONE)
+
+def remove_uploaded_episode(video_path):
+    """Delete an uploaded episode (DELETE_AFTER_UPLOAD) so its disk space is really freed"""
+    try:
+        os.remove(video_path)
+        print(f"🗑️ Deleted uploaded file: {os.path.basename(video_path)}")
+    except OSError as e:
+        print(f"⚠️ Could not delete {os.path.basename(video_path)}: {e}")
+
+async def upload_stage(client, upload_queue, total, budget=None):
+    """
+    Upload episodes in playlist order as soon as they leave the embed stage.
+    Creates each series' channel on its first episode and gives each
+    episode's disk budget back once it has left the pipeline.
+    Returns {folder_name: uploaded_count}.
+    """
+    loop = asyncio.get_running_loop()
+    channels = {}
+    uploaded = {}
+    pending = {}
+    next_index = 1
+
+    async def upload_one(i, folder_name, video_path):
+        uploaded_ok = False
+        try:
+            uploaded_ok = await upload_episode(i, folder_name, video_path)
+        except Exception as e:
+            # One bad episode must not take the rest of the series down with it
+            print(f"❌ Upload stage error on video {i} ({os.path.basename(video_path)}): {e}")
+        finally:
+            if uploaded_ok and DELETE_AFTER_UPLOAD:
+                remove_uploaded_episode(video_path)
+            # Only frees budget if the bytes really left the disk
+            if budget is not None:
+                budget.release_path(video_path)
+
+    async def upload_episode(i, folder_name, video_path):
+        if folder_name not in channels:
+            print(f"\n{'='*60}")
+            print(f"🚀 Setting up channel for: {folder_name}")
+            print(f"{'='*60}")
+            channels[folder_name] = await uploader.prepare_channel(client, folder_name)
+            uploaded.setdefault(folder_name, 0)
+
+        channel = channels[folder_name]
+        if not channel:
+            print(f"⚠️ No channel for {folder_name}, skipping {os.path.basename(video_path)}")
+            return False
+
+        # Pacing between uploads is handled by the uploader's rate limiter
+        if await uploader.upload_episode(client, channel, video_path, i, total, budget=budget):
+            uploaded[folder_name] += 1
+            return True
+        return False
+
+    while True:
+        item = await loop.run_in_executor(None, upload_queue.get)
+        if item is STAGE_DONE:
+            break
+
+        i, folder_name, video_path = item
+        pending[i] = (folder_name, video_path)
+
+        # Keep the channel in episode order even when downloads finish out of order
+        while next_index in pending:
+            folder_name, video_path = pending.pop(next_index)
+            if video_path:
+                await upload_one(next_index, folder_name, video_path)
+            next_index += 1
+
+    for i in sorted(pending):
+        folder_name, video_path = pending.pop(i)
+        if video_path:
+            await upload_one(i, folder_name, video_path)
+
+    return uploaded
+
+async def run_pipeline(url, convert_for_tg=True, workers=downen.DOWNLOAD_WORKERS):
+    """Run download -> subtitle embed -> upload as overlapping stages"""
+    base_directory = SCRIPT_DIR
+    ydl_opts = downen.get_ydl_opts(base_directory, convert_for_tg)
+
+    # First, check if it's a playlist or single video
+    with yt_dlp.YoutubeDL({'quiet': True, 'extract_flat': True}) as ydl:
+        info = ydl.extract_info(url, download=False)
+
+    if 'entries' in info:
+        entries = list(info['entries'])
+        print(f"Found playlist with {len(entries)} videos")
+    else:
+        entries = [{'url': url}]
+        print("Found single video")
+
+    # With DELETE_AFTER_UPLOAD, downloads wait for uploads to free disk budget instead
+    # of failing; admission follows playlist order like the uploads, so a late
+    # episode can't starve an early one
+    budget = disk_budget.DiskBudget(base_directory, release_on_upload=DELETE_AFTER_UPLOAD, ordered=True)
+    print(f"💾 {budget.report()}")
+
+    embed_queue = queue.Queue(maxsize=STAGE_QUEUE_SIZE)
+    upload_queue = queue.Queue(maxsize=STAGE_QUEUE_SIZE)
+    producers_left = {'count': EMBED_WORKERS, 'lock': threading.Lock()}
+
+    # Log in before the worker threads start so prompts are not interleaved
+    async with TelegramClient('session_name', uploader.API_ID, uploader.API_HASH,
+                              flood_sleep_threshold=uploader.FLOOD_SLEEP_THRESHOLD) as client:
+        print("🔗 Connecting to Telegram...")
+        await client.start()
+        print("✅ Successfully logged in!")
+
+        threads = [threading.Thread(
+            target=download_stage,
+            args=(entries, ydl_opts, convert_for_tg, base_directory, workers, embed_queue, budget),
+            daemon=True
+        )]
+        for _ in range(EMBED_WORKERS):
+            threads.append(threading.Thread(
+                target=embed_stage,
+                args=(embed_queue, upload_queue, producers_left, budget),
+                daemon=True
+            ))
+        for thread in threads:
+            thread.start()
+
+        uploaded = await upload_stage(client, upload_queue, len(entries), budget)
+
+    for thread in threads:
+        thread.join()
+
+    # Move finished series to the done folder
+    for folder_name, count in uploaded.items():
+        if count > 0:
+            uploader.move_folder_to_done(folder_name)
+        else:
+            print(f"⚠️ No videos were uploaded for {folder_name}, folder not moved")
+
+    total_uploaded = sum(uploaded.values())
+    print(f"\n🎊 Pipeline finished! Uploaded {total_uploaded}/{len(entries)} episodes")
+    telemetry.report()
+
+def main():
+    if len(sys.argv) > 1:
+        url = sys.argv[1]
+    else:
+        url = input("Please enter the HiAnime URL to download: ")
+
+    # Check if user wants Telegram conversion
+    convert_for_tg = True
+    if len(sys.argv) > 2:
+        if sys.argv[2].lower() in ['false', '0', 'no', 'n']:
+            convert_for_tg = False
+
+    workers = downen.DOWNLOAD_WORKERS
+    if len(sys.argv) > 3:
+        try:
+            workers = max(1, int(sys.argv[3]))
+        except ValueError:
+            print(f"⚠ Invalid worker count '{sys.argv[3]}', using {downen.DOWNLOAD_WORKERS}")
+
+    asyncio.run(run_pipeline(url, convert_for_tg, workers))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import time
+import threading
+from collections import deque
+
+# Throughput estimator settings
+TELEMETRY_BUCKET_SECONDS = 1       # Resolution of the rate history
+TELEMETRY_CURRENT_WINDOW = 10      # Seconds averaged for the "current" rate
+TELEMETRY_HISTORY_SECONDS = 3600   # Seconds of history kept for percentiles
+
+def to_mbps(bytes_per_second):
+    """Convert bytes/s to megabits/s"""
+    return bytes_per_second * 8 / 1000000
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+class ThroughputEstimator:
+    """
+    Rolling throughput of one pipeline stage, fed by the progress callbacks of
+    real transfers (several at once is fine). Bytes are summed into per-second
+    buckets; current rate is the last few seconds, average is over the seconds
+    the stage was active, percentiles are over the active buckets.
+    """
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.lock = threading.Lock()
+        self.buckets = deque()          # [bucket_start, bytes]
+        self.streams = {}               # key -> last cumulative byte count
+        self.total_bytes = 0
+
+    def add(self, nbytes, now=None):
+        """Count bytes transferred just now"""
+        if nbytes <= 0:
+            return
+        now = time.time() if now is None else now
+        bucket_start = now - now % TELEMETRY_BUCKET_SECONDS
+        with self.lock:
+            if self.buckets and self.buckets[-1][0] == bucket_start:
+                self.buckets[-1][1] += nbytes
+            else:
+                self.buckets.append([bucket_start, nbytes])
+            while self.buckets and self.buckets[0][0] < now - TELEMETRY_HISTORY_SECONDS:
+                self.buckets.popleft()
+            self.total_bytes += nbytes
+
+    def add_span(self, nbytes, seconds, now=None):
+        """
+        Count bytes transferred evenly over the last `seconds` (for transfers that
+        only report once, at the end), so they don't land in a single bucket.
+        """
+        if nbytes <= 0:
+            return
+        now = time.time() if now is None else now
+        if not seconds or seconds <= TELEMETRY_BUCKET_SECONDS:
+            self.add(nbytes, now)
+            return
+
+        seconds = min(seconds, TELEMETRY_HISTORY_SECONDS)
+        start = now - seconds
+        spread = {}
+        bucket_start = start - start % TELEMETRY_BUCKET_SECONDS
+        while bucket_start <= now:
+            # Share of the span that falls inside this bucket
+            overlap = min(bucket_start + TELEMETRY_BUCKET_SECONDS, now) - max(bucket_start, start)
+            if overlap > 0:
+                spread[bucket_start] = nbytes * overlap / seconds
+            bucket_start += TELEMETRY_BUCKET_SECONDS
+
+        with self.lock:
+            for bucket in self.buckets:
+                if bucket[0] in spread:
+                    bucket[1] += spread.pop(bucket[0])
+            if spread:
+                merged = sorted(list(self.buckets) + [[start, nbytes] for start, nbytes in spread.items()])
+                self.buckets = deque(merged)
+            while self.buckets and self.buckets[0][0] < now - TELEMETRY_HISTORY_SECONDS:
+                self.buckets.popleft()
+            self.total_bytes += nbytes
+
+    def update(self, key, current_bytes, now=None):
+        """
+        Feed a transfer's cumulative byte count (what progress callbacks report).
+        The first report of a transfer only sets its baseline, so resumed
+        transfers don't count bytes that were sent by an earlier attempt.
+        """
+        with self.lock:
+            previous = self.streams.get(key)
+            self.streams[key] = current_bytes
+        if previous is not None:
+            self.add(current_bytes - previous, now)
+
+    def has_stream(self, key):
+        """Check if a transfer has reported before"""
+        with self.lock:
+            return key in self.streams
+
+    def finish(self, key):
+        """Forget a finished transfer"""
+        with self.lock:
+            self.streams.pop(key, None)
+
+    def snapshot(self, now=None):
+        """Current, average and percentile rates in Mbps plus totals"""
+        now = time.time() if now is None else now
+        with self.lock:
+            buckets = list(self.buckets)
+            total_bytes = self.total_bytes
+
+        current_start = now - TELEMETRY_CURRENT_WINDOW
+        current_bytes = sum(nbytes for start, nbytes in buckets if start >= current_start)
+        # Leave out the bucket still being filled so it doesn't drag the percentiles down
+        rates = sorted(nbytes / TELEMETRY_BUCKET_SECONDS for start, nbytes in buckets
+                       if start + TELEMETRY_BUCKET_SECONDS <= now)
+        active_seconds = len(buckets) * TELEMETRY_BUCKET_SECONDS
+        history_bytes = sum(nbytes for _, nbytes in buckets)
+
+        return {
+            'stage': self.stage,
+            'current_mbps': to_mbps(current_bytes / TELEMETRY_CURRENT_WINDOW),
+            'average_mbps': to_mbps(history_bytes / active_seconds) if active_seconds else 0,
+            'p10_mbps': to_mbps(percentile(rates, 0.10)),
+            'p50_mbps': to_mbps(percentile(rates, 0.50)),
+            'p90_mbps': to_mbps(percentile(rates, 0.90)),
+            'total_bytes': total_bytes,
+            'active_seconds': active_seconds,
+        }
+
+    def summary(self):
+        """One-line description of the stage's throughput"""
+        snap = self.snapshot()
+        return (f"{self.stage}: {snap['total_bytes'] / (1024 * 1024):.1f} MB in {snap['active_seconds']:.0f}s active | "
+                f"avg {snap['average_mbps']:.2f} Mbps | p10/p50/p90 {snap['p10_mbps']:.2f}/"
+                f"{snap['p50_mbps']:.2f}/{snap['p90_mbps']:.2f} Mbps")
+
+_estimators = {}
+_estimators_lock = threading.Lock()
+
+def get_estimator(stage):
+    """Get the process-wide estimator for a stage, creating it on first use"""
+    with _estimators_lock:
+        if stage not in _estimators:
+            _estimators[stage] = ThroughputEstimator(stage)
+        return _estimators[stage]
+
+def report():
+    """Print the throughput of every stage that moved data"""
+    with _estimators_lock:
+        estimators = list(_estimators.values())
+    estimators = [estimator for estimator in estimators if estimator.total_bytes]
+    if not estimators:
+        return
+    print("📈 Throughput:")
+    for estimator in estimators:
+        print(f"  {estimator.summary()}")
@@ -0,0 +1,46 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import downen
+
+def run_in_pool(pool, job):
+    """Run job(pool) as a pool job (finalize_episode stubbed) and return its result"""
+    original = downen.finalize_episode
+    downen.finalize_episode = lambda *args, **kwargs: job(kwargs['transcode_pool'])
+    try:
+        return pool.submit('movie.mkv', 1, 'Series').result(timeout=10)
+    finally:
+        downen.finalize_episode = original
+
+def test_idle_pool_lends_its_threads_to_a_long_encode():
+    pool = downen.TranscodePool(workers=4, threads_per_job=2)
+    try:
+        def job(transcode_pool):
+            threads = transcode_pool.borrow_threads()
+            try:
+                return downen.get_chunk_layout(threads)
+            finally:
+                transcode_pool.return_threads(threads)
+
+        workers, chunk_threads = run_in_pool(pool, job)
+        assert workers * chunk_threads > pool.threads_per_job
+        assert workers * chunk_threads == pool.threads_per_job * pool.workers
+        assert pool.slots_in_use == 0
+    finally:
+        pool.shutdown()
+
+def test_busy_pool_keeps_the_job_to_its_share():
+    pool = downen.TranscodePool(workers=4, threads_per_job=2)
+    try:
+        with pool.lock:
+            pool.queued += 1    # Another episode waiting for a worker
+        try:
+            threads = run_in_pool(pool, lambda transcode_pool: transcode_pool.borrow_threads())
+        finally:
+            with pool.lock:
+                pool.queued -= 1
+        assert threads == pool.threads_per_job
+    finally:
+        pool.shutdown()